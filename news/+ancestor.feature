@@ -0,0 +1,3 @@
+Redirect paths below an object with a redirect, at any depth, by appending the rest of the path to its new path.
+This helps after importing redirects for folders only.
+The lookup needs one lookup per level of the path, independent of the number of redirects.
@@ -0,0 +1,3 @@
+Add an optional Bloom filter of all old paths to the redirection storage.
+Looking up a path without a redirect then usually does not load any buckets.
+Use ``storage.enable_bloom_filter(capacity, error_rate)`` and ``storage.bloom_filter_info()``.
@@ -0,0 +1,4 @@
+Make ``RedirectionStorage.update`` much faster for large imports:
+the redirects are resolved in memory and written to the BTrees in sorted passes,
+with the same result as calling ``add`` for each item.
+Loading new redirects into a storage is about five times faster than adding them one by one.
@@ -0,0 +1,4 @@
+Add opt-in ``compact_values`` to the redirection storage.
+New redirects are then stored as ``(new_path, stamp)``,
+with the date in microseconds since the epoch and the manual flag in the lowest bit.
+This avoids creating and pickling a ``DateTime`` for each redirect.
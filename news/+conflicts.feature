@@ -0,0 +1,2 @@
+Resolve more conflicts between concurrent changes of the redirection storage.
+Prefixes get numbers from a hash when interning, and transactions that only create different independent trees of the storage, like the subtree redirects or the removal queue, are combined.
@@ -0,0 +1,2 @@
+Add optional indexes on the date and manual flag of redirects, see ``enable_date_index``.
+``items_by_date`` and ``manual_redirects`` give pages of the newest or the manual redirects, reading only the redirects on the page.
@@ -0,0 +1 @@
+Record the redirects of moved objects when the transaction commits, in one batch, instead of on each move event.
@@ -0,0 +1,2 @@
+Add ``destroy_many`` to the redirection storage.
+Removing a folder now destroys the redirects to all its items at once, when the transaction commits.
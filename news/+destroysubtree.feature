@@ -0,0 +1,2 @@
+Add ``destroy_subtree`` to the redirection storage.
+When a folder is removed, the redirects to all paths below it are destroyed at once, also those to paths that are not content, like views of an item in it.
@@ -0,0 +1,2 @@
+Add ``RedirectionStorage.export_rows`` to export all redirects lazily as
+``(old_path, new_path, date, manual)`` rows, in pages with a resumable cursor.
@@ -0,0 +1,4 @@
+Add optional hit tracking to the redirection storage, see ``enable_hit_tracking``.
+The 404 view counts the hits of the redirects it serves in memory, and regularly writes the counts in a transaction of its own.
+Hits of a subtree redirect are counted for its old prefix, and hits of a rule for its pattern, so paths that crawlers try do not each get an entry.
+``prune`` can keep redirects with recent hits with its new ``hit_since`` argument.
@@ -0,0 +1,2 @@
+Add ``iter_redirects`` and ``count_redirects`` to the redirection storage.
+Moving a path that many redirects point to no longer copies the set of those redirects.
@@ -0,0 +1,3 @@
+Add ``RedirectionStorage.import_rows`` to import redirects from any iterable of rows, like a csv reader,
+in chunks with a transaction savepoint or commit after each chunk.
+It reports progress and can resume an interrupted import.
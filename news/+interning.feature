@@ -0,0 +1,2 @@
+Add an optional mode that stores the prefixes of paths only once, see ``RedirectionStorage.enable_interning``.
+This makes the database and the memory used by the ZODB cache smaller.
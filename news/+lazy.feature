@@ -0,0 +1,2 @@
+Add an optional mode that stores chains of redirects lazily, see ``RedirectionStorage.enable_lazy_chains``.
+Moving content that many old paths redirect to then only stores one redirect.
@@ -0,0 +1,3 @@
+Keep the number of redirects in a conflict-resolving ``Length`` counter,
+so ``len(storage)`` no longer loads all buckets of the storage.
+Existing storages keep working and can be migrated with ``storage._migrate_length()``.
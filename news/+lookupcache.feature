@@ -0,0 +1,4 @@
+Cache the outcome of redirect lookups for 404 pages in a per-process LRU cache,
+also when there is no redirect.
+Every change to the redirection storage invalidates the cache.
+Set environment variable ``PLONE_APP_REDIRECTOR_CACHE_SIZE`` to change its size (default 10000, 0 disables it).
@@ -0,0 +1,2 @@
+Add ``RedirectionStorage._migrate_values`` to convert all stored redirects to the compact format in one pass.
+Afterwards, reading redirects no longer checks which format each value has.
@@ -0,0 +1,3 @@
+Cache the nearest existing parent of missing paths on 404 pages per user, for ``PLONE_APP_REDIRECTOR_PARENT_CACHE_TTL`` seconds (default 60).
+Moving or removing content clears the cache, and ``PLONE_APP_REDIRECTOR_PARENT_CACHE_SIZE`` sets its size (default 10000, 0 disables it).
+The friendly types are computed only once per 404 page.
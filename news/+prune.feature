@@ -0,0 +1,2 @@
+Add ``prune`` to the redirection storage.
+It removes automatic redirects older than a date in batches, with a savepoint or commit after each batch, optionally keeping redirects that a ``keep`` callable selects.
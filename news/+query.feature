@@ -0,0 +1,2 @@
+Add ``items_from`` and ``targets_under`` to the redirection storage.
+They give the redirects from or to the paths below a prefix, optionally filtered on date and manual, without reading all redirects.
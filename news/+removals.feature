@@ -0,0 +1,2 @@
+Add an optional queue for removed paths, see ``RedirectionStorage.enable_removal_queue``.
+Deleting content then no longer has to wait for its redirects to be removed.
@@ -0,0 +1,4 @@
+Add ``resolve`` to the storage, which tries the query string, path, view, template and rule candidates of a path that was not found in one call, and tells which one matched.
+The 404 view uses it, so the parent is looked up only once.
+``IRedirectionStorage`` now declares the methods that the storage gained, like ``resolve``, ``import_rows``, ``prune`` and the ``enable_*`` options, and the new ``version`` and ``tracks_hits`` methods that the 404 view uses.
+The 404 view no longer looks for them with ``getattr``, so a custom storage must provide them.
@@ -0,0 +1,3 @@
+Add redirect rules with a prefix, glob or regex pattern, see ``add_rule``.
+The 404 view uses them for paths without a redirect.
+The rules are indexed by the literal start of their pattern, so only the rules that can match a path are tried.
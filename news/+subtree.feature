@@ -0,0 +1,4 @@
+Add subtree redirects: one redirect for everything below an old prefix, see ``RedirectionStorage.add_subtree``.
+Lookups of paths in an old folder use the longest matching prefix.
+Set ``subtree_moves`` on the storage to store one subtree redirect when a folder is moved or renamed, instead of a redirect for each item in it.
+Items then only get their own redirect when they are moved again later, and are not listed by ``redirects``.
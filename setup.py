@@ -38,6 +38,8 @@ setup(
         "Products.CMFCore",
         "Products.ZCatalog",
         "persistent",
+        "transaction",
+        "ZODB",
     ],
     extras_require={
         "test": [
@@ -0,0 +1,108 @@
+from hashlib import blake2b
+from math import ceil
+from math import exp
+from math import log
+from persistent import Persistent
+
+# Number of bits in one block of the filter.  All bits for one key are
+# in the same block, so adding a key changes only one persistent object.
+BLOCK_BITS = 8 * 8192
+
+
+class _Block(Persistent):
+    """Part of the bits of a BloomFilter."""
+
+    def __init__(self, size):
+        self.bits = bytearray(size // 8)
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        # Bits are only ever set, so we can combine both changes.
+        committed = committed_state["bits"]
+        new = new_state["bits"]
+        bits = int.from_bytes(committed, "little") | int.from_bytes(new, "little")
+        state = dict(new_state)
+        state["bits"] = bytearray(bits.to_bytes(len(new), "little"))
+        return state
+
+
+class BloomFilter(Persistent):
+    """A set of strings that can give false positives, but not false negatives.
+
+    When a string is not in the filter, it has certainly never been added.
+    When it is in the filter, it was added, or it is a false positive.
+    The chance of false positives stays below error_rate as long as no more
+    than capacity strings are added.  Strings cannot be removed.
+
+    This is a blocked Bloom filter: the bits are divided over blocks, and all
+    bits of one string are in the same block.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        bits = ceil(-capacity * log(error_rate) / (log(2) ** 2))
+        self.hash_count = max(1, round(bits / capacity * log(2)))
+        block_count = ceil(bits / BLOCK_BITS)
+        # Small filters need no full blocks.  Keep a multiple of 64 bits.
+        self.block_bits = min(BLOCK_BITS, ceil(bits / 64) * 64)
+        self.blocks = tuple(_Block(self.block_bits) for i in range(block_count))
+
+    def _hash(self, key):
+        # Python's own hash differs between processes, so we cannot use it.
+        digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        value = int.from_bytes(digest, "little")
+        block = self.blocks[(value >> 64) % len(self.blocks)]
+        # Use double hashing to get the positions of the bits.
+        first = value & 0xFFFFFFFF
+        step = (value >> 32) & 0xFFFFFFFF | 1
+        return block, first, step
+
+    def add(self, key):
+        block, position, step = self._hash(key)
+        bits = block.bits
+        size = self.block_bits
+        changed = False
+        for i in range(self.hash_count):
+            index = position % size
+            mask = 1 << (index & 7)
+            if not bits[index >> 3] & mask:
+                bits[index >> 3] |= mask
+                changed = True
+            position += step
+        if changed:
+            block._p_changed = True
+
+    def __contains__(self, key):
+        block, position, step = self._hash(key)
+        bits = block.bits
+        size = self.block_bits
+        for i in range(self.hash_count):
+            index = position % size
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+            position += step
+        return True
+
+    def info(self, count=None):
+        """Report the configuration and memory use.
+
+        Pass the number of strings that have been added as count,
+        to get an estimate of the current false positive rate.
+        """
+        bits = self.block_bits * len(self.blocks)
+        result = {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "hash_count": self.hash_count,
+            "blocks": len(self.blocks),
+            "bytes": bits // 8,
+        }
+        if count is not None:
+            result["estimated_error_rate"] = (
+                1 - exp(-self.hash_count * count / bits)
+            ) ** self.hash_count
+        return result
@@ -1,5 +1,9 @@
+from AccessControl import getSecurityManager
 from Acquisition import aq_base
 from Acquisition import aq_inner
+from plone.app.redirector.cache import lookup_cache
+from plone.app.redirector.cache import parent_cache
+from plone.app.redirector.hits import record_hit
 from plone.app.redirector.interfaces import IFourOhFourView
 from plone.app.redirector.interfaces import IRedirectionPolicy
 from plone.app.redirector.interfaces import IRedirectionStorage
@@ -20,6 +24,8 @@ import logging
 
 logger = logging.getLogger("plone.app.redirector")
 
+_marker = object()
+
 
 @implementer(IFourOhFourView)
 class FourOhFourView(BrowserView):
@@ -37,31 +43,29 @@ class FourOhFourView(BrowserView):
         if storage is None:
             return False
 
-        old_path = "/".join(old_path_elements)
-
-        # First lets try with query string in cases or content migration
-
-        new_path = None
-
         query_string = self.request.QUERY_STRING
-        if query_string:
-            new_path = storage.get(f"{old_path}?{query_string}")
-            # if we matched on the query_string we don't want to include it
-            # in redirect
-            if new_path:
-                query_string = ""
 
-        if not new_path:
-            new_path = storage.get(old_path)
-
-        if not new_path:
-            new_path = self.find_redirect_if_view(old_path_elements, storage)
-
-        if not new_path:
-            new_path = self.find_redirect_if_template(url, old_path_elements, storage)
+        # Bots ask for the same missing urls over and over,
+        # so we cache the outcome, also when there is no redirect.
+        result = cache_key = None
+        version = storage.version()
+        if version is not None:
+            cache_key = (
+                version,
+                "/".join(old_path_elements),
+                query_string,
+                url.split("/")[-1],
+            )
+            result = lookup_cache.get(cache_key)
+        if result is None:
+            result = self._find_new_path(url, old_path_elements, storage, query_string)
+            if cache_key is not None:
+                lookup_cache.set(cache_key, result)
+        new_path, query_string, hit_path = result
 
         if not new_path:
             return False
+        record_hit(storage, hit_path)
 
         url = urlsplit(new_path)
         if url.netloc:
@@ -89,6 +93,21 @@ class FourOhFourView(BrowserView):
         self.request.response.redirect(url, status=status, lock=1)
         return True
 
+    def _find_new_path(self, url, old_path_elements, storage, query_string):
+        """Find the new path in the storage.
+
+        Returns a tuple: the new path (or None), the query string
+        that should still be added to the url of the new path, and what
+        the hit is counted for: the old path of the redirect that was used,
+        or the old prefix or pattern that matched, see
+        IRedirectionStorage.resolve.
+        """
+        template_id = unquote(url.split("/")[-1])
+        new_path, query_string, kind, hit_path = storage.resolve(
+            old_path_elements, query_string, template_id
+        )
+        return new_path, query_string, hit_path
+
     def find_redirect_if_view(self, old_path_elements, storage):
         """find redirect for urls like http://example.com/object/@@view/part."""
         if len(old_path_elements) <= 1:
@@ -138,16 +157,42 @@ class FourOhFourView(BrowserView):
             (aq_inner(self.context), self.request), name="plone_portal_state"
         )
         portal = portal_state.portal()
+        friendly_types = self._friendly_types()
+        # Broken urls below the same missing folder have the same parent.
+        # We cache the path where it was found for each path we tried.  The
+        # user is part of the key, as it may not see the same objects.
+        user_id = getSecurityManager().getUser().getId()
+        tried = []
+        found = found_path = None
         for i in range(len(path_elements) - 1, 0, -1):
-            obj = portal.restrictedTraverse("/".join(path_elements[:i]), None)
-            if obj is not None:
-                # Skin objects acquire portal_type from the Plone site
-                if (
-                    getattr(aq_base(obj), "portal_type", None)
-                    in portal_state.friendly_types()
-                ):
+            path = "/".join(path_elements[:i])
+            cached = parent_cache.get((user_id, path), _marker)
+            if cached is None:
+                # No parent at or above path.
+                break
+            if cached is not _marker:
+                obj = portal.restrictedTraverse(cached, None)
+                if obj is not None and self._is_friendly(obj, friendly_types):
                     return obj
-        return None
+            tried.append(path)
+            obj = portal.restrictedTraverse(path, None)
+            if obj is not None and self._is_friendly(obj, friendly_types):
+                found, found_path = obj, path
+                break
+        for path in tried:
+            parent_cache.set((user_id, path), found_path)
+        return found
+
+    def _is_friendly(self, obj, friendly_types):
+        # Skin objects acquire portal_type from the Plone site
+        return getattr(aq_base(obj), "portal_type", None) in friendly_types
+
+    @memoize
+    def _friendly_types(self):
+        portal_state = getMultiAdapter(
+            (aq_inner(self.context), self.request), name="plone_portal_state"
+        )
+        return portal_state.friendly_types()
 
     def search_for_similar(self):
         path_elements = self._path_elements()
@@ -170,7 +215,7 @@ class FourOhFourView(BrowserView):
                     result_set = portal_catalog(
                         SearchableText=element,
                         path=navroot,
-                        portal_type=portal_state.friendly_types(),
+                        portal_type=self._friendly_types(),
                         sort_limit=10,
                     )
                     if result_set:
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from threading import Lock
+
+import os
+import time
+
+# Maximum number of lookups that are cached per process.
+# Set the environment variable to 0 to disable the cache.
+CACHE_SIZE = int(os.environ.get("PLONE_APP_REDIRECTOR_CACHE_SIZE", 10000))
+
+# Maximum number of nearest parents of missing paths that are cached per
+# process, and the number of seconds they are kept.
+PARENT_CACHE_SIZE = int(os.environ.get("PLONE_APP_REDIRECTOR_PARENT_CACHE_SIZE", 10000))
+PARENT_CACHE_TTL = float(os.environ.get("PLONE_APP_REDIRECTOR_PARENT_CACHE_TTL", 60))
+
+
+class LRUCache:
+    """A thread safe mapping that forgets the least recently used keys.
+
+    Zope serves requests in several threads, so all access is locked.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """An LRUCache that also forgets keys after ttl seconds."""
+
+    def __init__(self, size, ttl, clock=time.monotonic):
+        super().__init__(size)
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= self.clock():
+            return default
+        return value
+
+    def set(self, key, value):
+        super().set(key, (self.clock() + self.ttl, value))
+
+
+# Results of FourOhFourView lookups in the redirection storage.
+lookup_cache = LRUCache(CACHE_SIZE)
+
+# Nearest existing parents of missing paths, see
+# FourOhFourView.find_first_parent.  Content can be added, moved and
+# removed without a change in the redirection storage, so unlike
+# lookup_cache this has no version.  The subscribers clear it when content
+# is moved or removed in this process, the ttl takes care of the rest.
+parent_cache = TTLCache(PARENT_CACHE_SIZE, PARENT_CACHE_TTL)
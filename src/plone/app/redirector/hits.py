@@ -0,0 +1,117 @@
+from threading import Lock
+from time import time
+from ZODB.POSException import ConflictError
+
+import logging
+import os
+import transaction
+
+logger = logging.getLogger("plone.app.redirector")
+
+# Seconds between writing the buffered hits of a process to the database.
+FLUSH_INTERVAL = int(os.environ.get("PLONE_APP_REDIRECTOR_HITS_FLUSH_INTERVAL", 300))
+
+# Number of buffered paths after which we write them before the interval.
+FLUSH_SIZE = int(os.environ.get("PLONE_APP_REDIRECTOR_HITS_FLUSH_SIZE", 10000))
+
+# Number of times we try to write the hits when there are conflicts.
+FLUSH_ATTEMPTS = 3
+
+
+class HitBuffer:
+    """Count the hits of redirects in memory.
+
+    The 404 view records a hit for each redirect that it serves.  Writing
+    that to the database on each request would give conflicts between all
+    requests for popular redirects, so we only count in memory, and
+    regularly write the counts of all paths at once, see flush_hits.
+
+    Zope serves requests in several threads, so all access is locked.
+    """
+
+    def __init__(self):
+        # old path -> (number of hits, time of the last hit in microseconds)
+        self._data = {}
+        self._lock = Lock()
+        self.flushed = time()
+
+    def record(self, old_path, micros=None):
+        if micros is None:
+            micros = int(time() * 1000000)
+        with self._lock:
+            count, last = self._data.get(old_path, (0, 0))
+            self._data[old_path] = (count + 1, max(last, micros))
+
+    def restore(self, hits):
+        """Add hits that we could not write back to the buffer."""
+        with self._lock:
+            for old_path, (count, micros) in hits.items():
+                old_count, last = self._data.get(old_path, (0, 0))
+                self._data[old_path] = (old_count + count, max(last, micros))
+
+    def due(self):
+        """Is it time to write the hits?"""
+        return len(self._data) >= FLUSH_SIZE or time() - self.flushed >= FLUSH_INTERVAL
+
+    def drain(self):
+        """Get all buffered hits, and empty the buffer."""
+        with self._lock:
+            hits = self._data
+            self._data = {}
+            self.flushed = time()
+        return hits
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Hits of the redirects that this process has served.
+hit_buffer = HitBuffer()
+
+
+def record_hit(storage, old_path):
+    """Count a hit of the redirect from old_path, if the storage tracks hits.
+
+    Writes the buffered hits when that is due.
+    """
+    if not storage.tracks_hits():
+        return
+    hit_buffer.record(old_path)
+    if hit_buffer.due():
+        flush_hits(storage)
+
+
+def flush_hits(storage, buffer=hit_buffer):
+    """Write the buffered hits to the redirection storage.
+
+    When the storage is in a database, this uses its own connection and
+    transaction, so the hits are written even when the transaction of the
+    request is aborted, as it is for a 404.  On conflicts we try again,
+    and after FLUSH_ATTEMPTS the hits go back to the buffer.
+
+    Returns the number of paths that were written.
+    """
+    hits = buffer.drain()
+    if not hits:
+        return 0
+    jar = storage._p_jar
+    if jar is None:
+        storage.record_hits(hits)
+        return len(hits)
+    manager = transaction.TransactionManager()
+    connection = jar.db().open(transaction_manager=manager)
+    try:
+        for attempt in range(FLUSH_ATTEMPTS):
+            manager.begin()
+            try:
+                connection.get(storage._p_oid).record_hits(hits)
+                manager.commit()
+                return len(hits)
+            except ConflictError:
+                manager.abort()
+    finally:
+        manager.abort()
+        connection.close()
+    logger.info("Could not write the hits of %d redirects, will retry.", len(hits))
+    buffer.restore(hits)
+    return 0
@@ -43,8 +43,20 @@ class IRedirectionStorage(Interface):
     """A storage for items where the old and the new location are known.
 
     Will be registered as a local utility.
+
+    Besides redirects of single paths, the storage can have subtree
+    redirects: one redirect for everything below an old prefix.  The
+    objectMoved subscriber only adds them when subtree_moves is true.
     """
 
+    subtree_moves = Attribute(
+        "When true, moving a folder stores one subtree redirect for all its "
+        "contents, instead of a redirect for each item in it.  Those items "
+        "are then not listed by redirects or when iterating, and get and "
+        "has_path answer for any path below the old folder.  False by "
+        "default."
+    )
+
     def add(old_path, new_path):
         """Remember that the object at old_path is now at new_path.
 
@@ -62,20 +74,282 @@ class IRedirectionStorage(Interface):
         """
 
     def has_path(old_path):
-        """Determine if there are any redirects from old_path in effect."""
+        """Determine if there are any redirects from old_path in effect.
+
+        This includes the subtree redirects.
+        """
 
     def get(old_path, default=None):
         """Get the new path to the object that used to be at old_path.
 
         Will return the default value (None, unless set otherwise) if old_path
-        is not found.
+        is not found.  When old_path has no redirect of its own, the subtree
+        redirect with the longest matching old prefix is used.
         """
 
     def redirects(new_path):
         """Get a list of paths that redirect to new_path.
 
         Will return an empty list if nothing redirects to new_path.
+        Subtree redirects are not included.
         """
 
     def __iter__():
-        """Iterate over all existing paths."""
+        """Iterate over all existing paths.
+
+        Subtree redirects are not included.
+        """
+
+    def iter_redirects(new_path):
+        """Iterate over the old paths that redirect to new_path, in order.
+
+        Like redirects, without copying them into a list first.
+        """
+
+    def count_redirects(new_path):
+        """Get the number of old paths that redirect to new_path."""
+
+    def resolve(path_elements, query_string="", template_id=None):
+        """Find where a path that was not found should redirect to.
+
+        This is what the 404 view needs, in one call.  It tries the path
+        with the query string, the path itself, the parent of a view or
+        template, the nearest ancestor with a redirect, and the rules.
+
+        Returns (new_path, query_string, kind, source).  kind says which
+        of these matched: "query", "path", "view", "template", "ancestor"
+        or "rule".  source is what the hit is counted for: the old path of
+        the redirect that was used, the old prefix of a subtree redirect,
+        or the pattern of a rule.  The query string is empty when it was
+        part of the old path.  When nothing matches, new_path, kind and
+        source are None.
+        """
+
+    def version():
+        """Get a key for the committed state of the redirects.
+
+        The 404 view caches lookups with it.  Returns None when the storage
+        is not in a database, or has changes that are not committed yet.
+        """
+
+    # Deferred changes, for the subscribers.
+
+    def add_deferred(old_path, new_path):
+        """Add a redirect just before the current transaction is committed.
+
+        The result is the same as calling add for each redirect in the
+        same order.  When the transaction is aborted, or a savepoint from
+        before it is rolled back, the redirect is forgotten.
+        """
+
+    def destroy_deferred(new_path, subtree=False):
+        """Destroy the redirects to new_path before the transaction commits.
+
+        With subtree, this is destroy_subtree instead of destroy.
+        """
+
+    def has_redirect(old_path, new_path):
+        """Does old_path redirect to new_path, with the deferred redirects?
+
+        This may answer False when the deferred redirects could change the
+        answer.
+        """
+
+    # Subtree redirects.
+
+    def add_subtree(old_prefix, new_prefix, now=None, manual=False):
+        """Remember that everything below old_prefix is now below new_prefix."""
+
+    def remove_subtree(old_prefix):
+        """Forget the subtree redirect for old_prefix.
+
+        Raises a KeyError when there is none.
+        """
+
+    def get_subtree(old_prefix, default=None):
+        """Get the new prefix of the subtree redirect for old_prefix."""
+
+    def subtrees():
+        """Get a list of (old prefix, new prefix) of all subtree redirects."""
+
+    def destroy_many(new_paths):
+        """Destroy the redirects to all of new_paths."""
+
+    def destroy_subtree(prefix):
+        """Destroy the redirects to prefix and to all paths below it."""
+
+    # Rules.
+
+    def add_rule(pattern, target, kind="prefix"):
+        """Add a redirect rule, or replace the rule with the same pattern.
+
+        kind is "prefix", "glob" or "regex".  Rules are only used for paths
+        without a redirect.  Raises a ValueError for an invalid rule.
+        """
+
+    def remove_rule(pattern):
+        """Forget the rule with pattern.
+
+        Raises a KeyError when there is none.
+        """
+
+    def rules():
+        """Get a list of (pattern, target, kind) of all rules."""
+
+    def match_rule(path):
+        """Get the new path for path from the rules, or None."""
+
+    # Bulk import and export, and queries for management pages.  The rows
+    # are (old_path, new_path, date, manual).
+
+    def import_rows(
+        rows, chunk_size=10000, commit=False, progress=None, start=0, manual=True
+    ):
+        """Import redirects from an iterable of rows, in chunks.
+
+        The date and manual flag of a row are optional.  After each chunk
+        we take a savepoint, or commit when commit is true.  progress is
+        called after each chunk with the number of rows done and the rate.
+        Pass the number of rows done as start to resume an import.
+
+        Returns the number of rows done.
+        """
+
+    def export_rows(cursor=None, limit=None):
+        """Yield rows of all redirects in old path order.
+
+        Pass the old path of the last row you have seen as cursor to
+        continue after it, and a limit to get at most that many rows.
+        """
+
+    def items_from(prefix, start=None, end=None, manual=None):
+        """Get the rows of the redirects from prefix and from below it.
+
+        With start and/or end, only rows with a date in that range are
+        included.  With manual True or False, only rows with that flag.
+        """
+
+    def targets_under(prefix, start=None, end=None, manual=None):
+        """Get the rows of the redirects to prefix and to below it.
+
+        They are ordered by new path and then old path.  The other
+        arguments filter the rows, see items_from.
+        """
+
+    def items_by_date(start=None, end=None, manual=None, cursor=None, limit=None):
+        """Get the rows of the redirects with a date, the newest first.
+
+        The filters are those of items_from.  Pass the last row you have
+        seen as cursor to get the rows after it, and a limit to get a page.
+        """
+
+    def manual_redirects(cursor=None, limit=None):
+        """Get the rows of the manual redirects, in old path order.
+
+        cursor and limit are those of export_rows.
+        """
+
+    def prune(
+        before,
+        batch_size=1000,
+        commit=False,
+        keep=None,
+        progress=None,
+        hit_since=None,
+    ):
+        """Remove the automatic redirects with a date before the given date.
+
+        Manual redirects, redirects without a date, and redirects for
+        which keep returns true when called with the old path are kept.
+        With hit tracking, so are those with a hit since hit_since.  After
+        each batch we take a savepoint, or commit when commit is true.
+
+        Returns the number of removed redirects.
+        """
+
+    # Hit tracking.
+
+    def tracks_hits():
+        """Is hit tracking enabled?"""
+
+    def record_hits(hits):
+        """Add hits to the stored hits.
+
+        hits is a mapping of source, see resolve, to (number of hits, time
+        of the last hit in microseconds since the epoch).  Nothing is
+        stored when hit tracking is not enabled.
+        """
+
+    def get_hits(old_path):
+        """Get (number of hits, date of the last hit) of a redirect.
+
+        old_path can also be the old prefix of a subtree redirect, or the
+        pattern of a rule.  The date is None when there were no hits.
+        """
+
+    def iter_hits(cursor=None, limit=None):
+        """Yield (source, number of hits, date of the last hit) rows.
+
+        cursor and limit are those of export_rows.
+        """
+
+    # The removal queue.
+
+    def pending_removals():
+        """Get the number of queued removals, see enable_removal_queue."""
+
+    def process_removals(limit=None):
+        """Destroy the redirects to at most limit queued paths.
+
+        Returns the number of processed paths.
+        """
+
+    # Options.
+
+    def enable_lazy_chains():
+        """Let add only store the new hop of a chain of redirects."""
+
+    def disable_lazy_chains():
+        """Compact all chains, and let add update them again."""
+
+    def compact_chains(limit=None):
+        """Let redirects through at most limit hops skip them.
+
+        Returns the number of processed hops.
+        """
+
+    def enable_date_index():
+        """Keep indexes on the date and the manual flag of the redirects."""
+
+    def disable_date_index():
+        """Drop the indexes on the date and the manual flag."""
+
+    def enable_hit_tracking():
+        """Count the hits of each redirect, and remember the last one."""
+
+    def disable_hit_tracking():
+        """Stop counting hits, and forget them."""
+
+    def enable_removal_queue():
+        """Let destroy only queue the path, see process_removals."""
+
+    def disable_removal_queue():
+        """Process all queued removals, and let destroy work directly."""
+
+    def enable_bloom_filter(capacity=None, error_rate=0.01):
+        """Keep a Bloom filter of all old paths, for faster misses."""
+
+    def disable_bloom_filter():
+        """Drop the Bloom filter."""
+
+    def bloom_filter_info():
+        """Report the configuration and memory use of the Bloom filter.
+
+        Returns None when there is no filter.
+        """
+
+    def enable_interning():
+        """Store the prefixes of paths only once."""
+
+    def disable_interning():
+        """Store paths as strings again."""
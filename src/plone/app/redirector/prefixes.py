@@ -0,0 +1,75 @@
+from BTrees.IOBTree import IOBTree
+from BTrees.OIBTree import OIBTree
+from hashlib import blake2b
+from persistent import Persistent
+
+# Highest number of a prefix.
+MAX_ID = 2**31 - 1
+
+
+class PathPrefixes(Persistent):
+    """Numbers for the parent paths of paths.
+
+    A path like "/plone/en/news/item" is encoded as bytes: four bytes with
+    the number of its prefix "/plone/en/news/", followed by its last segment
+    in UTF-8: b"\\x00\\x00\\x00\\x0citem".  All paths in a folder share the
+    same number, so the long prefix takes only four bytes per path, both in
+    a pickle and in memory.  Encoding and decoding needs one lookup, and
+    only new folders need a new number.  Paths in the same folder sort
+    together.
+
+    Prefixes are never removed, so a number always means the same prefix.
+    The number of a new prefix comes from a hash of it, or the next free
+    number on a collision.  So two transactions that add different prefixes
+    at the same time add different keys, and the BTrees can resolve that
+    conflict.  New folders are also spread over the buckets of the BTrees
+    of a RedirectionStorage, instead of all being added at the end.
+    """
+
+    def __init__(self):
+        # prefix -> number
+        self._ids = OIBTree()
+        # number -> prefix
+        self._names = IOBTree()
+
+    def __len__(self):
+        return len(self._names)
+
+    def encode(self, path, create=False):
+        """Get the bytes for a path.
+
+        When the prefix is unknown, we add it if create is true.
+        Otherwise we return None: such a path cannot be stored anywhere.
+        """
+        index = path.rfind("/") + 1
+        prefix = path[:index]
+        prefix_id = self._ids.get(prefix)
+        if prefix_id is None:
+            if not create:
+                return None
+            prefix_id = self._add(prefix)
+        return prefix_id.to_bytes(4, "big") + path[index:].encode("utf-8")
+
+    def decode(self, key):
+        """Get the path for bytes that we have encoded."""
+        return self._names[int.from_bytes(key[:4], "big")] + key[4:].decode("utf-8")
+
+    def key_ranges(self, prefix):
+        """Get the ranges of the encoded paths below prefix.
+
+        Yields (min, max) tuples, where min is included and max is not.
+        """
+        ids = self._ids.values(min=prefix + "/", max=prefix + "0", excludemax=True)
+        for prefix_id in ids:
+            yield prefix_id.to_bytes(4, "big"), (prefix_id + 1).to_bytes(4, "big")
+
+    def _add(self, prefix):
+        names = self._names
+        digest = blake2b(prefix.encode("utf-8"), digest_size=4).digest()
+        # IOBTree keys are signed 32 bit integers.
+        prefix_id = int.from_bytes(digest, "big") & MAX_ID
+        while prefix_id in names:
+            prefix_id = prefix_id + 1 & MAX_ID
+        names[prefix_id] = prefix
+        self._ids[prefix] = prefix_id
+        return prefix_id
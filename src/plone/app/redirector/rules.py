@@ -0,0 +1,222 @@
+from persistent import Persistent
+
+import re
+
+# The kinds of rules, see RedirectRules.add.
+KINDS = ("prefix", "glob", "regex")
+
+# Characters that end the literal start of a regular expression.
+_SPECIAL = set(".^$*+?{}[]|()")
+
+
+class RedirectRules(Persistent):
+    """Redirect rules with patterns, for paths without an exact redirect.
+
+    The rules are stored in one dictionary, as they are changed rarely and
+    all of them are needed to match a path.  Each connection puts them in a
+    RuleMatcher once, until they change.
+    """
+
+    def __init__(self):
+        # pattern -> (kind, target)
+        self._rules = {}
+
+    def add(self, pattern, target, kind="prefix"):
+        """Add a rule, or replace the rule with the same pattern.
+
+        A prefix rule redirects the pattern itself to the target, and the
+        paths below it to the same paths below the target.  A glob rule
+        matches the whole path, where "*" matches any characters except a
+        slash, "**" any characters, and "?" one character except a slash.
+        A regex rule matches the whole path with a regular expression.  For
+        glob and regex rules, the target can use the matched groups, like
+        "\\1", where each wildcard of a glob is a group.
+
+        Raises a ValueError for an unknown kind, an invalid regular
+        expression, or a target that uses a group the pattern does not have.
+        """
+        rule = _compile(pattern, target, kind)
+        if rule.regex is not None:
+            try:
+                regex = re.compile(rule.regex)
+            except re.error as e:
+                raise ValueError(f"Invalid pattern {pattern}: {e}")
+            try:
+                # This parses the target, also without a match.
+                regex.sub(target, "")
+            except (re.error, IndexError) as e:
+                # Python before 3.12 gives an IndexError for unknown names.
+                raise ValueError(f"Invalid target {target}: {e}")
+        self._rules[pattern] = (kind, target)
+        self._p_changed = True
+        self._v_matcher = None
+
+    def remove(self, pattern):
+        del self._rules[pattern]
+        self._p_changed = True
+        self._v_matcher = None
+
+    def items(self):
+        """Get a sorted list of (pattern, target, kind) of all rules."""
+        return [
+            (pattern, target, kind)
+            for pattern, (kind, target) in sorted(self._rules.items())
+        ]
+
+    def match(self, path):
+        """Get the new path of the best rule that matches path, or None."""
+        found = self.find(path)
+        return None if found is None else found[0]
+
+    def find(self, path):
+        """Get (new path, pattern) of the best rule that matches path, or None."""
+        matcher = getattr(self, "_v_matcher", None)
+        if matcher is None:
+            matcher = self._v_matcher = RuleMatcher(
+                _compile(pattern, target, kind)
+                for pattern, (kind, target) in self._rules.items()
+            )
+        return matcher.find(path)
+
+    def __contains__(self, pattern):
+        return pattern in self._rules
+
+    def __len__(self):
+        return len(self._rules)
+
+
+class RuleMatcher:
+    """Find the rules that may match a path, and apply them.
+
+    The rules are in a trie of the path segments at the literal start of
+    their pattern.  For a path we only walk its segments down the trie, and
+    try the rules on the way, so the time depends on the depth of the path
+    and the number of rules that share its start, not on all rules.  Rules
+    with a longer literal start are tried first.
+    """
+
+    def __init__(self, rules):
+        # segment -> child node, and None -> rules of this node
+        self._root = {}
+        for rule in rules:
+            node = self._root
+            for segment in rule.segments:
+                node = node.setdefault(segment, {})
+            node.setdefault(None, []).append(rule)
+        self._sort(self._root)
+
+    def _sort(self, node):
+        for key, value in node.items():
+            if key is None:
+                value.sort(key=lambda rule: (-len(rule.literal), rule.pattern))
+            else:
+                self._sort(value)
+
+    def find(self, path):
+        node = self._root
+        found = [node.get(None)]
+        for segment in path.split("/"):
+            node = node.get(segment)
+            if node is None:
+                break
+            found.append(node.get(None))
+        for rules in reversed(found):
+            if rules:
+                for rule in rules:
+                    new_path = rule.apply(path)
+                    if new_path is not None:
+                        return (new_path, rule.pattern)
+        return None
+
+
+class _Rule:
+    """A rule, with the regular expression compiled when it is first used.
+
+    Most rules are never tried in a process, so compiling them all would
+    only take time.
+    """
+
+    def __init__(self, pattern, target, literal, segments, regex=None):
+        self.pattern = pattern
+        self.target = target
+        # The literal start of every path that matches.
+        self.literal = literal
+        # The segments of the literal start that are complete.
+        self.segments = segments
+        self.regex = regex
+
+    def apply(self, path):
+        if self.regex is None:
+            # A prefix rule.
+            if path == self.pattern:
+                return self.target
+            if path.startswith(self.literal):
+                return self.target + path[len(self.pattern) :]
+            return None
+        if isinstance(self.regex, str):
+            self.regex = re.compile(self.regex)
+        match = self.regex.fullmatch(path)
+        if match is None:
+            return None
+        return match.expand(self.target)
+
+
+def _compile(pattern, target, kind):
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind of rule: {kind}")
+    if kind == "prefix":
+        pattern = pattern.rstrip("/")
+        return _Rule(pattern, target.rstrip("/"), pattern + "/", pattern.split("/"))
+    if kind == "glob":
+        regex = _glob_regex(pattern)
+        literal = _glob_literal(pattern)
+    else:
+        regex = pattern
+        literal = _regex_literal(pattern)
+    return _Rule(pattern, target, literal, literal.split("/")[:-1], regex)
+
+
+def _glob_regex(pattern):
+    """Translate a glob pattern into a regular expression."""
+    parts = re.split(r"(\*\*|\*|\?)", pattern)
+    wildcards = {"**": "(.*)", "*": "([^/]*)", "?": "([^/])"}
+    return "".join(wildcards.get(part) or re.escape(part) for part in parts)
+
+
+def _glob_literal(pattern):
+    index = min(
+        (i for i in (pattern.find("*"), pattern.find("?")) if i >= 0),
+        default=len(pattern),
+    )
+    return pattern[:index]
+
+
+def _regex_literal(pattern):
+    """Get the literal characters at the start of a regular expression."""
+    if "|" in pattern:
+        # An alternative may start with anything.
+        return ""
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    literal = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            escaped = pattern[index + 1 : index + 2]
+            if not escaped or escaped.isalnum():
+                # Like \d or \1, or a pattern that ends with a backslash.
+                break
+            literal.append(escaped)
+            index += 2
+            continue
+        if char in "?*{":
+            # The character before is optional or repeated.
+            if literal:
+                literal.pop()
+            break
+        if char in _SPECIAL:
+            break
+        literal.append(char)
+        index += 1
+    return "".join(literal)
@@ -1,12 +1,52 @@
+from BTrees.Length import Length
 from BTrees.OOBTree import OOBTree
 from BTrees.OOBTree import OOSet
+from BTrees.OOBTree import OOTreeSet
+from contextlib import contextmanager
 from DateTime import DateTime
+from itertools import groupby
+from itertools import islice
+from operator import itemgetter
 from persistent import Persistent
+from plone.app.redirector.bloom import BloomFilter
 from plone.app.redirector.interfaces import IRedirectionStorage
+from plone.app.redirector.prefixes import PathPrefixes
+from plone.app.redirector.rules import RedirectRules
+from time import time
+from transaction.interfaces import ISavepointDataManager
+from ZODB.POSException import ConflictError
 from zope.interface import implementer
 
+import gc
+import logging
+import transaction
+
+logger = logging.getLogger("plone.app.redirector")
+
 _marker = object()
 
+# Number of rows after which export_rows lets the ZODB cache shrink.
+EXPORT_GC_INTERVAL = 10000
+
+# Minimum number of rows of update or an import_rows chunk for which we
+# pause the cyclic garbage collector, see _gc_paused.
+GC_PAUSE_SIZE = 10000
+
+# Maximum number of hops that lookups follow in lazy chains.
+MAX_HOPS = 50
+
+# Attributes of the storage that old storages or disabled options lack, and
+# that start as a fresh tree or Length that no other attribute depends on.
+# A transaction may create them while another one creates another.
+_INDEPENDENT_ATTRIBUTES = frozenset(
+    ("_generation", "_subtrees", "_rsubtrees", "_removals", "_hits", "_rules")
+)
+
+# Redirects that are added or destroyed when the transaction commits,
+# see add_deferred and destroy_deferred:
+# transaction -> {storage: _DeferredChanges}
+_deferred = {}
+
 
 @implementer(IRedirectionStorage)
 class RedirectionStorage(Persistent):
@@ -22,24 +62,249 @@ class RedirectionStorage(Persistent):
     See test_storage.py for demonstrations of its usage.
     """
 
+    # Number of old paths, kept up to date so we do not have to walk all
+    # buckets of _paths.  Storages created before this existed have None,
+    # until _migrate_length or _rebuild is called.
+    _length = None
+
+    # Changed on every change, so caches can see that lookups may differ,
+    # see plone.app.redirector.cache.
+    _generation = None
+
+    # Optional BloomFilter of all old paths, see enable_bloom_filter.
+    _bloom = None
+
+    # Set this to True to store new redirects in a compact format:
+    # (new_path, stamp), where stamp has the date in microseconds since the
+    # epoch, shifted one bit to the left, and the manual flag in that bit.
+    # Creating and pickling this is much cheaper than a DateTime.
+    # get_full still gives a DateTime, but always in UTC.
+    compact_values = False
+
+    # Version of the values in _paths.
+    # 0: a value can be a new path (very old data), a tuple
+    #    (new_path, DateTime, manual), or a compact (new_path, stamp).
+    # 1: all values are compact, see _migrate_values.
+    _values_version = 0
+
+    # Optional PathPrefixes, see enable_interning.  When set, the keys and
+    # the paths in the values of _paths and _rpaths are bytes, with the
+    # number of the prefix and the last segment.
+    _prefixes = None
+
+    # Set this to True to let the objectMoved subscriber store one subtree
+    # redirect for a moved folder, instead of a redirect for each item in
+    # it, see add_subtree.  Moving a big folder is then much faster, but
+    # the items are not listed by redirects, iterating, len or
+    # export_rows, and get and has_path answer for any path below the old
+    # folder, also when nothing was there.
+    subtree_moves = False
+
+    # Optional subtree redirects, see add_subtree.  _subtrees has the old
+    # prefixes as keys, and values like in _paths, with the new prefix
+    # as string.  _rsubtrees has the new prefixes, with an OOSet of the
+    # old prefixes that point to them.
+    _subtrees = None
+    _rsubtrees = None
+
+    # Optional OOTreeSet of new paths that destroy has queued,
+    # see enable_removal_queue.
+    _removals = None
+
+    # Store chains of redirects lazily, see enable_lazy_chains.  _hops has
+    # the keys of old paths that other old paths may redirect to.
+    _lazy_chains = False
+    _hops = None
+
+    # Optional indexes, see enable_date_index.  _dates is an OOTreeSet of
+    # (-micros, key) for the old paths with a date, so the newest come
+    # first.  _manuals is an OOTreeSet of the keys of manual redirects.
+    _dates = None
+    _manuals = None
+
+    # Optional OOBTree of hits, see enable_hit_tracking: old path ->
+    # (number of hits, time of the last hit in microseconds since the epoch).
+    _hits = None
+
+    # Optional RedirectRules with patterns, see add_rule.
+    _rules = None
+
     def __init__(self):
         self.clear()
 
     def clear(self):
         # If the data already exists, we could call 'clear' on all BTrees,
         # but making them fresh seems cleaner and faster.
+        self._flush()
         self._paths = OOBTree()
         self._rpaths = OOBTree()
+        self._length = Length()
+        if self._bloom is not None:
+            self._bloom = BloomFilter(self._bloom.capacity, self._bloom.error_rate)
+        if self._prefixes is not None:
+            self._prefixes = PathPrefixes()
+        # Create these now, so add_subtree does not have to change us.
+        self._subtrees = OOBTree()
+        self._rsubtrees = OOBTree()
+        if self._removals is not None:
+            self._removals = OOTreeSet()
+        if self._hops is not None:
+            self._hops = OOTreeSet()
+        if self._dates is not None:
+            self._dates = OOTreeSet()
+            self._manuals = OOTreeSet()
+        if self._hits is not None:
+            self._hits = OOBTree()
+        if self._rules is not None:
+            self._rules = RedirectRules()
+        self._changed()
+
+    def _p_resolveConflict(self, old_state, committed_state, new_state):
+        # The redirects are in BTrees and Lengths that resolve their own
+        # conflicts.  We only change when an attribute is set, like
+        # _subtrees on the first add_subtree in an old storage, or when
+        # enabling an option.  When both transactions only created
+        # different independent trees, we keep both.  Anything else may
+        # swap or rebuild trees that the other transaction changed, like
+        # enable_interning, so it still conflicts.
+        resolved = dict(committed_state)
+        for state in (committed_state, new_state):
+            for name in set(old_state) | set(state):
+                old = old_state.get(name, _marker)
+                value = state.get(name, _marker)
+                if _same_state(value, old):
+                    continue
+                if (
+                    name not in _INDEPENDENT_ATTRIBUTES
+                    or (old is not _marker and old is not None)
+                    or value is _marker
+                    or value is None
+                ):
+                    raise ConflictError
+                if state is new_state:
+                    if name in committed_state and not _same_state(
+                        committed_state[name], old
+                    ):
+                        raise ConflictError
+                    resolved[name] = value
+        return resolved
+
+    def _key(self, path, create=False):
+        """Get the key in our BTrees for a canonical path.
+
+        Without interning this is the path itself.  With interning it is
+        None when we do not know the prefix of the path, unless create
+        is true.
+        """
+        if self._prefixes is None:
+            return path
+        return self._prefixes.encode(path, create)
+
+    def _path(self, key):
+        """Get the path for a key in our BTrees."""
+        if self._prefixes is None:
+            return key
+        return self._prefixes.decode(key)
+
+    def _keys_under(self, tree, prefix):
+        """Get a list of the keys in tree for the paths below prefix."""
+        if self._prefixes is None:
+            return _string_keys_under(tree, prefix)
+        return [
+            key
+            for low, high in self._prefixes.key_ranges(prefix)
+            for key in tree.keys(min=low, max=high, excludemax=True)
+        ]
+
+    def _target(self, key):
+        """Get the key of the new path that the key of an old path points to."""
+        value = self._paths.get(key)
+        if isinstance(value, tuple):
+            return value[0]
+        return value
+
+    def _full_value(self, new_path, now=None, manual=False):
+        """Get the value to store in _paths for a redirect to new_path."""
+        if self.compact_values or self._values_version:
+            return (new_path, _stamp(now, manual))
+        if now is None:
+            now = DateTime()
+        return (new_path, now, manual)
+
+    def _changed(self):
+        if self._generation is None:
+            self._generation = Length()
+        self._generation.change(1)
+
+    def version(self):
+        """Get a key for the committed state of the redirects.
+
+        Every change to the storage changes its _generation counter.  When
+        that is committed, the counter gets a new serial: the id of the
+        transaction.  Unlike the value of the counter, this is never reused,
+        not even when a transaction that changed the storage is aborted.
+
+        Returns None when the storage is not in a database, or has changes
+        that are not committed yet.  Lookups must not be cached then, see
+        plone.app.redirector.cache.
+        """
+        # Deferred redirects would change us.
+        self._flush()
+        generation = self._generation
+        if generation is None or generation._p_jar is None:
+            return None
+        generation._p_activate()
+        if generation._p_changed:
+            return None
+        return (
+            generation._p_jar.db().database_name,
+            generation._p_oid,
+            generation._p_serial,
+        )
+
+    def _change_length(self, delta):
+        if self._length is not None and delta:
+            self._length.change(delta)
 
     def add(self, old_path, new_path, now=None, manual=False):
+        self._flush()
         old_path = self._canonical(old_path)
         new_path = self._canonical(new_path)
 
         if old_path == new_path:
             return
+        self._changed()
+        if self._rsubtrees:
+            if self._removals:
+                # Destroying them may change the subtree redirects.
+                self._process_removal(old_path)
+                self._process_removal(new_path)
+            for p in self._diverged(old_path):
+                self._add(p, new_path, now, manual)
+        self._add(old_path, new_path, now, manual)
+
+    __setitem__ = add
+
+    def _add(self, old_path, new_path, now, manual):
+        """Add a redirect for canonical paths, without the subtree checks."""
+        if old_path == new_path:
+            return
+        if self._removals:
+            self._process_removal(old_path)
+            self._process_removal(new_path)
+        if self._bloom is not None:
+            self._bloom.add(old_path)
+        old_path = self._key(old_path, create=True)
+        new_path = self._key(new_path, create=True)
+        if self._lazy_chains:
+            if self._removals:
+                self._process_chain_removal(old_path)
+                self._process_chain_removal(new_path)
+            self._add_hop(old_path, self._full_value(new_path, now, manual), manual)
+            return
 
         # Forget any existing reverse paths to old_path
-        existing_target = self.get(old_path)
+        existing_target = self._target(old_path)
         if (existing_target is not None) and (existing_target in self._rpaths):
             # old_path was pointing to existing_target, but now we want it to
             # point to new_path.  So remove the existing reverse path.
@@ -48,65 +313,1127 @@ class RedirectionStorage(Persistent):
             else:
                 self._rpaths[existing_target].remove(old_path)
 
-        if now is None:
-            now = DateTime()
-        full_value = (new_path, now, manual)
+        full_value = self._full_value(new_path, now, manual)
 
         # Update any references that pointed to old_path
-        for p in self.redirects(old_path):
+        self._repoint(old_path, new_path, full_value)
+
+        if existing_target is None:
+            self._change_length(1)
+        self._reindex(old_path, full_value)
+        self._paths[old_path] = full_value
+        self._rpaths.setdefault(new_path, OOSet()).insert(old_path)
+
+    def add_deferred(self, old_path, new_path):
+        """Add a redirect just before the current transaction is committed.
+
+        The objectMoved subscriber uses this.  Moving many objects, for
+        example with cut and paste, then changes the BTrees only once, like
+        update does.  The result is the same as calling add for each redirect
+        in the same order, but when an object is moved more than once, like
+        from A to B to C, each old path is only written once, pointing to C.
+        The other methods add the deferred redirects first, so they always
+        see them, except get_subtree and has_redirect, which do not need them.
+
+        When the transaction is aborted, or a savepoint from before them is
+        rolled back, the deferred redirects are forgotten.  They belong to
+        the transaction of our database connection.
+        """
+        self._defer(self._canonical(old_path), self._canonical(new_path))
+
+    def destroy_deferred(self, new_path, subtree=False):
+        """Destroy the redirects to new_path before the transaction commits.
+
+        With subtree, this is destroy_subtree instead of destroy.  The
+        objectRemoved subscriber uses this for the removed object.  All
+        deferred removals in a row are done at once.  See add_deferred.
+        """
+        new_path = self._canonical(new_path)
+        if subtree:
+            new_path += "/"
+        self._defer(None, new_path)
+
+    def _defer(self, old_path, new_path):
+        pending = self._pending(create=True)
+        if old_path is None:
+            pending.destroy(new_path)
+        else:
+            pending.move(old_path, new_path)
+
+    def _pending(self, create=False):
+        """Get the _DeferredChanges of the current transaction, or None."""
+        if not _deferred and not create:
+            return None
+        # The transaction of our connection, which need not be the one of
+        # the default transaction manager.
+        jar = self._p_jar
+        manager = transaction.manager if jar is None else jar.transaction_manager
+        txn = manager.get()
+        storages = _deferred.get(txn)
+        if storages is None:
+            if not create:
+                return None
+            storages = _deferred[txn] = {}
+            txn.join(_DeferredDataManager(txn, manager))
+            txn.addBeforeCommitHook(_apply_deferred, (txn,))
+        pending = storages.get(self)
+        if pending is None and create:
+            pending = storages[self] = _DeferredChanges()
+        return pending
+
+    def _flush(self, moves=True):
+        """Apply the deferred changes of the current transaction.
+
+        Without moves, this is only done when they may change the subtree
+        redirects.  Deferred moves do not, unless they process queued
+        removals.
+        """
+        pending = self._pending()
+        if pending is None or not pending.changes:
+            return
+        if moves or pending.destroys or self._removals:
+            self._apply_deferred(pending.take())
+
+    def has_redirect(self, old_path, new_path):
+        """Does old_path redirect to new_path, with the deferred redirects?
+
+        The objectMoved subscriber asks this for every moved object, so
+        unlike get, this does not add the deferred moves.  It may answer
+        False when they could change the answer, and then the subscriber
+        adds a redirect that was not needed.
+        """
+        old_path = self._canonical(old_path)
+        new_path = self._canonical(new_path)
+        if old_path == new_path:
+            return False
+        pending = self._pending()
+        if pending is not None and pending.changes:
+            if pending.destroys or self._removals or self._lazy_chains:
+                self._flush()
+            elif new_path in pending.moves:
+                # The redirects to new_path will point elsewhere.
+                return False
+            elif old_path in pending.moves:
+                return pending.moves[old_path] == new_path
+        return self._find(old_path) == new_path
+
+    def _apply_deferred(self, changes):
+        # Apply each run of moves or removals in one go, in order.
+        for destroying, group in groupby(changes, lambda change: change[0] is None):
+            if destroying:
+                self._destroy_or_queue([new_path for old_path, new_path in group])
+            else:
+                self._add_moves(group)
+
+    def _add_moves(self, moves):
+        now = DateTime()
+        loader = _BulkLoader(self)
+        for old_path, new_path in moves:
+            loader.add(old_path, new_path, now=now, manual=False)
+        loader.write()
+
+    def _repoint(self, old_path, new_path, full_value):
+        """Let the redirects to old_path point to new_path instead.
+
+        Both are keys.  Values that only have a path get full_value.
+        """
+        old_paths = self._rpaths.get(old_path)
+        if old_paths is None:
+            return
+        paths = self._paths
+        for p in old_paths:
             # p points to old_path, but old_path will point to new_path,
             # so we update p to point to new_path directly.
             if p != new_path:
-                old_full_value = self._paths[p]
+                old_full_value = paths[p]
                 if isinstance(old_full_value, tuple):
                     # keep date and manual
-                    new_full_value = (
-                        new_path,
-                        old_full_value[1],
-                        old_full_value[2],
-                    )
+                    paths[p] = (new_path,) + old_full_value[1:]
                 else:
-                    new_full_value = full_value
-                self._paths[p] = new_full_value
-                self._rpaths.setdefault(new_path, OOSet()).insert(p)
+                    self._reindex(p, full_value)
+                    paths[p] = full_value
+        if new_path in old_paths:
+            # There is an existing redirect from new_path to old_path.
+            # We now want to update new_path to point to new_path.
+            # This is not useful, so we delete it.
+            self._unindex(new_path, paths.pop(new_path))
+            self._change_length(-1)
+            old_paths.remove(new_path)
+
+        # The reverse paths of old_path are now those of new_path.  We move
+        # the set instead of copying it, or add the smaller set to the
+        # larger one, so a target with many redirects is cheap to move.
+        del self._rpaths[old_path]
+        if not old_paths:
+            return
+        new_paths = self._rpaths.get(new_path)
+        if new_paths is None:
+            self._rpaths[new_path] = old_paths
+        elif len(new_paths) >= len(old_paths):
+            new_paths.update(old_paths)
+        else:
+            old_paths.update(new_paths)
+            self._rpaths[new_path] = old_paths
+
+    def enable_lazy_chains(self):
+        """Let add only store the new hop of a chain of redirects.
+
+        Normally, when a path is moved, add changes all redirects to it so
+        that they point to the new path.  Moving an object that many old
+        paths redirect to then takes time.  With lazy chains, add only
+        stores the redirect from the path.  Lookups follow the chain of
+        hops, detecting loops, and at most MAX_HOPS.  Call compact_chains
+        regularly to let redirects point to the end of their chain again,
+        so lookups need fewer hops.
+
+        When content is moved to a path that still redirects, that redirect
+        is removed, after compacting the chains through it.  Manual
+        redirects to a path that redirects are chained, unless that would
+        make a loop.
+        """
+        self._flush()
+        if self._hops is None:
+            self._hops = OOTreeSet()
+        self._lazy_chains = True
+
+    def disable_lazy_chains(self):
+        """Compact all chains, and let add update them again."""
+        self.compact_chains()
+        self._lazy_chains = False
+        self._hops = None
+
+    def compact_chains(self, limit=None):
+        """Let redirects through at most limit hops skip them.
+
+        Call this from a clock server or cron job, and commit after each
+        batch.  Returns the number of processed hops.
+        """
+        self._flush()
+        if not self._hops:
+            return 0
+        hops = list(islice(self._hops, limit))
+        for key in hops:
+            self._hops.remove(key)
+            self._skip_hop(key)
+        return len(hops)
+
+    def _add_hop(self, old_path, full_value, manual):
+        """Add a redirect, leaving the redirects to old_path as they are.
+
+        This is add for lazy chains, with keys.
+        """
+        paths = self._paths
+        rpaths = self._rpaths
+        new_path = full_value[0]
+        if new_path in paths and (not manual or self._reaches(new_path, old_path)):
+            # Content is moved to new_path, so it no longer redirects.
+            self._skip_hop(new_path)
+            self._unlink(new_path)
+            self._unindex(new_path, paths.pop(new_path))
+            self._change_length(-1)
+        if old_path in paths:
+            self._unlink(old_path)
+        else:
+            self._change_length(1)
+        self._reindex(old_path, full_value)
+        paths[old_path] = full_value
+        rpaths.setdefault(new_path, OOSet()).insert(old_path)
+        if old_path in rpaths:
+            self._hops.insert(old_path)
+        if new_path in paths:
+            self._hops.insert(new_path)
+
+    def _process_chain_removal(self, key):
+        """Destroy the redirects to the end of the chain from key now, if queued.
+
+        A new hop from or to key changes the chains through it.  destroy
+        would already have removed them, so we do that first.
+        """
+        value = self._paths.get(key)
+        if value is None:
+            return
+        value = self._follow(value)
+        if value is not None:
+            self._process_removal(self._path(_new_path(value)))
+
+    def _unlink(self, old_path):
+        """Remove the key old_path from the reverse paths of its new path."""
+        existing_target = self._target(old_path)
+        old_paths = self._rpaths.get(existing_target)
+        if old_paths is not None and old_path in old_paths:
+            if len(old_paths) == 1:
+                del self._rpaths[existing_target]
             else:
-                # There is an existing redirect from new_path to old_path.
-                # We now want to update new_path to point to new_path.
-                # This is not useful, so we delete it.
-                del self._paths[new_path]
+                old_paths.remove(old_path)
+
+    def _skip_hop(self, key):
+        """Let the redirects to key point to the end of its chain."""
+        value = self._paths.get(key)
+        if value is None or key not in self._rpaths:
+            return
+        value = self._follow(value)
+        if value is None:
+            # A loop, which we do not create, so this should not happen.
+            # Take the first hop.
+            value = self._paths[key]
+        new_path = _new_path(value)
+        self._repoint(key, new_path, self._full_value(new_path))
 
-        # Remove reverse paths for old_path.  If old_path was being
-        # redirected to, the above code will have updated those redirects,
-        # so this reverse redirect info is no longer needed.
-        if old_path in self._rpaths:
-            del self._rpaths[old_path]
+    def _follow(self, value):
+        """Follow the hops of a lazy chain from a value of _paths.
 
-        self._paths[old_path] = full_value
-        self._rpaths.setdefault(new_path, OOSet()).insert(old_path)
+        Returns the value with the new path at the end of the chain, and the
+        date and manual flag of the first hop.  When the chain has a loop,
+        this returns None.
+        """
+        paths = self._paths
+        new_path = _new_path(value)
+        next_value = paths.get(new_path)
+        if next_value is None:
+            # This is the usual case.
+            return value
+        seen = {new_path}
+        for hop in range(MAX_HOPS):
+            new_path = _new_path(next_value)
+            if new_path in seen:
+                return None
+            seen.add(new_path)
+            next_value = paths.get(new_path)
+            if next_value is None:
+                break
+        if isinstance(value, tuple):
+            return (new_path,) + value[1:]
+        return new_path
 
-    __setitem__ = add
+    def _reaches(self, start, goal):
+        """Does the chain from the key start reach the key goal?"""
+        value = self._paths.get(start)
+        for hop in range(MAX_HOPS):
+            if value is None:
+                return False
+            new_path = _new_path(value)
+            if new_path == goal:
+                return True
+            value = self._paths.get(new_path)
+        return False
+
+    def add_subtree(self, old_prefix, new_prefix, now=None, manual=False):
+        """Remember that everything below old_prefix is now below new_prefix.
+
+        This is one redirect for all paths below old_prefix, for example for
+        the contents of a folder that was renamed: get("/old/folder/a/b")
+        gives "/new/folder/a/b", unless there is a redirect for that exact
+        path.  The longest matching old prefix wins.  Redirects for old_prefix
+        itself are not changed, use add for that.  The objectMoved
+        subscriber uses this for moved folders when subtree_moves is true.
+
+        Redirects and subtree redirects that pointed to paths below
+        old_prefix now point below new_prefix.  When a path below new_prefix
+        is moved later, add stores a redirect for the matching path below
+        old_prefix.  When it is removed, we still redirect to it, and the
+        404 page takes over from there.  Subtree redirects that reach below
+        old_prefix from above get their own for the matching prefix: after
+        "/a" to "/b", moving "/b/x" adds "/a/x" too.
+
+        When old_prefix already has a subtree redirect to another prefix, it
+        is for the content that was at old_prefix before, so we keep it.
+        The paths below old_prefix then need their own redirects to below
+        new_prefix, which the objectMoved subscriber adds.  Call
+        remove_subtree first to replace it.
+
+        Subtree redirects are not counted in len, and not included when
+        iterating or exporting.  See subtrees.
+        """
+        old_prefix = self._canonical(old_prefix)
+        new_prefix = self._canonical(new_prefix)
+        if old_prefix == new_prefix:
+            return
+        pending = self._pending(create=True)
+        added = (old_prefix, new_prefix) in pending.subtrees
+        if added and self._subtrees and old_prefix in self._subtrees:
+            # The objectMoved subscriber calls this for every item in the
+            # moved folder, when an existing subtree redirect was kept.
+            return
+        pending.subtrees.add((old_prefix, new_prefix))
+        if pending.touches(old_prefix) or pending.touches(new_prefix):
+            self._flush()
+        else:
+            self._flush(moves=False)
+        self._changed()
+        if self._removals:
+            # Queued removals below old_prefix would miss their redirects
+            # once they point below new_prefix.
+            for path in _string_keys_under(self._removals, old_prefix):
+                # Queued subtrees end with a slash.
+                self._process_removal(self._canonical(path))
+            self._process_removal(old_prefix)
+            self._process_removal(new_prefix)
+        if self._subtrees is None:
+            self._subtrees = OOBTree()
+            self._rsubtrees = OOBTree()
+        subtrees = self._subtrees
+        rsubtrees = self._rsubtrees
+
+        # Update subtree redirects that pointed to old_prefix or below it.
+        targets = _string_keys_under(rsubtrees, old_prefix)
+        if old_prefix in rsubtrees:
+            targets.append(old_prefix)
+        for target in targets:
+            new_target = new_prefix + target[len(old_prefix) :]
+            for p in rsubtrees[target]:
+                if p == new_target:
+                    # This would redirect to itself.
+                    del subtrees[p]
+                    continue
+                subtrees[p] = (new_target,) + subtrees[p][1:]
+                rsubtrees.setdefault(new_target, OOSet()).insert(p)
+            del rsubtrees[target]
+
+        # Update redirects that pointed below old_prefix.
+        full_value = self._full_value(new_prefix, now, manual)
+        for target in self._keys_under(self._rpaths, old_prefix):
+            if self._lazy_chains and target in self._paths:
+                # The redirects to target follow its own redirect.
+                continue
+            new_target = new_prefix + self._path(target)[len(old_prefix) :]
+            new_target = self._key(new_target, create=True)
+            self._repoint(target, new_target, (new_target,) + full_value[1:])
+
+        # Subtree redirects to above old_prefix reach its contents too,
+        # like "/a" to "/b" when moving "/b/x": "/a/x" gets its own.
+        for p in self._diverged_subtrees(old_prefix):
+            if (p + "/").startswith(new_prefix + "/"):
+                # _subtree_lookup would skip it.
+                continue
+            subtrees[p] = full_value
+            rsubtrees.setdefault(new_prefix, OOSet()).insert(p)
+
+        existing = subtrees.get(old_prefix)
+        if existing is not None:
+            if existing[0] != new_prefix:
+                return
+            self._forget_subtree(old_prefix, existing[0])
+        subtrees[old_prefix] = full_value
+        rsubtrees.setdefault(new_prefix, OOSet()).insert(old_prefix)
+
+    def _forget_subtree(self, old_prefix, new_prefix):
+        """Remove old_prefix from the reverse subtree redirects."""
+        old_prefixes = self._rsubtrees.get(new_prefix)
+        if old_prefixes is None or old_prefix not in old_prefixes:
+            return
+        if len(old_prefixes) == 1:
+            del self._rsubtrees[new_prefix]
+        else:
+            old_prefixes.remove(old_prefix)
+
+    def remove_subtree(self, old_prefix):
+        """Forget the subtree redirect for old_prefix."""
+        self._flush()
+        old_prefix = self._canonical(old_prefix)
+        if not self._subtrees or old_prefix not in self._subtrees:
+            raise KeyError(old_prefix)
+        self._forget_subtree(old_prefix, self._subtrees[old_prefix][0])
+        del self._subtrees[old_prefix]
+        self._forget_hits(old_prefix)
+        self._changed()
+
+    def get_subtree(self, old_prefix, default=None):
+        """Get the new prefix of the subtree redirect for old_prefix."""
+        self._flush(moves=False)
+        old_prefix = self._canonical(old_prefix)
+        if not self._subtrees:
+            return default
+        value = self._subtrees.get(old_prefix)
+        return default if value is None else value[0]
+
+    def subtrees(self):
+        """Get a list of (old prefix, new prefix) of all subtree redirects."""
+        self._flush()
+        if not self._subtrees:
+            return []
+        return [(p, value[0]) for p, value in self._subtrees.items()]
+
+    def _subtree_lookup(self, old_path):
+        """Get the value of the subtree redirect that matches old_path.
+
+        Instead of the new prefix, the value has the new path.
+        Returns None when no old prefix matches.
+        """
+        match = self._subtree_match(old_path)
+        return None if match is None else match[1]
+
+    def _subtree_match(self, old_path):
+        """Get (old prefix, value) of the subtree redirect for old_path.
+
+        Like _subtree_lookup, but also with the old prefix that matched.
+        """
+        subtrees = self._subtrees
+        if not subtrees:
+            return None
+        index = len(old_path)
+        while True:
+            index = old_path.rfind("/", 0, index)
+            if index <= 0:
+                return None
+            old_prefix = old_path[:index]
+            value = subtrees.get(old_prefix)
+            if value is None or self._is_queued(value[0]):
+                continue
+            if (old_path + "/").startswith(value[0] + "/"):
+                # The new prefix is below the old prefix, like after moving
+                # "/news" to "/archive", and "/archive" to "/news/archive".
+                # old_path may be a new path we gave before, so the 404
+                # view would redirect to "/news/archive/archive/..." without
+                # end.
+                continue
+            return (old_prefix, (value[0] + old_path[index:],) + value[1:])
+
+    def _diverged(self, old_path, added=()):
+        """Get the old paths that reach old_path with subtree redirects.
+
+        When old_path moves, they need their own redirect to the new path.
+        This includes the old paths that reach those, and so on.  Old paths
+        with an exact redirect keep it, also when it is in added, a
+        container of keys that are about to be added.  Subtree redirects can
+        form a cycle, like "/a" to "/b/a" and "/b/a/sub" to "/a".  So each
+        one is followed once, and paths below old_path itself are skipped,
+        as they only reach it through such a cycle.
+        """
+        result = []
+        self._collect_diverged(old_path, old_path + "/", added, set(), result)
+        return result
+
+    def _collect_diverged(self, old_path, below, added, followed, result):
+        rsubtrees = self._rsubtrees
+        paths = self._paths
+        index = len(old_path)
+        while True:
+            index = old_path.rfind("/", 0, index)
+            if index <= 0:
+                return
+            old_prefixes = rsubtrees.get(old_path[:index])
+            if old_prefixes is None:
+                continue
+            suffix = old_path[index:]
+            for old_prefix in old_prefixes:
+                if old_prefix in followed:
+                    continue
+                followed.add(old_prefix)
+                p = old_prefix + suffix
+                if p.startswith(below):
+                    continue
+                key = self._key(p)
+                if key is not None and (key in paths or key in added):
+                    continue
+                # The old paths that reach p are added first, like add did.
+                self._collect_diverged(p, below, added, followed, result)
+                result.append(p)
+
+    def _diverged_subtrees(self, old_prefix):
+        """Get the old prefixes that reach old_prefix with subtree redirects.
+
+        This is like _diverged, but for the paths below old_prefix: an old
+        prefix with a subtree redirect of its own, or with one between it
+        and the subtree redirect that reaches it, is skipped.
+        """
+        result = []
+        self._collect_diverged_subtrees(old_prefix, old_prefix + "/", set(), result)
+        return result
+
+    def _collect_diverged_subtrees(self, prefix, below, followed, result):
+        subtrees = self._subtrees
+        index = len(prefix)
+        while True:
+            index = prefix.rfind("/", 0, index)
+            if index <= 0:
+                return
+            old_prefixes = self._rsubtrees.get(prefix[:index])
+            if old_prefixes is None:
+                continue
+            suffix = prefix[index:]
+            for old_prefix in old_prefixes:
+                if old_prefix in followed:
+                    continue
+                followed.add(old_prefix)
+                p = old_prefix + suffix
+                if p.startswith(below) or any(
+                    p[:i] in subtrees
+                    for i in range(len(old_prefix) + 1, len(p) + 1)
+                    if i == len(p) or p[i] == "/"
+                ):
+                    continue
+                self._collect_diverged_subtrees(p, below, followed, result)
+                result.append(p)
+
+    def add_rule(self, pattern, target, kind="prefix"):
+        """Add a redirect rule with a pattern.
+
+        Migrations give rules like "/blog/(\\d{4})/(.*)" to "/news/\\1/\\2",
+        which cannot be stored as redirects of single paths.  kind is
+        "prefix", "glob" or "regex", see plone.app.redirector.rules.  A rule
+        with the same pattern is replaced.  The rules are only used for
+        paths without a redirect, see match_rule, and they are not changed
+        when content is moved or removed.
+        """
+        self._flush()
+        if self._rules is None:
+            self._rules = RedirectRules()
+        self._rules.add(self._canonical(pattern), target, kind)
+        self._changed()
+
+    def remove_rule(self, pattern):
+        self._flush()
+        pattern = self._canonical(pattern)
+        if not self._rules or pattern not in self._rules:
+            raise KeyError(pattern)
+        self._rules.remove(pattern)
+        self._forget_hits(pattern)
+        self._changed()
+
+    def rules(self):
+        """Get a list of (pattern, target, kind) of all rules."""
+        if not self._rules:
+            return []
+        return self._rules.items()
+
+    def match_rule(self, path):
+        """Get the new path for path from the rules, or None.
+
+        The rule with the longest literal start that matches wins.
+        """
+        found = self._match_rule(self._canonical(path))
+        return None if found is None else found[0]
+
+    def _match_rule(self, path):
+        """Get (new_path, pattern) of the rule for a canonical path, or None."""
+        if not self._rules:
+            return None
+        return self._rules.find(path)
 
     def update(self, info, manual=True):
         # Bulk update information.
         # Calling update will usually be done for manual additions (csv upload).
+        # This gives the same result as calling add for each item,
+        # but the BTrees are only changed at the end, in sorted order.
+        self._flush()
         now = DateTime()
-        for key, value in info.items():
-            if isinstance(value, tuple):
-                # This is (new path, datetime, manual),
-                # where datetime may be None.
-                self.add(key, value[0], now=value[1] or now, manual=value[2])
+        loader = _BulkLoader(self)
+        with _gc_paused(len(info)):
+            for key, value in info.items():
+                if isinstance(value, tuple):
+                    # This is (new path, datetime, manual),
+                    # where datetime may be None.
+                    loader.add(key, value[0], now=value[1] or now, manual=value[2])
+                else:
+                    loader.add(key, value, now=now, manual=manual)
+            loader.write()
+
+    def import_rows(
+        self, rows, chunk_size=10000, commit=False, progress=None, start=0, manual=True
+    ):
+        """Import redirects from an iterable of rows, in chunks.
+
+        Each row is (old_path, new_path), optionally followed by a date and
+        a manual flag.  The date can be a DateTime, a string, or empty for the
+        current time.  The manual flag can be a boolean or a string like
+        "True".  When it is missing or empty, the manual argument is used.
+        Empty rows are skipped.
+
+        The rows are read lazily, so this works with a generator or a csv
+        reader over a huge file.  After each chunk of chunk_size rows we take
+        a transaction savepoint, or commit the transaction if commit is true,
+        so memory use stays bounded.
+
+        progress is called after each chunk with the number of rows done
+        and the number of rows per second.  When an import with commit=True
+        is interrupted, pass the last reported number of rows done as start
+        to resume: the rows before it are skipped.
+
+        Returns the number of rows done.
+        """
+        self._flush()
+        rows = iter(rows)
+        for row in islice(rows, start):
+            pass
+        done = start
+        started = time()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            now = DateTime()
+            loader = _BulkLoader(self)
+            with _gc_paused(len(chunk)):
+                for row in chunk:
+                    if not row:
+                        continue
+                    date = row[2] if len(row) > 2 else None
+                    if isinstance(date, str):
+                        date = DateTime(date) if date.strip() else None
+                    row_manual = row[3] if len(row) > 3 else None
+                    if isinstance(row_manual, str):
+                        row_manual = row_manual.strip().lower() or None
+                        if row_manual is not None:
+                            row_manual = row_manual in ("true", "yes", "1")
+                    if row_manual is None:
+                        row_manual = manual
+                    loader.add(row[0], row[1], now=date or now, manual=row_manual)
+                loader.write()
+            if commit:
+                transaction.commit()
+            else:
+                transaction.savepoint(optimistic=True)
+            done += len(chunk)
+            if progress is not None:
+                elapsed = time() - started
+                progress(done, (done - start) / elapsed if elapsed else 0.0)
+        return done
+
+    def export_rows(self, cursor=None, limit=None):
+        """Yield (old_path, new_path, date, manual) rows in old path order.
+
+        This reads the buckets of _paths one by one, instead of iterating
+        and calling get_full for each old path.  Pass the old path of the
+        last row you have seen as cursor to continue after it, for example
+        after a timeout.  With limit you get at most that many rows, so you
+        can export in pages.  With interning, the order is that of the keys,
+        which keeps paths in the same folder together, and the cursor must
+        be an old path that is in the storage, or was in it.
+
+        When the storage is in a database, we let the ZODB cache shrink
+        regularly, so the loaded buckets do not fill it up.
+        """
+        self._flush()
+        if cursor is None:
+            items = self._paths.items()
+        else:
+            key = self._key(cursor)
+            if key is None:
+                raise KeyError(cursor)
+            items = self._paths.items(min=key, excludemin=True)
+        if limit is not None:
+            items = islice(items, limit)
+        jar = self._p_jar
+        full_info = _compact_info if self._values_version else _full_info
+        path = self._path
+        for count, (old_path, info) in enumerate(items, 1):
+            if self._lazy_chains:
+                info = self._follow(info) or info
+            new_path, date, manual = full_info(info)
+            yield (path(old_path), path(new_path), date, manual)
+            if jar is not None and not count % EXPORT_GC_INTERVAL:
+                jar.cacheGC()
+
+    def items_from(self, prefix, start=None, end=None, manual=None):
+        """Get the redirects from prefix and from the paths below it.
+
+        This gives an iterator of (old_path, new_path, date, manual) rows,
+        like export_rows, in the same order.  Only the buckets of _paths
+        for those old paths are read.  Subtree redirects are not included.
+
+        With start and/or end, only rows with a date in that range are
+        included, including start and end.  With manual True or False, only
+        rows with that manual flag are included.
+        """
+        self._flush()
+        items = self._items_under(self._paths, self._canonical(prefix))
+        return self._rows(items, start, end, manual)
+
+    def targets_under(self, prefix, start=None, end=None, manual=None):
+        """Get the redirects to prefix and to the paths below it.
+
+        This gives an iterator of (old_path, new_path, date, manual) rows,
+        ordered by new path and then old path.  Only the buckets of _rpaths
+        for those new paths are read, plus the values of their old paths.
+        The other arguments filter the rows, see items_from.
+        """
+        self._flush()
+        return self._rows(self._items_to(self._canonical(prefix)), start, end, manual)
+
+    def _items_to(self, prefix):
+        paths = self._paths
+        for new_path, old_paths in self._items_under(self._rpaths, prefix):
+            if self._lazy_chains:
+                if new_path in paths:
+                    # The chains go on from here.
+                    continue
+                old_paths = self._chain_old_paths(old_paths)
+            for old_path in old_paths:
+                yield old_path, paths[old_path]
+
+    def _items_under(self, tree, prefix):
+        """Iterate over the items in tree for prefix and the paths below it."""
+        key = self._key(prefix)
+        if key is not None:
+            value = tree.get(key)
+            if value is not None:
+                yield key, value
+        if self._prefixes is None:
+            yield from tree.items(min=prefix + "/", max=prefix + "0", excludemax=True)
+            return
+        for low, high in self._prefixes.key_ranges(prefix):
+            yield from tree.items(min=low, max=high, excludemax=True)
+
+    def _rows(self, items, start=None, end=None, manual=None):
+        """Turn (key, value) items of _paths into rows, see items_from."""
+        start = None if start is None else start.micros()
+        end = None if end is None else end.micros()
+        full_info = _compact_info if self._values_version else _full_info
+        path = self._path
+        for old_path, value in items:
+            if self._lazy_chains:
+                value = self._follow(value) or value
+            if not _matches(value, start, end, manual):
+                continue
+            new_path, date, is_manual = full_info(value)
+            new_path = path(new_path)
+            if self._removals and self._is_queued(new_path):
+                continue
+            yield (path(old_path), new_path, date, is_manual)
+
+    def enable_date_index(self):
+        """Keep indexes on the date and the manual flag of the redirects.
+
+        A redirect management page lists the newest redirects, or the manual
+        ones, a page at a time.  Without indexes, items_by_date and
+        manual_redirects have to read all values of _paths for each page.
+        With them, a page reads the index entries and the values on it.
+        The indexes are kept up to date on every change, which makes adding
+        and removing redirects a bit slower.
+
+        Calling this again rebuilds the indexes.
+        """
+        self._flush()
+        self._build_date_index()
+
+    def disable_date_index(self):
+        self._dates = None
+        self._manuals = None
+
+    def _build_date_index(self):
+        self._dates = OOTreeSet()
+        self._manuals = OOTreeSet()
+        for key, value in self._paths.items():
+            self._index(key, value)
+
+    def _index(self, key, value):
+        """Add the key and value of _paths to the date index, if we have it."""
+        if self._dates is None or value is None:
+            return
+        entry = _date_entry(key, value)
+        if entry is not None:
+            self._dates.insert(entry)
+        if _is_manual_value(value):
+            self._manuals.insert(key)
+
+    def _unindex(self, key, value):
+        """Remove the key and its old value from the date index."""
+        if self._dates is None or value is None:
+            return
+        entry = _date_entry(key, value)
+        if entry is not None and entry in self._dates:
+            self._dates.remove(entry)
+        if key in self._manuals:
+            self._manuals.remove(key)
+
+    def _reindex(self, key, value):
+        """Update the date index before the value of key is set to value."""
+        if self._dates is not None:
+            self._unindex(key, self._paths.get(key))
+            self._index(key, value)
+
+    def items_by_date(self, start=None, end=None, manual=None, cursor=None, limit=None):
+        """Get the redirects with a date, the newest first.
+
+        This gives an iterator of (old_path, new_path, date, manual) rows,
+        like items_from, with the same filters.  Redirects with the same
+        date are in the order of export_rows.  Pass the last row you have seen as
+        cursor to get the rows after it, and a limit to get a page.
+
+        With the date index, see enable_date_index, a page only reads the
+        index entries and values of its rows, plus those that the manual
+        filter skips.  Without it, we read and sort all values first.
+        """
+        self._flush()
+        dates = self._dates
+        if dates is None:
+            dates = OOTreeSet(
+                entry
+                for entry in map(_date_entry, self._paths.keys(), self._paths.values())
+                if entry is not None
+            )
+        bounds = {}
+        if end is not None:
+            bounds["min"] = (-end.micros(),)
+        if cursor is not None:
+            key = self._key(self._canonical(cursor[0]))
+            if key is None:
+                raise KeyError(cursor[0])
+            entry = (-cursor[2].micros(), key)
+            if entry >= bounds.get("min", entry):
+                bounds.update(min=entry, excludemin=True)
+        if start is not None:
+            bounds.update(max=(1 - start.micros(),), excludemax=True)
+        entries = dates.keys(**bounds)
+        paths = self._paths
+        rows = self._rows(
+            ((key, paths[key]) for micros, key in entries), None, None, manual
+        )
+        return islice(rows, limit)
+
+    def manual_redirects(self, cursor=None, limit=None):
+        """Get the manual redirects, in old path order.
+
+        This gives an iterator of (old_path, new_path, date, manual) rows,
+        like export_rows, with the same cursor and limit.  With the date
+        index, see enable_date_index, only the values of these rows are
+        read.  Without it, we read all values.
+        """
+        self._flush()
+        if cursor is None:
+            cursor_key = None
+        else:
+            cursor_key = self._key(self._canonical(cursor))
+            if cursor_key is None:
+                raise KeyError(cursor)
+        if self._manuals is None:
+            items = self._paths.items(min=cursor_key, excludemin=cursor is not None)
+            rows = self._rows(items, manual=True)
+        else:
+            keys = self._manuals.keys(min=cursor_key, excludemin=cursor is not None)
+            paths = self._paths
+            rows = self._rows((key, paths[key]) for key in keys)
+        return islice(rows, limit)
+
+    def prune(
+        self,
+        before,
+        batch_size=1000,
+        commit=False,
+        keep=None,
+        progress=None,
+        hit_since=None,
+    ):
+        """Remove the automatic redirects with a date before the given date.
+
+        Redirects that were added for moved content pile up over the years,
+        and most of them are never used again.  Manual redirects and
+        redirects without a date are kept.  So are the redirects for which
+        keep, when given, returns true when called with the old path, for
+        example those that served a hit recently.  With hit tracking, see
+        enable_hit_tracking, you can pass a date as hit_since instead: the
+        redirects with a hit on or after it are kept.  Expired subtree
+        redirects are removed at the end.
+
+        The redirects are removed in batches of at most batch_size.  After
+        each batch we take a transaction savepoint, or commit the transaction
+        if commit is true, so this can run as a periodic job without
+        changing the storage for minutes in one transaction.  When it is
+        interrupted, call it again to continue.  With the date index, see
+        enable_date_index, we only read the expired redirects.  Without it,
+        we read all of them.
+
+        progress is called after each batch with the number of removed
+        redirects and the number of removed redirects per second.
+
+        Returns the number of removed redirects.
+        """
+        self._flush()
+        if hit_since is not None and self._hits is not None:
+            keep = self._keep_hit_since(hit_since.micros(), keep)
+        cutoff = before.micros()
+        removed = 0
+        started = time()
+        cursor = None
+        while True:
+            keys, cursor = self._expired(cutoff, cursor, keep, batch_size)
+            if keys:
+                removed += self._remove_keys(keys)
+            if cursor is None:
+                removed += self._prune_subtrees(cutoff, keep)
+            if commit:
+                transaction.commit()
             else:
-                self.add(key, value, now=now, manual=manual)
+                transaction.savepoint(optimistic=True)
+            if progress is not None:
+                elapsed = time() - started
+                progress(removed, removed / elapsed if elapsed else 0.0)
+            if cursor is None:
+                return removed
+
+    def _expired(self, cutoff, cursor, keep, limit):
+        """Find at most limit keys of automatic redirects before cutoff.
+
+        cutoff is in microseconds since the epoch.  Returns a list of keys,
+        and the cursor to find more after them, or None when there are none.
+        """
+        if self._dates is None:
+            items = self._paths.items(min=cursor, excludemin=cursor is not None)
+            candidates = (
+                (key, key)
+                for key, value in items
+                if _matches(value, None, cutoff - 1, False)
+            )
+        elif cursor is None:
+            candidates = self._automatic(self._dates.keys(min=(1 - cutoff,)))
+        else:
+            candidates = self._automatic(self._dates.keys(min=cursor, excludemin=True))
+        keys = []
+        for cursor, key in candidates:
+            if keep is None or not keep(self._path(key)):
+                keys.append(key)
+                if len(keys) == limit:
+                    return keys, cursor
+        return keys, None
+
+    def _keep_hit_since(self, micros, keep):
+        """Get a keep function for prune that also keeps recent hits."""
+        hits = self._hits
+
+        def keep_hit(old_path):
+            hit = hits.get(old_path)
+            if hit is not None and hit[1] >= micros:
+                return True
+            return keep is not None and keep(old_path)
+
+        return keep_hit
+
+    def _automatic(self, entries):
+        """Get (entry, key) for the entries of the date index that are not manual."""
+        manuals = self._manuals
+        return ((entry, entry[1]) for entry in entries if entry[1] not in manuals)
+
+    def _remove_keys(self, keys):
+        """Remove the redirects from the keys, in sorted order.
+
+        Returns the number of removed redirects.
+        """
+        paths = self._paths
+        hits = self._hits
+        removed = 0
+        for key in sorted(keys):
+            if self._lazy_chains:
+                self._skip_hop(key)
+            self._unlink(key)
+            value = paths.pop(key, None)
+            if value is not None:
+                removed += 1
+                self._unindex(key, value)
+            if hits:
+                hits.pop(self._path(key), None)
+        self._change_length(-removed)
+        self._changed()
+        return removed
+
+    def _prune_subtrees(self, cutoff, keep):
+        """Remove the automatic subtree redirects before cutoff, see prune."""
+        subtrees = self._subtrees
+        if not subtrees:
+            return 0
+        expired = [
+            old_prefix
+            for old_prefix, value in subtrees.items()
+            if _matches(value, None, cutoff - 1, False)
+            and (keep is None or not keep(old_prefix))
+        ]
+        for old_prefix in expired:
+            self._forget_subtree(old_prefix, subtrees[old_prefix][0])
+            del subtrees[old_prefix]
+            self._forget_hits(old_prefix)
+        if expired:
+            self._changed()
+        return len(expired)
+
+    def enable_hit_tracking(self):
+        """Count the hits of each redirect, and remember the last one.
+
+        The 404 view counts the hits in memory and regularly writes the
+        counts of all paths at once, in a transaction of its own, see
+        plone.app.redirector.hits.  So serving a redirect does not write to
+        the database.  The hits are stored per old path in an OOBTree, which
+        resolves conflicts between processes that write different paths.
+        Hits of a subtree redirect are counted for its old prefix, and hits
+        of a rule for its pattern, see resolve.  See get_hits, iter_hits and
+        the hit_since argument of prune.
+        """
+        if self._hits is None:
+            self._hits = OOBTree()
+
+    def tracks_hits(self):
+        """Is hit tracking enabled?  See enable_hit_tracking."""
+        return self._hits is not None
+
+    def disable_hit_tracking(self):
+        """Stop counting hits, and forget them."""
+        self._hits = None
+
+    def record_hits(self, hits):
+        """Add hits to the stored hits.
+
+        hits is a mapping of old path to (number of hits, time of the last
+        hit in microseconds since the epoch).  Nothing is stored when hit
+        tracking is not enabled.  This does not change the redirects, so
+        cached lookups stay valid.
+        """
+        stored = self._hits
+        if stored is None:
+            return
+        updates = []
+        for old_path, (count, micros) in sorted(hits.items()):
+            old_count, last = stored.get(old_path, (0, 0))
+            updates.append((old_path, (old_count + count, max(last, micros))))
+        stored.update(updates)
+
+    def _forget_hits(self, source):
+        """Forget the hits of a removed subtree redirect or rule."""
+        if self._hits:
+            self._hits.pop(source, None)
+
+    def get_hits(self, old_path):
+        """Get (number of hits, date of the last hit) of a redirect.
+
+        old_path can also be the old prefix of a subtree redirect, or the
+        pattern of a rule.
+
+        The date is None when there were no hits.
+        """
+        hits = self._hits
+        hit = None if hits is None else hits.get(self._canonical(old_path))
+        if hit is None:
+            return (0, None)
+        return (hit[0], DateTime(hit[1] / 1000000.0, "UTC"))
+
+    def iter_hits(self, cursor=None, limit=None):
+        """Yield (old_path, number of hits, date of the last hit) rows.
+
+        They are in old path order, with the same cursor and limit as
+        export_rows.  Old paths of redirects that have been removed, other
+        than by prune, can still be included.
+        """
+        if not self._hits:
+            return
+        items = self._hits.items(min=cursor, excludemin=cursor is not None)
+        for old_path, (count, micros) in islice(items, limit):
+            yield (old_path, count, DateTime(micros / 1000000.0, "UTC"))
 
     def remove(self, old_path):
+        self._flush()
         old_path = self._canonical(old_path)
-        new_path = self.get(old_path)
+        key = self._key(old_path)
+        if key is None:
+            raise KeyError(old_path)
+        old_path = key
+        if self._lazy_chains:
+            self._skip_hop(old_path)
+        new_path = self._target(old_path)
         if new_path is not None and new_path in self._rpaths:
             if len(self._rpaths[new_path]) == 1:
                 del self._rpaths[new_path]
             else:
                 self._rpaths[new_path].remove(old_path)
-        del self._paths[old_path]
+        self._unindex(old_path, self._paths.pop(old_path))
+        self._change_length(-1)
+        self._changed()
 
     __delitem__ = remove
 
@@ -121,7 +1448,9 @@ class RedirectionStorage(Persistent):
         and the _rpaths an extra 3 seconds.  Seems fine, as this should
         rarely be used.
         """
+        self._flush()
         now = DateTime()
+        self._changed()
         self._rpaths = OOBTree()
         for old_path in self._paths:
             new_info = self._paths[old_path]
@@ -132,13 +1461,17 @@ class RedirectionStorage(Persistent):
                 # We cannot know if this was a manual redirect or not.
                 # For safety we register this as a manual one.
                 new_path = new_info
-                new_info = (new_path, now, True)
+                new_info = self._full_value(new_path, now, True)
                 self._paths[old_path] = new_info
             self._rpaths.setdefault(new_path, OOSet()).insert(old_path)
 
         # Look for inconsistenties and fix them:
         # paths that are both in paths and in rpaths.
         bads = [new_path for new_path in self._rpaths if new_path in self._paths]
+        if self._lazy_chains:
+            # These are the hops of lazy chains.
+            self._hops = OOTreeSet(bads)
+            bads = []
         for new_path in bads:
             newer_path = self._paths[new_path][0]
             for old_path in self._rpaths[new_path]:
@@ -146,42 +1479,476 @@ class RedirectionStorage(Persistent):
                 # but new_path points to newer_path.
                 # So update old_path to point to newer_path.
                 info = self._paths[old_path]
-                info = (newer_path, info[1], info[2])
+                info = (newer_path,) + info[1:]
                 self._paths[old_path] = info
                 self._rpaths[newer_path].insert(old_path)
             # self._rpaths[new_path] is empty now
             del self._rpaths[new_path]
 
+        self._migrate_length()
+        if self._bloom is not None:
+            self.enable_bloom_filter(self._bloom.capacity, self._bloom.error_rate)
+        if self._dates is not None:
+            self._build_date_index()
+
+    def _migrate_values(self):
+        """Store all values in the compact format.
+
+        Can be used in migration.  Values that only have a new path get the
+        current date and are marked as manual, like in _rebuild.  Afterwards
+        new redirects are always stored compact, and reading them no longer
+        needs to check which format a value has.
+        """
+        self._flush()
+        now = DateTime()
+        updates = []
+        for old_path, value in self._paths.items():
+            if isinstance(value, tuple) and len(value) == 2:
+                continue
+            new_path, date, manual = _full_info(value)
+            updates.append((old_path, (new_path, _stamp(date or now, manual))))
+        self._paths.update(updates)
+        self._values_version = 1
+        if self._dates is not None:
+            # Values without a date have one now.
+            self._build_date_index()
+        self._changed()
+
+    def _migrate_length(self):
+        """Initialize the length counter from the actual data.
+
+        Can be used in migration of storages that were created before
+        the counter existed.  This walks all buckets of _paths once.
+        """
+        self._flush()
+        self._length = Length(len(self._paths))
+
     def destroy(self, new_path):
-        new_path = self._canonical(new_path)
-        for p in self._rpaths.get(new_path, []):
-            if p in self._paths:
-                del self._paths[p]
-        if new_path in self._rpaths:
-            if new_path in self._rpaths:
-                del self._rpaths[new_path]
+        self.destroy_many([new_path])
+
+    def destroy_many(self, new_paths):
+        """Destroy the redirects to all of new_paths.
+
+        This is faster than calling destroy for each path: we take the sets
+        of old paths for all of them, and remove those old paths in sorted
+        order, so the buckets of _paths are visited in order.
+        """
+        self._flush()
+        self._destroy_or_queue([self._canonical(p) for p in new_paths])
+
+    def destroy_subtree(self, prefix):
+        """Destroy the redirects to prefix and to all paths below it.
+
+        Use this when a folder is removed.  This finds the paths below the
+        prefix with range scans of _rpaths and of the subtree redirects,
+        so it works without knowing what was in the folder.
+        """
+        self._flush()
+        self._destroy_or_queue([self._canonical(prefix) + "/"])
+
+    def _destroy_or_queue(self, new_paths):
+        if self._removals is not None:
+            self._removals.update(new_paths)
+            self._changed()
+        else:
+            self._destroy(new_paths)
+
+    def _destroy(self, new_paths):
+        """Destroy the redirects to new_paths.
+
+        A path that ends with a slash stands for that path and all paths
+        below it, see destroy_subtree.
+        """
+        prefixes = [p[:-1] for p in new_paths if p.endswith("/")]
+        if prefixes:
+            new_paths = [p for p in new_paths if not p.endswith("/")] + prefixes
+        rpaths = self._rpaths
+        rsubtrees = self._rsubtrees
+        if rsubtrees:
+            targets = new_paths + [
+                target
+                for prefix in prefixes
+                for target in _string_keys_under(rsubtrees, prefix)
+            ]
+            for new_path in targets:
+                old_prefixes = rsubtrees.pop(new_path, None)
+                if old_prefixes is not None:
+                    self._changed()
+                    for old_prefix in old_prefixes:
+                        del self._subtrees[old_prefix]
+        keys = [key for key in map(self._key, new_paths) if key is not None]
+        for prefix in prefixes:
+            keys.extend(self._keys_under(rpaths, prefix))
+        keys.sort()
+        if self._lazy_chains:
+            for key in keys:
+                if key in rpaths:
+                    self._destroy_chains(key)
+            return
+        old_paths = []
+        for key in keys:
+            old_paths.extend(rpaths.pop(key, ()))
+        if not old_paths:
+            return
+        self._changed()
+        old_paths.sort()
+        paths = self._paths
+        indexed = self._dates is not None
+        removed = 0
+        for old_path in old_paths:
+            value = paths.pop(old_path, None)
+            if value is not None:
+                removed += 1
+                if indexed:
+                    self._unindex(old_path, value)
+        self._change_length(-removed)
+
+    def _destroy_chains(self, new_path):
+        """Remove the lazy chains that end at the key new_path."""
+        if new_path in self._paths:
+            # The chains go on from here.
+            return
+        self._changed()
+        targets = [new_path]
+        while targets:
+            old_paths = self._rpaths.pop(targets.pop(), ())
+            for p in old_paths:
+                if p in self._paths:
+                    self._unindex(p, self._paths.pop(p))
+                    self._change_length(-1)
+                    targets.append(p)
+
+    def enable_removal_queue(self):
+        """Let destroy only queue the path, see process_removals.
+
+        Removing a folder calls destroy for each item in it, and each call
+        changes the buckets of all redirects to that item.  With the queue,
+        destroy only adds the path to an OOTreeSet, which takes the same
+        time however many redirects there are.  Concurrent transactions that
+        add different paths to the queue rarely conflict.
+
+        Lookups ignore redirects to queued paths, so they are not served.
+        Iterating, len and export_rows still include them until the queue
+        is processed.  Adding a redirect from or to a queued path first
+        processes that path, and with lazy chains also the queued end of
+        the chains through them.
+        """
+        self._flush()
+        if self._removals is None:
+            self._removals = OOTreeSet()
+
+    def disable_removal_queue(self):
+        """Process all queued removals, and let destroy work directly again."""
+        self.process_removals()
+        self._removals = None
+
+    def pending_removals(self):
+        """Get the number of queued removals."""
+        self._flush()
+        if not self._removals:
+            return 0
+        return len(self._removals)
+
+    def process_removals(self, limit=None):
+        """Destroy the redirects to at most limit queued paths.
+
+        Call this regularly from a clock server or cron job, and commit
+        after each batch.  Returns the number of processed paths.
+        """
+        self._flush()
+        if not self._removals:
+            return 0
+        paths = list(islice(self._removals, limit))
+        for path in paths:
+            self._removals.remove(path)
+        self._destroy(paths)
+        return len(paths)
+
+    def _process_removal(self, new_path):
+        """Destroy the redirects to new_path now, if it is queued.
+
+        This includes queued removals of folders that contain new_path.
+        """
+        removals = self._removals
+        queued = [p for p in _removal_entries(new_path) if p in removals]
+        if queued:
+            for p in queued:
+                removals.remove(p)
+            self._destroy(queued)
+
+    def _is_queued(self, new_path):
+        """Is new_path queued for removal?  It expects a string."""
+        removals = self._removals
+        if not removals:
+            return False
+        return any(p in removals for p in _removal_entries(new_path))
+
+    def enable_bloom_filter(self, capacity=None, error_rate=0.01):
+        """Keep a Bloom filter of all old paths.
+
+        Most 404s are for paths without a redirect.  With the filter, looking
+        those up usually does not need to load any buckets of _paths.
+        The filter is kept up to date when adding redirects.  Removed paths
+        stay in the filter until _rebuild is called, which only makes false
+        positives more likely.
+
+        By default the capacity is twice the current number of redirects,
+        with a minimum of 100000.  Calling this again recreates the filter.
+        """
+        self._flush()
+        if capacity is None:
+            capacity = max(2 * len(self), 100000)
+        self._bloom = BloomFilter(capacity, error_rate)
+        for old_path in self:
+            self._bloom.add(old_path)
+
+    def disable_bloom_filter(self):
+        self._bloom = None
+
+    def bloom_filter_info(self):
+        """Report configuration and memory use of the Bloom filter.
+
+        Returns None when there is no filter.
+        """
+        if self._bloom is None:
+            return None
+        return self._bloom.info(count=len(self))
+
+    def enable_interning(self):
+        """Store the prefixes of paths only once.
+
+        Paths of redirects share long prefixes like "/Plone/en/news/2019/".
+        With interning each prefix is stored once, in a PathPrefixes table,
+        and the paths in _paths and _rpaths are bytes with the number of the
+        prefix and the last segment.  This makes the database and the
+        objects in the ZODB cache much smaller, at the cost of a lookup in
+        the table for each path that is passed in or returned.  Adding a
+        redirect from or to a new folder also changes the table.
+
+        The existing redirects are converted.  Old values that only have
+        a new path get the current date and are marked as manual,
+        like in _rebuild.
+        """
+        self._flush()
+        if self._prefixes is not None:
+            return
+        prefixes = PathPrefixes()
+        self._recode(lambda path: prefixes.encode(path, create=True))
+        self._prefixes = prefixes
+
+    def disable_interning(self):
+        """Store paths as strings again, see enable_interning."""
+        self._flush()
+        if self._prefixes is None:
+            return
+        self._recode(self._prefixes.decode)
+        self._prefixes = None
+
+    def _recode(self, recode):
+        """Replace the BTrees by new ones with recoded paths."""
+        # The keys in _hops would need recoding as well.
+        self.compact_chains()
+        now = DateTime()
+        items = []
+        for old_path, value in self._paths.items():
+            if isinstance(value, tuple):
+                value = (recode(value[0]),) + value[1:]
+            else:
+                value = self._full_value(recode(value), now, True)
+            items.append((recode(old_path), value))
+        items.sort(key=itemgetter(0))
+        rpaths = [
+            (recode(new_path), OOSet([recode(p) for p in old_paths]))
+            for new_path, old_paths in self._rpaths.items()
+        ]
+        rpaths.sort(key=itemgetter(0))
+        self._paths = OOBTree()
+        self._paths.update(items)
+        self._rpaths = OOBTree()
+        self._rpaths.update(rpaths)
+        if self._dates is not None:
+            self._build_date_index()
+        self._changed()
+
+    def _lookup(self, old_path, default):
+        if self._bloom is not None and old_path not in self._bloom:
+            return default
+        if self._prefixes is not None:
+            old_path = self._prefixes.encode(old_path)
+            if old_path is None:
+                return default
+        value = self._paths.get(old_path, default)
+        if self._lazy_chains and value is not default:
+            value = self._follow(value)
+            if value is None:
+                return default
+        if self._removals and value is not default:
+            new_path = value[0] if isinstance(value, tuple) else value
+            if self._is_queued(self._path(new_path)):
+                return default
+        return value
 
     def has_path(self, old_path):
+        self._flush()
         old_path = self._canonical(old_path)
-        return old_path in self._paths
+        if self._lookup(old_path, _marker) is not _marker:
+            return True
+        return self._subtree_lookup(old_path) is not None
 
     __contains__ = has_path
 
     def get(self, old_path, default=None):
+        self._flush()
+        new_path = self._find(self._canonical(old_path))
+        return default if new_path is None else new_path
+
+    def _find(self, old_path, subtrees=True):
+        """Get the new path for a canonical old path, or None."""
+        value = self._lookup(old_path, None)
+        if value is None:
+            if not subtrees:
+                return None
+            value = self._subtree_lookup(old_path)
+            return None if value is None else value[0]
+        if self._prefixes is not None:
+            return self._prefixes.decode(value[0])
+        if self._values_version or isinstance(value, tuple):
+            # (new_path, date, manual) or (new_path, stamp)
+            return value[0]
+        # Not migrated yet.
+        return value
+
+    def _find_source(self, old_path):
+        """Get (new_path, source) for a canonical old path, or None.
+
+        source is the old path of the redirect that matched: old_path
+        itself, or the old prefix of a subtree redirect.
+        """
+        new_path = self._find(old_path, subtrees=False)
+        if new_path is not None:
+            return (new_path, old_path)
+        match = self._subtree_match(old_path)
+        if match is None:
+            return None
+        return (match[1][0], match[0])
+
+    def resolve(self, path_elements, query_string="", template_id=None):
+        """Find where a path that was not found should redirect to.
+
+        This is what the 404 view needs, in one call.  We try in order:
+
+        - "query": the path with the query string,
+        - "path": the path itself,
+        - "view": the path before the first element that starts with "@@",
+          with the rest appended, like "/old/@@images/image",
+        - "template": the parent path, with template_id appended, which
+          defaults to the last element,
+        - "ancestor": the nearest ancestor with a redirect, with the rest of
+          the path appended, like after importing only "/old-folder",
+        - "rule": the rules, see add_rule.
+
+        Returns (new_path, query_string, kind, source), where kind is one
+        of the above.  source is what the hits of the redirect are counted
+        for, see enable_hit_tracking: the old path of the redirect that was
+        used, the old prefix of a subtree redirect, or the pattern of a
+        rule.  So a crawler that tries many paths below an old folder does
+        not add a hit for each of them.  The query string is empty when it
+        was part of the old path.  When nothing matches, new_path, kind and
+        source are None.
+        """
+        self._flush()
+        old_path = "/".join(path_elements)
+        if query_string:
+            candidate = self._canonical(f"{old_path}?{query_string}")
+            found = self._find_source(candidate)
+            if found and found[0]:
+                return (found[0], "", "query", found[1])
         old_path = self._canonical(old_path)
-        new_path = self._paths.get(old_path, default)
-        if isinstance(new_path, tuple):
-            # (new_path, date, manual)
-            return new_path[0]
-        return new_path
+        found = self._find_source(old_path)
+        if found and found[0]:
+            return (found[0], query_string, "path", found[1])
+        # The view, template and ancestor candidates share their parents.
+        parents = {}
+        if len(path_elements) > 1:
+            for index, element in enumerate(path_elements):
+                if element.startswith("@@"):
+                    parent = "/".join(path_elements[:index])
+                    found = parents[parent] = self._find_source(self._canonical(parent))
+                    if found and found[0] and found[0] != parent:
+                        view = "/".join(path_elements[index:])
+                        return (f"{found[0]}/{view}", query_string, "view", found[1])
+                    break
+            parent = "/".join(path_elements[:-1])
+            if parent in parents:
+                found = parents[parent]
+            else:
+                found = parents[parent] = self._find_source(self._canonical(parent))
+            if found and found[0] == parent:
+                logger.warning("source and target are equal : [%s]", parent)
+            elif found and found[0]:
+                if template_id is None:
+                    template_id = path_elements[-1]
+                new_path = f"{found[0]}/{template_id}"
+                return (new_path, query_string, "template", found[1])
+        found = self._find_ancestor(old_path, parents)
+        if found is not None:
+            new_path, ancestor = found
+            return (new_path, query_string, "ancestor", ancestor)
+        found = self._match_rule(old_path)
+        if found is not None:
+            new_path, pattern = found
+            return (new_path, query_string, "rule", pattern)
+        return (None, query_string, None, None)
+
+    def _find_ancestor(self, old_path, known):
+        """Find the nearest ancestor of old_path with a redirect.
+
+        Returns (new_path, source), where new_path has the rest of
+        old_path appended, or None.  source is the ancestor, or the old
+        prefix of a subtree redirect that matched it.  This is one lookup
+        per level of old_path.  Subtree redirects are already matched by
+        _find for old_path itself, so we only look for exact redirects
+        here.  known has the results of _find_source for ancestors that
+        were looked up already.
+
+        Like for subtree redirects, an ancestor that redirects to old_path
+        or above it is skipped.  With "/news" redirecting to
+        "/news/archive", "/news/archive/missing" would otherwise give
+        "/news/archive/archive/missing", and so on without end.
+        """
+        index = len(old_path)
+        while True:
+            index = old_path.rfind("/", 0, index)
+            if index <= 0:
+                return None
+            ancestor = old_path[:index]
+            if ancestor in known:
+                found = known[ancestor]
+            else:
+                new_path = self._find(ancestor, subtrees=False)
+                found = None if new_path is None else (new_path, ancestor)
+            if found is None or not found[0]:
+                continue
+            new_path = found[0]
+            if not (old_path + "/").startswith(new_path + "/"):
+                return (new_path + old_path[index:], found[1])
 
     def get_full(self, old_path, default=None):
+        self._flush()
         old_path = self._canonical(old_path)
-        new_path = self._paths.get(old_path, default)
-        if isinstance(new_path, tuple):
-            # (new_path, date, manual)
-            return new_path
-        return (new_path, None, True)
+        value = self._lookup(old_path, None)
+        if value is None:
+            value = self._subtree_lookup(old_path)
+            if value is None:
+                return (default, None, True)
+            return _full_info(value)
+        if self._values_version:
+            info = _compact_info(value)
+        else:
+            info = _full_info(value)
+        if self._prefixes is not None:
+            info = (self._prefixes.decode(info[0]),) + info[1:]
+        return info
 
     def __getitem__(self, old_path):
         result = self.get(old_path, default=_marker)
@@ -190,8 +1957,52 @@ class RedirectionStorage(Persistent):
         return result
 
     def redirects(self, new_path):
+        return list(self.iter_redirects(new_path))
+
+    def iter_redirects(self, new_path):
+        """Iterate over the old paths that redirect to new_path, in order.
+
+        Unlike redirects, this does not copy them all into a list first.
+        Do not change the redirects to new_path while iterating.
+        With lazy chains, the old paths that reach new_path through other
+        old paths come after those that redirect to it directly.
+        """
+        old_paths = self._old_paths(new_path)
+        if self._prefixes is None:
+            return iter(old_paths)
+        return map(self._prefixes.decode, old_paths)
+
+    def count_redirects(self, new_path):
+        """Get the number of old paths that redirect to new_path."""
+        return len(self._old_paths(new_path))
+
+    def _old_paths(self, new_path):
+        """Get the set of keys of the old paths that redirect to new_path."""
+        self._flush()
         new_path = self._canonical(new_path)
-        return [a for a in self._rpaths.get(new_path, [])]
+        if self._is_queued(new_path):
+            return ()
+        new_path = self._key(new_path)
+        if new_path is None:
+            return ()
+        old_paths = self._rpaths.get(new_path, ())
+        if self._lazy_chains and old_paths:
+            if new_path in self._paths:
+                # The chains go on from here.
+                return ()
+            return self._chain_old_paths(old_paths)
+        return old_paths
+
+    def _chain_old_paths(self, old_paths):
+        """Get the keys of old_paths and of the old paths that reach them."""
+        result = list(old_paths)
+        seen = set(result)
+        for old_path in result:
+            for p in self._rpaths.get(old_path, ()):
+                if p not in seen:
+                    seen.add(p)
+                    result.append(p)
+        return result
 
     def _canonical(self, path):
         if path.endswith("/"):
@@ -199,7 +2010,549 @@ class RedirectionStorage(Persistent):
         return path
 
     def __iter__(self):
-        return iter(self._paths)
+        self._flush()
+        if self._prefixes is None:
+            return iter(self._paths)
+        return map(self._prefixes.decode, self._paths)
 
     def __len__(self):
-        return len(self._paths)
+        self._flush()
+        if self._length is None:
+            # Not migrated yet.
+            return len(self._paths)
+        return self._length()
+
+
+def _apply_deferred(txn):
+    """Apply the deferred changes of a transaction that is committing."""
+    for storage, pending in _deferred.pop(txn, {}).items():
+        if pending.changes:
+            storage._apply_deferred(pending.take())
+
+
+@implementer(ISavepointDataManager)
+class _DeferredDataManager:
+    """Forget the deferred changes when their transaction is rolled back.
+
+    The changes are applied by a before commit hook, so there is nothing
+    to do when committing.  When this joins the transaction after a
+    savepoint, rolling back that savepoint calls abort.
+    """
+
+    def __init__(self, txn, transaction_manager):
+        self.txn = txn
+        self.transaction_manager = transaction_manager
+
+    def abort(self, txn):
+        _deferred.pop(self.txn, None)
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        _deferred.pop(self.txn, None)
+
+    def tpc_abort(self, txn):
+        _deferred.pop(self.txn, None)
+
+    def sortKey(self):
+        return f"plone.app.redirector.storage:{id(self)}"
+
+    def savepoint(self):
+        return _DeferredSavepoint(_deferred.get(self.txn, {}))
+
+
+class _DeferredSavepoint:
+    """The deferred changes of all storages at a savepoint."""
+
+    def __init__(self, storages):
+        self.storages = storages
+        # A flush gives the changes to _apply_deferred and starts a new
+        # list, so keeping the list and its length is enough.
+        self.saved = {
+            storage: (pending.changes, len(pending.changes))
+            for storage, pending in storages.items()
+        }
+
+    def rollback(self):
+        for storage in list(self.storages):
+            saved = self.saved.get(storage)
+            if saved is None:
+                del self.storages[storage]
+            else:
+                changes, length = saved
+                self.storages[storage].restore(changes[:length])
+
+
+class _DeferredChanges:
+    """The deferred changes of a storage in one transaction."""
+
+    def __init__(self):
+        # (old_path, new_path) in order, where old_path is None for
+        # destroying the redirects to new_path
+        self.changes = []
+        self.destroys = False
+        # old path -> new path of its last move, and the new paths, for the
+        # moves since the last destroy
+        self.moves = {}
+        self.targets = set()
+        # (old prefix, new prefix) of the subtree redirects added in the
+        # transaction, see add_subtree
+        self.subtrees = set()
+
+    def move(self, old_path, new_path):
+        self.changes.append((old_path, new_path))
+        self.moves[old_path] = new_path
+        self.targets.add(new_path)
+
+    def destroy(self, new_path):
+        self.changes.append((None, new_path))
+        self.destroys = True
+        self.moves.clear()
+        self.targets.clear()
+
+    def restore(self, changes):
+        """Go back to the given changes, when rolling back a savepoint."""
+        self.take()
+        # The subtree redirects may have been rolled back too.
+        self.subtrees = set()
+        for old_path, new_path in changes:
+            if old_path is None:
+                self.destroy(new_path)
+            else:
+                self.move(old_path, new_path)
+
+    def touches(self, prefix):
+        """Do deferred moves come from or go to prefix or below it?"""
+        below = prefix + "/"
+        return any(
+            path == prefix or path.startswith(below)
+            for paths in (self.moves, self.targets)
+            for path in paths
+        )
+
+    def take(self):
+        """Get the changes, and forget them."""
+        changes = self.changes
+        self.changes = []
+        self.destroys = False
+        self.moves = {}
+        self.targets = set()
+        return changes
+
+
+def _removal_entries(new_path):
+    """Get the entries in the removal queue that would destroy new_path.
+
+    These are the path itself, and the subtrees of the path and its parents.
+    """
+    if new_path.endswith("/"):
+        new_path = new_path[:-1]
+    yield new_path
+    index = len(new_path)
+    while index > 0:
+        yield new_path[:index] + "/"
+        index = new_path.rfind("/", 0, index)
+
+
+def _string_keys_under(tree, prefix):
+    """Get a list of the string keys in tree that start with prefix + "/"."""
+    # "0" comes right after "/".
+    return list(tree.keys(min=prefix + "/", max=prefix + "0", excludemax=True))
+
+
+def _new_path(value):
+    """Get the new path of a value of _paths."""
+    if isinstance(value, tuple):
+        return value[0]
+    # Not migrated yet.
+    return value
+
+
+def _is_manual(value):
+    """Get the manual flag of a full value of _paths."""
+    if len(value) == 2:
+        # compact
+        return bool(value[1] & 1)
+    return value[2]
+
+
+def _matches(value, start, end, manual):
+    """Does a value of _paths match the filters of items_from?
+
+    start and end are in microseconds since the epoch, or None.
+    """
+    if not isinstance(value, tuple):
+        # Not migrated yet: no date, and manual.
+        micros = None
+        is_manual = True
+    elif len(value) == 2:
+        # compact
+        micros = value[1] >> 1
+        is_manual = bool(value[1] & 1)
+    else:
+        micros = None if value[1] is None else value[1].micros()
+        is_manual = value[2]
+    if manual is not None and is_manual != manual:
+        return False
+    if start is None and end is None:
+        return True
+    if micros is None:
+        return False
+    return (start is None or micros >= start) and (end is None or micros <= end)
+
+
+def _date_entry(key, value):
+    """Get the entry in the date index for a key and value of _paths.
+
+    Returns None when the value has no date.
+    """
+    if not isinstance(value, tuple):
+        return None
+    if len(value) == 2:
+        # compact
+        return (-(value[1] >> 1), key)
+    if value[1] is None:
+        return None
+    return (-value[1].micros(), key)
+
+
+def _is_manual_value(value):
+    """Get the manual flag of any value of _paths."""
+    if not isinstance(value, tuple):
+        # Not migrated yet: we treat it as manual.
+        return True
+    return _is_manual(value)
+
+
+def _same_state(value, other):
+    """Are two values from the states in a conflict the same?"""
+    try:
+        return value is other or value == other
+    except ValueError:
+        # Persistent references to different objects.
+        return False
+
+
+def _full_info(value):
+    """Get (new_path, date, manual) for a value of _paths."""
+    if not isinstance(value, tuple):
+        # Not migrated yet.
+        return (value, None, True)
+    if len(value) == 2:
+        return _compact_info(value)
+    # (new_path, date, manual)
+    return value
+
+
+def _compact_info(value):
+    """Get (new_path, date, manual) for a compact value of _paths.
+
+    See RedirectionStorage.compact_values.
+    """
+    new_path, stamp = value
+    return (new_path, DateTime((stamp >> 1) / 1000000.0, "UTC"), bool(stamp & 1))
+
+
+@contextmanager
+def _gc_paused(size):
+    """Pause the cyclic garbage collector during a bulk load of size rows.
+
+    Every row tuple and OOSet that we make is tracked by the collector, so
+    making hundreds of thousands of them runs it over and over, while none
+    of them are garbage.  The collector is paused for the whole process,
+    including the other threads that serve requests, so we only do this
+    for explicit imports of at least GC_PAUSE_SIZE rows.
+    """
+    if size < GC_PAUSE_SIZE or not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+def _stamp(date, manual):
+    """Combine date and manual into one number for a compact value."""
+    if date is None:
+        micros = int(time() * 1000000)
+    else:
+        micros = date.micros()
+    return micros << 1 | bool(manual)
+
+
+class _BulkLoader:
+    """Add many redirects to a RedirectionStorage at once.
+
+    The end result is the same as calling RedirectionStorage.add for each
+    redirect in the same order, but the BTrees are only changed when calling
+    write, in sorted key order, so each bucket is loaded and changed once.
+
+    Most batches, like a csv upload of redirects to existing content, contain
+    no chains: no new path is also an old path, and nothing redirects to one
+    of the old paths yet.  Then the last redirect for an old path wins and we
+    can write everything in a few sorted passes.  Otherwise we apply the add
+    logic in order, on plain dictionaries and sets that are filled from the
+    BTrees the first time a path is needed.  This resolves chains within the
+    batch and chains through existing redirects.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        # (old path, full value) in the order they were added
+        self.rows = []
+        # the keys of the old paths in rows
+        self.old_paths = set()
+        # Without subtree redirects, queued removals, a Bloom filter or
+        # interning, the keys are the canonical paths and adding a row
+        # only needs to append it.
+        self.plain = not (
+            storage._rsubtrees
+            or storage._removals
+            or storage._bloom is not None
+            or storage._prefixes is not None
+        )
+        # the full value without the new path, for the last now and manual
+        self.now = self.manual = _marker
+        self.tail = None
+
+    def add(self, old_path, new_path, now, manual):
+        if self.plain:
+            # This is _canonical and _append, inlined for speed.
+            if old_path.endswith("/"):
+                old_path = old_path[:-1]
+            if new_path.endswith("/"):
+                new_path = new_path[:-1]
+            if old_path == new_path:
+                return
+            if now is not self.now or manual is not self.manual:
+                self.now = now
+                self.manual = manual
+                self.tail = self.storage._full_value(None, now, manual)[1:]
+            self.rows.append((old_path, (new_path,) + self.tail))
+            self.old_paths.add(old_path)
+            return
+        storage = self.storage
+        old_path = storage._canonical(old_path)
+        new_path = storage._canonical(new_path)
+        if old_path != new_path:
+            if storage._rsubtrees:
+                if storage._removals:
+                    # Destroying them may change the subtree redirects.
+                    storage._process_removal(old_path)
+                    storage._process_removal(new_path)
+                for p in storage._diverged(old_path, self.old_paths):
+                    self._append(p, new_path, now, manual)
+            self._append(old_path, new_path, now, manual)
+
+    def _append(self, old_path, new_path, now, manual):
+        storage = self.storage
+        if old_path != new_path:
+            if storage._removals:
+                storage._process_removal(old_path)
+                storage._process_removal(new_path)
+            if storage._bloom is not None:
+                storage._bloom.add(old_path)
+            old_path = storage._key(old_path, create=True)
+            new_path = storage._key(new_path, create=True)
+            full_value = storage._full_value(new_path, now, manual)
+            self.rows.append((old_path, full_value))
+            self.old_paths.add(old_path)
+
+    def write(self):
+        if not self.rows:
+            return
+        storage = self.storage
+        storage._changed()
+        if storage._lazy_chains:
+            for old_path, full_value in self.rows:
+                if storage._removals:
+                    storage._process_chain_removal(old_path)
+                    storage._process_chain_removal(full_value[0])
+                storage._add_hop(old_path, full_value, _is_manual(full_value))
+        elif self._has_chains():
+            self._write_in_order()
+        else:
+            self._write_independent()
+        self.rows = []
+        self.old_paths = set()
+
+    def _has_chains(self):
+        old_paths = self.old_paths
+        if not old_paths.isdisjoint([value[0] for old_path, value in self.rows]):
+            return True
+        rpaths = self.storage._rpaths
+        return bool(rpaths) and any(old_path in rpaths for old_path in old_paths)
+
+    def _write_independent(self):
+        storage = self.storage
+        paths = storage._paths
+        rpaths = storage._rpaths
+        # The last redirect for an old path wins.  We sort the rows by old
+        # path, so each bucket of _paths is changed once, and the old paths
+        # for a new path are in order when we make their OOSet.
+        final = sorted(dict(self.rows).items())
+
+        # new path -> old paths that we add or remove
+        added = {}
+        removed = {}
+        if not paths:
+            delta = len(final)
+            for old_path, value in final:
+                added.setdefault(value[0], []).append(old_path)
+        else:
+            delta = 0
+            for old_path, value in final:
+                added.setdefault(value[0], []).append(old_path)
+                existing_target = paths.get(old_path)
+                if existing_target is None:
+                    delta += 1
+                    continue
+                storage._unindex(old_path, existing_target)
+                if isinstance(existing_target, tuple):
+                    existing_target = existing_target[0]
+                if existing_target != value[0]:
+                    removed.setdefault(existing_target, []).append(old_path)
+
+        paths.update(final)
+        storage._change_length(delta)
+        if storage._dates is not None:
+            for old_path, value in final:
+                storage._index(old_path, value)
+
+        if not rpaths:
+            rpaths.update(sorted((new_path, OOSet(p)) for new_path, p in added.items()))
+            return
+        new_sets = []
+        for new_path in sorted(added.keys() | removed.keys()):
+            old_paths = rpaths.get(new_path)
+            if old_paths is None:
+                if new_path in added:
+                    new_sets.append((new_path, OOSet(added[new_path])))
+                continue
+            for p in removed.get(new_path, ()):
+                if p in old_paths:
+                    old_paths.remove(p)
+            old_paths.update(added.get(new_path, ()))
+            if not old_paths:
+                del rpaths[new_path]
+        rpaths.update(new_sets)
+
+    def _write_in_order(self):
+        # old path -> full value, or None if it is not (or no longer) there
+        self.paths = {}
+        # old path -> value, for the old paths that were in the storage
+        # when we loaded them
+        self.existing = {}
+        # new path -> set of old paths
+        self.rpaths = {}
+        # keys of paths and rpaths that we have changed
+        self.changed_paths = set()
+        self.changed_rpaths = set()
+        for old_path, full_value in self.rows:
+            self._add(old_path, full_value)
+        self._write_changes()
+
+    def _get(self, old_path):
+        value = self.paths.get(old_path, _marker)
+        if value is not _marker:
+            return value
+        value = self.storage._paths.get(old_path)
+        self.paths[old_path] = value
+        if value is not None:
+            self.existing[old_path] = value
+        return value
+
+    def _set(self, old_path, value):
+        if old_path not in self.paths:
+            self._get(old_path)
+        self.paths[old_path] = value
+        self.changed_paths.add(old_path)
+
+    def _redirects(self, new_path):
+        result = self.rpaths.get(new_path)
+        if result is None:
+            result = set(self.storage._rpaths.get(new_path, ()))
+            self.rpaths[new_path] = result
+        return result
+
+    def _add(self, old_path, full_value):
+        # This follows RedirectionStorage.add.
+        new_path = full_value[0]
+
+        # Forget any existing reverse paths to old_path
+        existing_target = self._get(old_path)
+        if isinstance(existing_target, tuple):
+            existing_target = existing_target[0]
+        if existing_target is not None:
+            self._redirects(existing_target).discard(old_path)
+            self.changed_rpaths.add(existing_target)
+
+        # Update any references that pointed to old_path
+        redirects = self._redirects(old_path)
+        if redirects:
+            new_redirects = self._redirects(new_path)
+            for p in redirects:
+                if p != new_path:
+                    old_full_value = self._get(p)
+                    if isinstance(old_full_value, tuple):
+                        # keep date and manual
+                        new_full_value = (new_path,) + old_full_value[1:]
+                    else:
+                        new_full_value = full_value
+                    self._set(p, new_full_value)
+                    new_redirects.add(p)
+                else:
+                    # There is an existing redirect from new_path to old_path.
+                    # This is not useful, so we delete it.
+                    self._set(new_path, None)
+            redirects.clear()
+            self.changed_rpaths.add(old_path)
+
+        self._set(old_path, full_value)
+        self._redirects(new_path).add(old_path)
+        self.changed_rpaths.add(new_path)
+
+    def _write_changes(self):
+        storage = self.storage
+        delta = 0
+        updates = []
+        for old_path in sorted(self.changed_paths):
+            value = self.paths[old_path]
+            existing = self.existing.get(old_path)
+            storage._unindex(old_path, existing)
+            if value is None:
+                if existing is not None:
+                    del storage._paths[old_path]
+                    delta -= 1
+            else:
+                if existing is None:
+                    delta += 1
+                storage._index(old_path, value)
+                updates.append((old_path, value))
+        storage._paths.update(updates)
+        storage._change_length(delta)
+
+        for new_path in sorted(self.changed_rpaths):
+            old_paths = self.rpaths[new_path]
+            existing = storage._rpaths.get(new_path)
+            if existing is None:
+                if old_paths:
+                    storage._rpaths[new_path] = OOSet(old_paths)
+                continue
+            if not old_paths:
+                del storage._rpaths[new_path]
+                continue
+            for p in [p for p in existing if p not in old_paths]:
+                existing.remove(p)
+            added = [p for p in old_paths if p not in existing]
+            if added:
+                existing.update(added)
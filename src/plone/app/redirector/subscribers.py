@@ -1,5 +1,8 @@
 from Acquisition import aq_base
+from plone.app.redirector.cache import parent_cache
 from plone.app.redirector.interfaces import IRedirectionStorage
+from Products.CMFCore.interfaces import IContentish
+from Products.CMFCore.interfaces import IFolderish
 from zope.component import queryUtility
 
 
@@ -12,6 +15,7 @@ def objectMoved(obj, event):
         and event.newParent is not None
         and event.oldName is not None
     ):
+        parent_cache.clear()
         storage = queryUtility(IRedirectionStorage)
         if storage is None:
             return
@@ -28,14 +32,38 @@ def objectMoved(obj, event):
 
         if aq_base(event.object) is not aq_base(obj):
             new_path_of_moved = "/".join(event.object.getPhysicalPath())
+            old_path_of_moved = old_path
             old_path = old_path + new_path[len(new_path_of_moved) :]
+            if storage.subtree_moves:
+                # The moved folder gets one subtree redirect for all its
+                # contents, so we only need to store children that differ.
+                # The children may get the event before the folder itself.
+                _add_subtree(
+                    storage, event.object, old_path_of_moved, new_path_of_moved
+                )
+                if storage.has_redirect(old_path, new_path):
+                    return
+        elif storage.subtree_moves:
+            _add_subtree(storage, obj, old_path, new_path)
 
-        storage.add(old_path, new_path)
+        storage.add_deferred(old_path, new_path)
+
+
+def _add_subtree(storage, obj, old_path, new_path):
+    if IFolderish.providedBy(obj) and storage.get_subtree(old_path) != new_path:
+        storage.add_subtree(old_path, new_path)
 
 
 def objectRemoved(obj, event):
     """Tell the redirection storage that the object was removed"""
+    if aq_base(event.object) is not aq_base(obj) and IContentish.providedBy(
+        event.object
+    ):
+        # This event gets redispatched to children.  The removed object
+        # itself takes care of everything below it.
+        return
+    parent_cache.clear()
     storage = queryUtility(IRedirectionStorage)
     if storage is not None:
         path = "/".join(obj.getPhysicalPath())
-        storage.destroy(path)
+        storage.destroy_deferred(path, subtree=True)
@@ -0,0 +1,78 @@
+from plone.app.redirector.bloom import BLOCK_BITS
+from plone.app.redirector.bloom import BloomFilter
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+
+import os
+import tempfile
+import transaction
+import unittest
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Test the BloomFilter class."""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f"/plone/folder/{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        for key in keys:
+            self.assertIn(key, bloom)
+
+    def test_error_rate(self):
+        bloom = BloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(f"/plone/folder/{i}")
+        false_positives = sum(f"/plone/other/{i}" in bloom for i in range(10000))
+        # We expect about 100.
+        self.assertLess(false_positives, 200)
+
+    def test_info(self):
+        bloom = BloomFilter(capacity=1000000, error_rate=0.01)
+        info = bloom.info()
+        self.assertEqual(info["capacity"], 1000000)
+        self.assertEqual(info["error_rate"], 0.01)
+        self.assertEqual(info["hash_count"], 7)
+        # About 1.2 MB
+        self.assertEqual(info["blocks"], 147)
+        self.assertEqual(info["bytes"], 147 * BLOCK_BITS // 8)
+        self.assertNotIn("estimated_error_rate", info)
+        self.assertEqual(bloom.info(count=0)["estimated_error_rate"], 0)
+        self.assertLess(bloom.info(count=1000000)["estimated_error_rate"], 0.01)
+        self.assertGreater(bloom.info(count=2000000)["estimated_error_rate"], 0.1)
+        # A small filter does not need a full block.
+        info = BloomFilter(capacity=10, error_rate=0.01).info()
+        self.assertEqual(info["blocks"], 1)
+        self.assertEqual(info["bytes"], 16)
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            BloomFilter(capacity=0)
+        with self.assertRaises(ValueError):
+            BloomFilter(error_rate=0)
+        with self.assertRaises(ValueError):
+            BloomFilter(error_rate=1)
+
+    def test_conflict_resolution(self):
+        # Concurrent additions are combined.
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        db = DB(FileStorage(os.path.join(tmpdir.name, "Data.fs")))
+        self.addCleanup(db.close)
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        conn1.root()["bloom"] = BloomFilter(capacity=10)
+        tm1.commit()
+        conn2 = db.open(transaction_manager=tm2)
+        conn1.root()["bloom"].add("/foo")
+        conn2.root()["bloom"].add("/bar")
+        tm1.commit()
+        tm2.commit()
+        conn1.close()
+        conn2.close()
+        with db.transaction() as conn:
+            bloom = conn.root()["bloom"]
+            self.assertIn("/foo", bloom)
+            self.assertIn("/bar", bloom)
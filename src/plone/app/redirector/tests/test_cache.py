@@ -0,0 +1,127 @@
+from plone.app.redirector.cache import LRUCache
+from plone.app.redirector.cache import TTLCache
+from plone.app.redirector.storage import RedirectionStorage
+from ZODB import DB
+
+import transaction
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test the LRUCache class."""
+
+    def test_get_set(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get("foo"))
+        self.assertEqual(cache.get("foo", "default"), "default")
+        cache.set("foo", "bar")
+        self.assertEqual(cache.get("foo"), "bar")
+        cache.set("foo", None)
+        self.assertIsNone(cache.get("foo", "default"))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_forgotten(self):
+        cache = LRUCache(3)
+        for key in "abc":
+            cache.set(key, key)
+        # Use "a", so "b" is the least recently used.
+        cache.get("a")
+        cache.set("d", "d")
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "a")
+        self.assertEqual(cache.get("c"), "c")
+        self.assertEqual(cache.get("d"), "d")
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set("foo", "bar")
+        self.assertIsNone(cache.get("foo"))
+
+
+class TestTTLCache(unittest.TestCase):
+    """Test the TTLCache class."""
+
+    def test_expires(self):
+        now = [100.0]
+        cache = TTLCache(10, 60, clock=lambda: now[0])
+        cache.set("foo", "bar")
+        cache.set("none", None)
+        now[0] = 159.0
+        self.assertEqual(cache.get("foo"), "bar")
+        self.assertIsNone(cache.get("none", "default"))
+        now[0] = 160.0
+        self.assertEqual(cache.get("foo", "default"), "default")
+        self.assertEqual(cache.get("none", "default"), "default")
+        cache.set("foo", "baz")
+        self.assertEqual(cache.get("foo"), "baz")
+
+
+class TestStorageVersion(unittest.TestCase):
+    """Test the version method of the storage."""
+
+    def setUp(self):
+        self.db = DB(None)
+        self.connection = self.db.open()
+
+    def tearDown(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+
+    def test_not_in_database(self):
+        st = RedirectionStorage()
+        self.assertIsNone(st.version())
+        # A storage from before the generation counter existed.
+        del st._generation
+        self.assertIsNone(st.version())
+
+    def test_changes(self):
+        st = RedirectionStorage()
+        self.connection.root()["storage"] = st
+        transaction.commit()
+        version = st.version()
+        self.assertIsNotNone(version)
+        self.assertEqual(st.version(), version)
+
+        # Uncommitted changes must not be cached.
+        st.add("/foo", "/bar")
+        self.assertIsNone(st.version())
+        transaction.commit()
+        new_version = st.version()
+        self.assertIsNotNone(new_version)
+        self.assertNotEqual(new_version, version)
+
+        # An aborted change keeps the old version.
+        st.add("/foo", "/baz")
+        transaction.abort()
+        self.assertEqual(st.version(), new_version)
+
+        # The version is the same in a fresh cache.
+        self.connection.cacheMinimize()
+        self.assertEqual(st.version(), new_version)
+
+    def test_no_change_without_effect(self):
+        st = RedirectionStorage()
+        st.add("/foo", "/bar")
+        self.connection.root()["storage"] = st
+        transaction.commit()
+        version = st.version()
+        st.add("/foo", "/foo")
+        st.destroy("/unknown")
+        st.update({})
+        self.assertEqual(st.version(), version)
+        for change in (
+            lambda: st.add("/baz", "/bar"),
+            lambda: st.remove("/baz"),
+            lambda: st.update({"/baz": "/bar"}),
+            lambda: st.destroy("/bar"),
+            lambda: st.clear(),
+            lambda: st._rebuild(),
+        ):
+            change()
+            self.assertIsNone(st.version())
+            transaction.commit()
+            self.assertNotEqual(st.version(), version)
+            version = st.version()
@@ -1,4 +1,5 @@
 from plone.app.redirector.interfaces import IRedirectionStorage
+from plone.app.redirector.storage import _apply_deferred
 from plone.app.redirector.testing import PLONE_APP_REDIRECTOR_INTEGRATION_TESTING
 from plone.app.testing import setRoles
 from plone.app.testing import TEST_USER_ID
@@ -43,6 +44,41 @@ class TestRedirectorEvents(unittest.TestCase):
         self.assertEqual(self.storage.get(fp + "/p1"), fp + "/f1/p1")
         self.assertEqual(self.storage.get(fp + "/p2"), fp + "/f1/p2")
 
+    def test_cut_paste_defers_storage(self):
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.invokeFactory("Document", "p1")
+        self.folder.invokeFactory("Document", "p2")
+        transaction.savepoint(1)
+        cp = self.folder.manage_cutObjects(ids=("p1", "p2"))
+        self.folder.f1.manage_pasteObjects(cp)
+
+        # The redirects are added when committing, or when reading.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertNotIn(fp + "/p1", self.storage._paths)
+        hooks = [hook for hook, args, kws in transaction.get().getBeforeCommitHooks()]
+        self.assertIn(_apply_deferred, hooks)
+        self.assertEqual(self.storage.get(fp + "/p1"), fp + "/f1/p1")
+        self.assertIn(fp + "/p2", self.storage._paths)
+
+    def test_cut_paste_folders_defers_storage(self):
+        self.storage.subtree_moves = True
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.invokeFactory("Folder", "f2")
+        self.folder.invokeFactory("Folder", "f3")
+        self.folder.f2.invokeFactory("Document", "p1")
+        self.folder.f3.invokeFactory("Document", "p2")
+        transaction.savepoint(1)
+        cp = self.folder.manage_cutObjects(ids=("f2", "f3"))
+        self.folder.f1.manage_pasteObjects(cp)
+
+        # The events of the children do not add the deferred redirects.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertNotIn(fp + "/f2", self.storage._paths)
+        self.assertNotIn(fp + "/f3", self.storage._paths)
+        self.assertEqual(self.storage.get(fp + "/f2/p1"), fp + "/f1/f2/p1")
+        self.assertEqual(self.storage.get(fp + "/f3"), fp + "/f1/f3")
+        self.assertNotIn(fp + "/f3/p2", self.storage._paths)
+
     def test_cut_paste_rename_updates_storage(self):
         self.folder.invokeFactory("Folder", "f1")
         self.folder.invokeFactory("Document", "p1")
@@ -83,8 +119,38 @@ class TestRedirectorEvents(unittest.TestCase):
 
         self.folder._delObject("f1")
 
+        # The redirects are destroyed at once when committing, or reading.
+        self.assertIn(fp + "/f1/p1", self.storage._paths)
         self.assertEqual(self.storage.get(fp + "/f1/p1"), None)
 
+    def test_delete_with_removal_queue(self):
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.f1.invokeFactory("Document", "p1")
+        transaction.savepoint(1)
+        self.folder.f1.manage_renameObject("p1", "p2")
+        self.storage.enable_removal_queue()
+        self.folder._delObject("f1")
+
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertIsNone(self.storage.get(fp + "/f1/p1"))
+        # One removal for the folder and everything in it.
+        self.assertEqual(self.storage.pending_removals(), 1)
+        self.assertEqual(self.storage.process_removals(), 1)
+        self.assertNotIn(fp + "/f1/p1", list(self.storage))
+
+    def test_delete_destroys_references_below(self):
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.f1.invokeFactory("Document", "p1")
+        transaction.savepoint(1)
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.storage.add("/plone/old", fp + "/f1/p1/@@images/image")
+        self.storage.add("/plone/other", fp + "/f10")
+
+        self.folder._delObject("f1")
+
+        self.assertIsNone(self.storage.get("/plone/old"))
+        self.assertEqual(self.storage.get("/plone/other"), fp + "/f10")
+
     def test_rename_updates_parent_and_children(self):
         self.folder.invokeFactory("Folder", "f1")
         self.folder.f1.invokeFactory("Document", "p1")
@@ -141,6 +207,91 @@ class TestRedirectorEvents(unittest.TestCase):
         self.assertEqual(self.storage.get(fp + "/f1/f11/p1"), fp + "/f2a/f1/f11/p1")
         self.assertEqual(self.storage.get(fp + "/f1/f11/p2"), fp + "/f2a/f1/f11/p2")
 
+    def test_rename_folder_lists_children(self):
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.f1.invokeFactory("Document", "p1")
+        transaction.savepoint(1)
+        orig_len = len(self.storage)
+        self.folder.manage_renameObject("f1", "f2")
+
+        # Without subtree_moves, each item has its own redirect.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertEqual(len(self.storage), orig_len + 2)
+        self.assertListEqual(self.storage.subtrees(), [])
+        self.assertListEqual(self.storage.redirects(fp + "/f2/p1"), [fp + "/f1/p1"])
+        self.assertFalse(self.storage.has_path(fp + "/f1/missing"))
+
+    def test_rename_folder_stores_subtree(self):
+        self.storage.subtree_moves = True
+        self.folder.invokeFactory("Folder", "f1")
+        self.folder.f1.invokeFactory("Folder", "f11")
+        self.folder.f1.f11.invokeFactory("Document", "p1")
+        self.folder.f1.invokeFactory("Document", "p2")
+        transaction.savepoint(1)
+        orig_len = len(self.storage)
+        self.folder.manage_renameObject("f1", "f2")
+
+        # Only the folder itself has its own redirect.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertEqual(len(self.storage), orig_len + 1)
+        self.assertIn((fp + "/f1", fp + "/f2"), self.storage.subtrees())
+        self.assertEqual(self.storage.get(fp + "/f1/f11/p1"), fp + "/f2/f11/p1")
+
+        # A child that is moved later gets its own redirect.
+        transaction.savepoint(1)
+        self.folder.f2.f11.manage_renameObject("p1", "p3")
+        self.assertEqual(self.storage.get(fp + "/f1/f11/p1"), fp + "/f2/f11/p3")
+        self.assertEqual(self.storage.get(fp + "/f2/f11/p1"), fp + "/f2/f11/p3")
+        self.assertEqual(self.storage.get(fp + "/f1/p2"), fp + "/f2/p2")
+
+        # Deleting the folder removes its subtree redirect.
+        transaction.savepoint(1)
+        self.folder._delObject("f2")
+        self.assertListEqual(self.storage.subtrees(), [])
+        self.assertIsNone(self.storage.get(fp + "/f1/p2"))
+        self.assertIsNone(self.storage.get(fp + "/f1/f11/p1"))
+
+    def test_move_folder_out_of_moved_folder(self):
+        self.storage.subtree_moves = True
+        self.folder.invokeFactory("Folder", "news")
+        self.folder.news.invokeFactory("Folder", "news")
+        self.folder.invokeFactory("Folder", "archive")
+        transaction.savepoint(1)
+        cp = self.folder.manage_cutObjects(ids=("news",))
+        self.folder.archive.manage_pasteObjects(cp)
+        transaction.savepoint(1)
+        cp = self.folder.archive.news.manage_cutObjects(ids=("news",))
+        self.folder.manage_pasteObjects(cp)
+
+        # The subtree redirects form a cycle, which must not be followed.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertEqual(self.storage.get(fp + "/archive/news/news"), fp + "/news")
+        self.assertEqual(self.storage.get(fp + "/news/news"), fp + "/news")
+        self.assertEqual(self.storage.get(fp + "/news/x"), fp + "/archive/news/x")
+
+    def test_move_folder_to_old_path_of_moved_folder(self):
+        self.storage.subtree_moves = True
+        self.folder.invokeFactory("Folder", "a")
+        self.folder.invokeFactory("Folder", "b")
+        self.folder.b.invokeFactory("Document", "z")
+        transaction.savepoint(1)
+        cp = self.folder.manage_cutObjects(ids=("b",))
+        self.folder.a.manage_pasteObjects(cp)
+        transaction.savepoint(1)
+        self.folder.a.manage_renameObject("b", "c")
+        transaction.savepoint(1)
+        self.folder.manage_renameObject("a", "b")
+        transaction.savepoint(1)
+        self.folder.manage_renameObject("b", "n8")
+
+        # The first and the second /b each keep their redirects.
+        fp = "/".join(self.folder.getPhysicalPath())
+        self.assertEqual(self.storage.get(fp + "/b/z"), fp + "/n8/c/z")
+        self.assertEqual(self.storage.get(fp + "/b/c"), fp + "/n8/c")
+        self.assertEqual(self.storage.get(fp + "/b/c/z"), fp + "/n8/c/z")
+        self.assertEqual(self.storage.get(fp + "/a/c/z"), fp + "/n8/c/z")
+        self.assertEqual(self.storage.get(fp + "/b"), fp + "/n8")
+
     def test_add_doesnt_create_storage_entry(self):
         """refers https://dev.plone.org/plone/ticket/8260"""
         orig_len = len(list(self.storage))
@@ -0,0 +1,108 @@
+from DateTime import DateTime
+from plone.app.redirector.hits import flush_hits
+from plone.app.redirector.hits import HitBuffer
+from plone.app.redirector.storage import RedirectionStorage
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+
+import os
+import tempfile
+import transaction
+import unittest
+
+
+class TestHitBuffer(unittest.TestCase):
+    """Test the HitBuffer class."""
+
+    def test_record_drain(self):
+        buffer = HitBuffer()
+        buffer.record("/a", 10)
+        buffer.record("/a", 30)
+        buffer.record("/a", 20)
+        buffer.record("/b", 40)
+        self.assertEqual(len(buffer), 2)
+        self.assertFalse(buffer.due())
+        hits = buffer.drain()
+        self.assertDictEqual(hits, {"/a": (3, 30), "/b": (1, 40)})
+        self.assertEqual(len(buffer), 0)
+        buffer.record("/a", 25)
+        buffer.restore(hits)
+        self.assertDictEqual(buffer.drain(), {"/a": (4, 30), "/b": (1, 40)})
+
+    def test_due(self):
+        buffer = HitBuffer()
+        buffer.flushed = 0
+        self.assertTrue(buffer.due())
+        buffer.drain()
+        self.assertFalse(buffer.due())
+
+
+class TestFlushHits(unittest.TestCase):
+    """Test the flush_hits function."""
+
+    def setUp(self):
+        # A FileStorage resolves conflicts, a MappingStorage does not.
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = DB(FileStorage(os.path.join(self.tmpdir.name, "Data.fs")))
+        self.connection = self.db.open()
+
+    def tearDown(self):
+        transaction.abort()
+        self.connection.close()
+        self.db.close()
+        self.tmpdir.cleanup()
+
+    def test_not_in_database(self):
+        st = RedirectionStorage()
+        st.enable_hit_tracking()
+        buffer = HitBuffer()
+        self.assertEqual(flush_hits(st, buffer), 0)
+        buffer.record("/a", DateTime(2020, 1, 1).micros())
+        self.assertEqual(flush_hits(st, buffer), 1)
+        self.assertEqual(st.get_hits("/a"), (1, DateTime(2020, 1, 1)))
+
+    def test_own_transaction(self):
+        st = RedirectionStorage()
+        st.enable_hit_tracking()
+        self.connection.root()["storage"] = st
+        transaction.commit()
+        buffer = HitBuffer()
+        buffer.record("/a", DateTime(2020, 1, 1).micros())
+        self.assertEqual(flush_hits(st, buffer), 1)
+        # The hits are committed, even when our transaction is aborted.
+        transaction.abort()
+        self.assertEqual(st.get_hits("/a")[0], 1)
+        buffer.record("/a")
+        buffer.record("/b")
+        self.assertEqual(flush_hits(st, buffer), 2)
+        transaction.abort()
+        self.assertEqual(st.get_hits("/a")[0], 2)
+        self.assertEqual(st.get_hits("/b")[0], 1)
+
+    def test_concurrent_flushes(self):
+        st = RedirectionStorage()
+        st.enable_hit_tracking()
+        st.record_hits({f"/{i}": (1, 0) for i in range(10)})
+        self.connection.root()["storage"] = st
+        transaction.commit()
+        # Another process writes other paths in the meantime.
+        manager = transaction.TransactionManager()
+        other = self.db.open(transaction_manager=manager)
+        other.root()["storage"].record_hits({"/1": (5, 0)})
+        buffer = HitBuffer()
+        buffer.record("/8", 10)
+        self.assertEqual(flush_hits(st, buffer), 1)
+        manager.commit()
+        other.close()
+        transaction.abort()
+        self.assertEqual(st.get_hits("/1")[0], 6)
+        self.assertEqual(st.get_hits("/8")[0], 2)
+
+    def test_tracking_disabled(self):
+        st = RedirectionStorage()
+        self.connection.root()["storage"] = st
+        transaction.commit()
+        buffer = HitBuffer()
+        buffer.record("/a")
+        self.assertEqual(flush_hits(st, buffer), 1)
+        self.assertEqual(st.get_hits("/a"), (0, None))
@@ -1,8 +1,17 @@
 from contextlib import contextmanager
+from DateTime import DateTime
+from plone.app.redirector.hits import flush_hits
+from plone.app.redirector.hits import HitBuffer
 from plone.app.redirector.storage import RedirectionStorage
 from time import time
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
 
 import os
+import pickle
+import tempfile
+import tracemalloc
+import transaction
 import unittest
 
 env_name = "PLONE_APP_REDIRECTOR_PERFORMANCE_NUMBER"
@@ -32,12 +41,16 @@ def pretty_number(num):
 class TestStoragePerformance(unittest.TestCase):
     """Test the performance of the RedirectionStorage class."""
 
+    def setUp(self):
+        self.timings = {}
+
     @contextmanager
     def timeit(self, message, limit=0):
         start = time()
         yield
         end = time()
         total = end - start
+        self.timings[message] = total
         # Allow taking at least 0.3 seconds.  Otherwise a really low NUMBER
         # like 0 may give errors like this:
         # AssertionError: Listing all takes too long: 0.00 seconds (max 1e-06)
@@ -76,10 +89,8 @@ class TestStoragePerformance(unittest.TestCase):
         # Can take long.  But 10.000 per second should be no problem.
         # Take one tenth of the items at first.
         num = max(int(NUMBER / 10), 1)
-        with self.timeit(
-            f"Inserting {pretty_number(num)} individual items",
-            num / 10000.0,
-        ):
+        individual_message = f"Inserting {pretty_number(num)} individual items"
+        with self.timeit(individual_message, num / 10000.0):
             for i in range(num):
                 st[f"/old/{i}"] = f"/new/{i}"
 
@@ -96,16 +107,19 @@ class TestStoragePerformance(unittest.TestCase):
         ):
             info = {f"/old/{i}": f"/new/{i}" for i in range(NUMBER)}
 
-        # Can take long.  But 10.000 per second should be no problem.
-        with self.timeit(
-            f"Inserting {pretty_number(NUMBER)} prepared items in bulk",
-            NUMBER / 10000.0,
-        ):
+        # The bulk import does not call add for each item,
+        # so 50.000 per second should be no problem.
+        bulk_message = f"Inserting {pretty_number(NUMBER)} prepared items in bulk"
+        with self.timeit(bulk_message, NUMBER / 50000.0):
             # Prepare input:
             info = {}
             for i in range(NUMBER):
                 info[f"/old/{i}"] = f"/new/{i}"
             st.update(info)
+        if VERBOSE:
+            individual = self.timings[individual_message] / num
+            bulk = self.timings[bulk_message] / NUMBER
+            print(f"Bulk insert speedup per item: {individual / bulk:.1f}x")
 
         # Should be almost instantaneous.
         with self.timeit("Getting length"):
@@ -124,6 +138,540 @@ class TestStoragePerformance(unittest.TestCase):
             for key in st:
                 st[key]
 
+        # Should be quicker than getting each single one.
+        with self.timeit("Exporting all rows", NUMBER / 1000000.0):
+            for row in st.export_rows():
+                pass
+
+        # Should be reasonably quick.
+        with self.timeit("Enabling the Bloom filter", NUMBER / 100000.0):
+            st.enable_bloom_filter()
+        if VERBOSE:
+            print(f"Bloom filter: {st.bloom_filter_info()}")
+
+        # Should be reasonably quick.
+        with self.timeit("Getting missing paths", NUMBER / 100000.0):
+            for i in range(NUMBER):
+                st.get(f"/missing/{i}")
+
         # Can take long.  But 10.000 per second should be no problem.
         with self.timeit("Rebuilding the structure for migration", NUMBER / 100000.0):
             st._rebuild()
+
+        # Store the data in a database and empty its cache, so we can check
+        # that getting the length does not load all buckets.
+        db = DB(None)
+        self.addCleanup(db.close)
+        connection = db.open()
+        self.addCleanup(connection.close)
+        self.addCleanup(transaction.abort)
+        connection.root()["storage"] = st
+        transaction.commit()
+        connection.cacheMinimize()
+
+        # Should be almost instantaneous, also on a cold cache.
+        with self.timeit("Getting length on a cold cache"):
+            self.assertEqual(len(st), NUMBER)
+        # Only the storage and its length counter have been loaded.
+        self.assertLessEqual(connection._cache.cache_non_ghost_count, 2)
+
+    def test_bulk_insert_speedup(self):
+        """Compare update with adding the same items one by one.
+
+        Sample run with one million inserts:
+
+            $ PLONE_APP_REDIRECTOR_PERFORMANCE_NUMBER=1000000 \
+                bin/test -s plone.app.redirector -m test_performance
+            ...
+            Inserting 100 thousand items one by one: 1.95 seconds
+            Inserting 100 thousand items in bulk: 0.31 seconds
+            Bulk insert speedup: 6.3x
+
+        """
+        num = max(int(NUMBER / 10), 10000)
+        info = {f"/old/{i}": f"/new/{i}" for i in range(num)}
+        # Take the best of three runs, so a busy machine does not make
+        # the test fail.
+        individual = bulk = float("inf")
+        for attempt in range(3):
+            st = RedirectionStorage()
+            start = time()
+            for old_path, new_path in info.items():
+                st[old_path] = new_path
+            individual = min(individual, time() - start)
+            st = RedirectionStorage()
+            start = time()
+            st.update(info)
+            bulk = min(bulk, time() - start)
+        self.assertEqual(len(st), num)
+        if VERBOSE:
+            print(
+                f"Inserting {pretty_number(num)} items one by one: "
+                f"{individual:.2f} seconds"
+            )
+            print(f"Inserting {pretty_number(num)} items in bulk: {bulk:.2f} seconds")
+            print(f"Bulk insert speedup: {individual / bulk:.1f}x")
+        # We see about 5x, but leave some room.
+        self.assertGreater(individual / bulk, 4)
+
+    def test_compact_values_performance(self):
+        """Compare inserting with standard and with compact values.
+
+        Sample run with one million inserts:
+
+            $ PLONE_APP_REDIRECTOR_PERFORMANCE_NUMBER=1000000 \
+                bin/test -s plone.app.redirector -m test_performance
+            ...
+            Inserting 100 thousand items with DateTime values: 2.84 seconds (max 10.0)
+            Size of DateTime values: 8 million bytes
+            Inserting 100 thousand items with compact values: 1.44 seconds (max 10.0)
+            Size of compact values: 3 million bytes
+
+        """
+        num = max(int(NUMBER / 10), 1)
+        sizes = {}
+        for compact in (False, True):
+            st = RedirectionStorage()
+            st.compact_values = compact
+            kind = "compact" if compact else "DateTime"
+            # Can take long.  But 10.000 per second should be no problem.
+            with self.timeit(
+                f"Inserting {pretty_number(num)} items with {kind} values",
+                num / 10000.0,
+            ):
+                for i in range(num):
+                    st[f"/old/{i}"] = f"/new/{i}"
+            sizes[kind] = sum(len(pickle.dumps(value)) for value in st._paths.values())
+            if VERBOSE:
+                print(f"Size of {kind} values: {pretty_number(sizes[kind])} bytes")
+        self.assertLess(sizes["compact"], sizes["DateTime"] / 2)
+
+    def test_migrate_values_performance(self):
+        """Compare pickles before and after migrating to compact values."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        # Add them one by one, so each has its own DateTime, like after moves.
+        for i in range(num):
+            st[f"/old/{i}"] = f"/new/{i}"
+        sizes = {}
+        # Unpickling DateTimes is slow, that is the point of migrating.
+        for kind, per_second in (("DateTime", 10000.0), ("compact", 100000.0)):
+            if kind == "compact":
+                # Can take long.  But 10.000 per second should be no problem.
+                with self.timeit(
+                    f"Migrating {pretty_number(num)} values", num / 10000.0
+                ):
+                    st._migrate_values()
+            # Pickle the items in chunks, like the buckets in the database.
+            items = list(st._paths.items())
+            data = [pickle.dumps(items[i : i + 30]) for i in range(0, num, 30)]
+            sizes[kind] = sum(len(chunk) for chunk in data)
+            with self.timeit(
+                f"Unpickling {pretty_number(num)} {kind} values", num / per_second
+            ):
+                for chunk in data:
+                    pickle.loads(chunk)
+            if VERBOSE:
+                print(f"Pickles of {kind} values: {pretty_number(sizes[kind])} bytes")
+        self.assertLess(sizes["compact"], sizes["DateTime"] * 0.75)
+
+    def test_interning_performance(self):
+        """Compare database size and cache memory with and without interning.
+
+        The paths look like those in a site with a news archive:
+        they share long prefixes.
+
+        Sample run with one million paths:
+
+            $ PLONE_APP_REDIRECTOR_PERFORMANCE_NUMBER=1000000 \
+                bin/test -s plone.app.redirector -m test_performance
+            ...
+            Database with string paths: 300 million bytes, cache memory: 649 million bytes
+            Interning 1 million paths: 15.05 seconds (max 100.0)
+            Database with interned paths: 203 million bytes, cache memory: 503 million bytes
+            Saved by interning: 32% of the database, 22% of the memory
+
+        Most of the remaining memory is used by the OOSet of old paths that
+        _rpaths has for each new path.
+        """
+        info = {
+            f"/Plone/en/news/{i % 20 + 2000}/{i % 12 + 1:02}/item-{i}": (
+                f"/Plone/en/archive/{i % 20 + 2000}/{i % 12 + 1:02}/item-{i}"
+            )
+            for i in range(NUMBER)
+        }
+        sizes = {}
+        memory = {}
+        for kind in ("string", "interned"):
+            st = RedirectionStorage()
+            st.compact_values = True
+            st.update(info)
+            if kind == "interned":
+                # Can take long.  But 10.000 per second should be no problem.
+                with self.timeit(
+                    f"Interning {pretty_number(NUMBER)} paths", NUMBER / 10000.0
+                ):
+                    st.enable_interning()
+            tmpdir = tempfile.TemporaryDirectory()
+            self.addCleanup(tmpdir.cleanup)
+            filename = os.path.join(tmpdir.name, "Data.fs")
+            db = DB(FileStorage(filename))
+            connection = db.open()
+            connection.root()["storage"] = st
+            transaction.commit()
+            db.pack()
+            sizes[kind] = os.path.getsize(filename)
+            connection.close()
+            db.close()
+
+            # Load everything in a fresh database, and see how much memory
+            # the objects in the cache take.
+            db = DB(FileStorage(filename, read_only=True))
+            connection = db.open()
+            stored = connection.root()["storage"]
+            tracemalloc.start()
+            for value in stored._paths.values():
+                pass
+            for value in stored._rpaths.values():
+                value._p_activate()
+            if stored._prefixes is not None:
+                for value in stored._prefixes._ids.values():
+                    pass
+                for value in stored._prefixes._names.values():
+                    pass
+            memory[kind] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            with self.timeit(
+                f"Getting {pretty_number(NUMBER)} {kind} paths", NUMBER / 100000.0
+            ):
+                for old_path in info:
+                    stored.get(old_path)
+            transaction.abort()
+            connection.close()
+            db.close()
+            if VERBOSE:
+                print(
+                    f"Database with {kind} paths: {pretty_number(sizes[kind])} "
+                    f"bytes, cache memory: {pretty_number(memory[kind])} bytes"
+                )
+        if VERBOSE:
+            print(
+                "Saved by interning: "
+                f"{1 - sizes['interned'] / sizes['string']:.0%} of the database, "
+                f"{1 - memory['interned'] / memory['string']:.0%} of the memory"
+            )
+        self.assertLess(sizes["interned"], sizes["string"] * 0.75)
+        self.assertLess(memory["interned"], memory["string"] * 0.9)
+
+    def test_subtree_performance(self):
+        """Compare moving a big folder with and without a subtree redirect.
+
+        This does what the objectMoved subscriber does for the folder and
+        each of its children.
+        """
+        num = max(int(NUMBER / 10), 1)
+        children = [f"/plone/folder/{i}" for i in range(num)]
+        st = RedirectionStorage()
+        with self.timeit(
+            f"Moving a folder with {pretty_number(num)} children one by one",
+            num / 10000.0,
+        ):
+            st.add("/plone/folder", "/plone/moved")
+            for path in children:
+                st.add(path, "/plone/moved" + path[13:])
+        self.assertEqual(len(st), num + 1)
+        st = RedirectionStorage()
+        with self.timeit(
+            f"Moving a folder with {pretty_number(num)} children as a subtree",
+            num / 100000.0,
+        ):
+            st.add("/plone/folder", "/plone/moved")
+            st.add_subtree("/plone/folder", "/plone/moved")
+            for path in children:
+                new_path = "/plone/moved" + path[13:]
+                if st.get(path) != new_path:
+                    st.add(path, new_path)
+        self.assertEqual(len(st), 1)
+        self.assertEqual(st.get(children[-1]), "/plone/moved" + children[-1][13:])
+
+    def test_add_deferred_performance(self):
+        """Compare adding the redirects of many moves directly and deferred."""
+        num = max(int(NUMBER / 10), 1)
+        moves = [(f"/plone/a/{i}", f"/plone/b/{i}") for i in range(num)]
+        self.addCleanup(transaction.abort)
+        for kind in ("directly", "deferred"):
+            st = RedirectionStorage()
+            st.compact_values = True
+            # Some existing redirects.
+            for i in range(0, num, 10):
+                st.add(f"/plone/old/{i}", f"/plone/a/{i}")
+            with self.timeit(
+                f"Adding {pretty_number(num)} moves {kind}", num / 10000.0
+            ):
+                if kind == "directly":
+                    for old_path, new_path in moves:
+                        st.add(old_path, new_path)
+                else:
+                    for old_path, new_path in moves:
+                        st.add_deferred(old_path, new_path)
+                    len(st)
+            self.assertEqual(st.get("/plone/old/0"), "/plone/b/0")
+
+    def test_removal_queue_performance(self):
+        """Compare destroying directly and with the removal queue."""
+        num = max(int(NUMBER / 10), 1)
+        targets = [f"/plone/folder/{i}" for i in range(num // 100 + 1)]
+        for kind in ("directly", "queued"):
+            st = RedirectionStorage()
+            st.compact_values = True
+            st.update(
+                {f"/plone/old/{i}": targets[i % len(targets)] for i in range(num)}
+            )
+            if kind == "queued":
+                st.enable_removal_queue()
+            with self.timeit(
+                f"Destroying {pretty_number(len(targets))} paths with "
+                f"{pretty_number(num)} redirects {kind}",
+                num / 10000.0,
+            ):
+                for target in targets:
+                    st.destroy(target)
+            self.assertIsNone(st.get("/plone/old/0"))
+            if kind == "queued":
+                with self.timeit(
+                    f"Processing {pretty_number(len(targets))} queued paths",
+                    num / 10000.0,
+                ):
+                    while st.process_removals(limit=1000):
+                        pass
+            self.assertEqual(len(st), 0)
+
+    def test_hub_performance(self):
+        """Move a target that many old paths redirect to."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.compact_values = True
+        st.update({f"/plone/old/{i}": "/plone/hub0" for i in range(num)})
+        with self.timeit(f"Counting {pretty_number(num)} redirects", 0.001):
+            self.assertEqual(st.count_redirects("/plone/hub0"), num)
+        with self.timeit(
+            f"Moving a hub with {pretty_number(num)} redirects 10 times", num / 20000.0
+        ):
+            for i in range(10):
+                st.add(f"/plone/hub{i}", f"/plone/hub{i + 1}")
+        self.assertEqual(st.get("/plone/old/0"), "/plone/hub10")
+        self.assertEqual(st.count_redirects("/plone/hub10"), num + 10)
+        with self.timeit(
+            f"Iterating over {pretty_number(num)} redirects", num / 100000.0
+        ):
+            self.assertEqual(len(list(st.iter_redirects("/plone/hub10"))), num + 10)
+
+    def test_lazy_chains_performance(self):
+        """Compare eager and lazy chains when moving and reading.
+
+        Sample run with PLONE_APP_REDIRECTOR_PERFORMANCE_NUMBER=1000000:
+
+            Moving a hub with 100 thousand redirects 20 times eager: 3.35 seconds
+            Reading 100 thousand redirects eager: 0.29 seconds
+            Moving a hub with 100 thousand redirects 20 times lazy: 0.00 seconds
+            Reading 100 thousand redirects lazy: 3.49 seconds
+            Compacting 20 hops: 0.17 seconds
+            Reading 100 thousand redirects lazy after compacting: 0.41 seconds
+        """
+        num = max(int(NUMBER / 10), 1)
+        moves = 20
+        old_paths = [f"/plone/old/{i}" for i in range(num)]
+        for kind in ("eager", "lazy"):
+            st = RedirectionStorage()
+            st.compact_values = True
+            if kind == "lazy":
+                st.enable_lazy_chains()
+            st.update({old_path: "/plone/hub0" for old_path in old_paths})
+            with self.timeit(
+                f"Moving a hub with {pretty_number(num)} redirects "
+                f"{moves} times {kind}",
+                num * moves / 100000.0,
+            ):
+                for i in range(moves):
+                    st.add(f"/plone/hub{i}", f"/plone/hub{i + 1}")
+            with self.timeit(
+                f"Reading {pretty_number(num)} redirects {kind}", num / 10000.0
+            ):
+                for old_path in old_paths:
+                    st.get(old_path)
+        self.assertEqual(st.get(old_paths[0]), f"/plone/hub{moves}")
+        with self.timeit(f"Compacting {moves} hops", num / 10000.0):
+            st.compact_chains()
+        with self.timeit(
+            f"Reading {pretty_number(num)} redirects lazy after compacting",
+            num / 10000.0,
+        ):
+            for old_path in old_paths:
+                st.get(old_path)
+
+    def test_destroy_many_performance(self):
+        """Compare calling destroy for each removed path and destroy_many."""
+        num = max(int(NUMBER / 10), 1)
+        targets = [f"/plone/folder/{i}" for i in range(num)]
+        for kind in ("destroy", "destroy_many"):
+            st = RedirectionStorage()
+            st.compact_values = True
+            st.update({f"/plone/old/{i}": target for i, target in enumerate(targets)})
+            with self.timeit(
+                f"Removing {pretty_number(num)} redirected paths with {kind}",
+                num / 10000.0,
+            ):
+                if kind == "destroy":
+                    for target in targets:
+                        st.destroy(target)
+                else:
+                    st.destroy_many(targets)
+            self.assertEqual(len(st), 0)
+
+    def test_destroy_subtree_performance(self):
+        """Remove a folder with many redirected paths below it."""
+        num = max(int(NUMBER / 10), 1)
+        targets = [f"/plone/folder/{i % 100}/{i}" for i in range(num)]
+        st = RedirectionStorage()
+        st.compact_values = True
+        st.update({f"/plone/old/{i}": target for i, target in enumerate(targets)})
+        st.add("/plone/other", "/plone/folder2")
+        with self.timeit(
+            f"Removing a folder with {pretty_number(num)} redirected paths",
+            num / 10000.0,
+        ):
+            st.destroy_subtree("/plone/folder")
+        self.assertEqual(len(st), 1)
+
+    def test_prefix_query_performance(self):
+        """Compare prefix queries with filtering all redirects."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.compact_values = True
+        st.update(
+            {
+                f"/plone/{i % 100}/old/{i}": f"/plone/{i % 99}/new/{i}"
+                for i in range(num)
+            }
+        )
+        with self.timeit(f"Exporting {pretty_number(num)} redirects", num / 10000.0):
+            rows = list(st.export_rows())
+        old_rows = [row for row in rows if row[0].startswith("/plone/7/")]
+        new_rows = [row for row in rows if row[1].startswith("/plone/7/")]
+        with self.timeit(f"Redirects below a prefix of {pretty_number(num)}"):
+            self.assertEqual(list(st.items_from("/plone/7")), old_rows)
+        with self.timeit(f"Redirects to below a prefix of {pretty_number(num)}"):
+            self.assertEqual(len(list(st.targets_under("/plone/7"))), len(new_rows))
+
+    def test_date_index_performance(self):
+        """Compare pages of the newest redirects with and without the index."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.compact_values = True
+        st.update(
+            {
+                f"/plone/old/{i}": (f"/plone/new/{i}", None, i % 10 == 0)
+                for i in range(num)
+            }
+        )
+        with self.timeit(f"Scanning for a page of {pretty_number(num)}", num / 10000.0):
+            page = list(st.items_by_date(limit=50))
+        with self.timeit(f"Indexing {pretty_number(num)} redirects", num / 10000.0):
+            st.enable_date_index()
+        with self.timeit(f"Getting 100 pages of {pretty_number(num)} with the index"):
+            self.assertEqual(list(st.items_by_date(limit=50)), page)
+            for i in range(99):
+                if page:
+                    page = list(st.items_by_date(cursor=page[-1], limit=50))
+        with self.timeit("Getting 100 pages of manual redirects"):
+            rows = list(st.manual_redirects(limit=50))
+            for i in range(99):
+                if rows:
+                    rows = list(st.manual_redirects(cursor=rows[-1][0], limit=50))
+
+    def test_prune_performance(self):
+        """Prune old automatic redirects, with and without the date index."""
+        num = max(int(NUMBER / 10), 1)
+        old = DateTime(2020, 1, 1)
+        info = {
+            f"/plone/old/{i}": (f"/plone/new/{i}", None if i % 10 else old, False)
+            for i in range(num)
+        }
+        for indexed in (False, True):
+            st = RedirectionStorage()
+            st.compact_values = True
+            if indexed:
+                st.enable_date_index()
+            st.update(info)
+            kind = "with" if indexed else "without"
+            with self.timeit(
+                f"Pruning a tenth of {pretty_number(num)} {kind} the index",
+                num / 10000.0,
+            ):
+                self.assertEqual(st.prune(DateTime(2021, 1, 1)), len(range(0, num, 10)))
+            transaction.abort()
+
+    def test_hits_performance(self):
+        """Record hits in memory, and write them in one go."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.enable_hit_tracking()
+        buffer = HitBuffer()
+        paths = [f"/plone/old/{i % 1000}" for i in range(num)]
+        with self.timeit(f"Recording {pretty_number(num)} hits", num / 100000.0):
+            for path in paths:
+                buffer.record(path)
+        with self.timeit(f"Writing the hits of {len(buffer)} paths"):
+            flush_hits(st, buffer)
+        self.assertEqual(sum(row[1] for row in st.iter_hits()), num)
+
+    def test_rules_performance(self):
+        """Match paths against ten thousand rules."""
+        num = max(int(NUMBER / 100), 1)
+        st = RedirectionStorage()
+        for i in range(10000):
+            st.add_rule(
+                f"/plone/blog{i}/(\\d{{4}})/(.*)", f"/plone/news{i}/\\1/\\2", "regex"
+            )
+            st.add_rule(f"/plone/files{i}/*/*.pdf", f"/plone/media{i}/\\1/\\2", "glob")
+        with self.timeit("Indexing 20 thousand rules", 1.0):
+            st.match_rule("/plone")
+        # The first match of a rule compiles its regular expression.
+        for message, limit in (("Matching", num / 1000.0 + 5.0), ("Rematching", 1.0)):
+            with self.timeit(f"{message} {pretty_number(num)} paths", limit):
+                for i in range(num):
+                    self.assertEqual(
+                        st.match_rule(f"/plone/blog{i % 10000}/2020/a"),
+                        f"/plone/news{i % 10000}/2020/a",
+                    )
+                    path = f"/plone/files{i % 10000}/x/a.doc"
+                    self.assertIsNone(st.match_rule(path))
+
+    def test_resolve_performance(self):
+        """Resolve paths that only match the parent, like a template."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.update({f"/plone/old{i}": f"/plone/new{i}" for i in range(num)})
+        with self.timeit(f"Resolving {pretty_number(num)} template paths", 5.0):
+            for i in range(num):
+                new_path = st.resolve(["", "plone", f"old{i}", "@@view", "edit"])[0]
+                self.assertEqual(new_path, f"/plone/new{i}/@@view/edit")
+        with self.timeit(f"Getting {pretty_number(num)} template paths", 5.0):
+            for i in range(num):
+                for path in (
+                    f"/plone/old{i}/@@view/edit",
+                    f"/plone/old{i}",
+                    f"/plone/old{i}/@@view",
+                ):
+                    st.get(path)
+
+    def test_resolve_ancestor_performance(self):
+        """Resolve deep paths below redirected folders."""
+        num = max(int(NUMBER / 10), 1)
+        st = RedirectionStorage()
+        st.update({f"/plone/old{i}": f"/plone/new{i}" for i in range(num)})
+        rest = ["a", "b", "c", "d", "e", "f", "g", "h"]
+        with self.timeit(f"Resolving {pretty_number(num)} deep paths", 10.0):
+            for i in range(num):
+                new_path = st.resolve(["", "plone", f"old{i}"] + rest)[0]
+                self.assertEqual(new_path, f"/plone/new{i}/a/b/c/d/e/f/g/h")
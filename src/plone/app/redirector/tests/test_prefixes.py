@@ -0,0 +1,50 @@
+from plone.app.redirector.prefixes import PathPrefixes
+
+import unittest
+
+
+class TestPathPrefixes(unittest.TestCase):
+    """Test the PathPrefixes class."""
+
+    def test_encode_decode(self):
+        prefixes = PathPrefixes()
+        key = prefixes.encode("/plone/en/news", create=True)
+        self.assertEqual(key, b"\x65\xe7\x93\x55news")
+        self.assertEqual(prefixes.decode(key), "/plone/en/news")
+        # Known prefixes are reused.
+        key = prefixes.encode("/plone/en/events", create=True)
+        self.assertEqual(key, b"\x65\xe7\x93\x55events")
+        key = prefixes.encode("/plone/en/news/item", create=True)
+        self.assertEqual(key, b"\x69\x94\x22\xa2item")
+        self.assertEqual(prefixes.decode(key), "/plone/en/news/item")
+        self.assertEqual(len(prefixes), 2)
+        # Paths without a leading slash, or with a query string, keep it so.
+        paths = ("plone", "/plone", "/plone/en?a=1", "http://example.org/a", "", "/ü")
+        for path in paths:
+            self.assertEqual(prefixes.decode(prefixes.encode(path, True)), path)
+        self.assertNotEqual(prefixes.encode("plone"), prefixes.encode("/plone"))
+
+    def test_encode_unknown(self):
+        prefixes = PathPrefixes()
+        prefixes.encode("/plone/en", create=True)
+        self.assertEqual(prefixes.encode("/plone/de"), b"\x6d\x4b\x91\xc4de")
+        self.assertIsNone(prefixes.encode("/plone/de/news"))
+        # Nothing has been added.
+        self.assertEqual(len(prefixes), 1)
+
+    def test_number_collision(self):
+        # Pretend that another prefix has the number of "/plone/en/".
+        prefixes = PathPrefixes()
+        prefixes._names[0x65E79355] = "/other/"
+        prefixes._ids["/other/"] = 0x65E79355
+        key = prefixes.encode("/plone/en/news", create=True)
+        self.assertEqual(key, b"\x65\xe7\x93\x56news")
+        self.assertEqual(prefixes.decode(key), "/plone/en/news")
+        self.assertEqual(prefixes.decode(b"\x65\xe7\x93\x55news"), "/other/news")
+
+    def test_ids_fit_in_keys(self):
+        prefixes = PathPrefixes()
+        for i in range(1000):
+            key = prefixes.encode(f"/plone/{i}/item", create=True)
+            self.assertLess(int.from_bytes(key[:4], "big"), 2**31)
+        self.assertEqual(len(prefixes), 1000)
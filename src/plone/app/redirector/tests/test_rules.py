@@ -0,0 +1,105 @@
+from plone.app.redirector.rules import _regex_literal
+from plone.app.redirector.rules import RedirectRules
+from ZODB import DB
+
+import transaction
+import unittest
+
+
+class TestRedirectRules(unittest.TestCase):
+    """Test the RedirectRules class."""
+
+    def test_prefix(self):
+        rules = RedirectRules()
+        rules.add("/plone/old", "/plone/new")
+        self.assertEqual(rules.match("/plone/old"), "/plone/new")
+        self.assertEqual(rules.match("/plone/old/a/b"), "/plone/new/a/b")
+        self.assertIsNone(rules.match("/plone/older"))
+        self.assertIsNone(rules.match("/plone"))
+        self.assertListEqual(rules.items(), [("/plone/old", "/plone/new", "prefix")])
+
+    def test_glob(self):
+        rules = RedirectRules()
+        rules.add("/plone/blog/*/*.html", "/plone/news/\\1/\\2", "glob")
+        rules.add("/plone/files/**", "/plone/media/\\1", "glob")
+        rules.add("/plone/page?", "/plone/pages/\\1", "glob")
+        self.assertEqual(rules.match("/plone/blog/2020/a.html"), "/plone/news/2020/a")
+        self.assertIsNone(rules.match("/plone/blog/2020/x/a.html"))
+        self.assertIsNone(rules.match("/plone/blog/2020/ahtml"))
+        self.assertEqual(rules.match("/plone/files/a/b.pdf"), "/plone/media/a/b.pdf")
+        self.assertEqual(rules.match("/plone/page1"), "/plone/pages/1")
+        self.assertIsNone(rules.match("/plone/page12"))
+
+    def test_regex(self):
+        rules = RedirectRules()
+        rules.add(r"/plone/blog/(\d{4})/(.*)", r"/plone/news/\1/\2", "regex")
+        rules.add(r"^/plone/(?P<lang>en|de)/home", r"/plone/\g<lang>", "regex")
+        self.assertEqual(rules.match("/plone/blog/2020/a/b"), "/plone/news/2020/a/b")
+        self.assertIsNone(rules.match("/plone/blog/20/a"))
+        # The whole path must match.
+        self.assertEqual(rules.match("/plone/de/home"), "/plone/de")
+        self.assertIsNone(rules.match("/plone/de/home/page"))
+        self.assertIsNone(rules.match("/other/plone/en/home"))
+
+    def test_longest_literal_wins(self):
+        rules = RedirectRules()
+        rules.add("/plone/a", "/plone/x")
+        rules.add("/plone/a/b/**", "/plone/y/\\1", "glob")
+        rules.add("/plone/a/b/c*", "/plone/z", "glob")
+        rules.add(".*", "/plone/fallback", "regex")
+        self.assertEqual(rules.match("/plone/a/b/cd"), "/plone/z")
+        self.assertEqual(rules.match("/plone/a/b/d"), "/plone/y/d")
+        self.assertEqual(rules.match("/plone/a/d"), "/plone/x/d")
+        self.assertEqual(rules.match("/plone/b"), "/plone/fallback")
+        rules.remove(".*")
+        self.assertIsNone(rules.match("/plone/b"))
+        self.assertEqual(len(rules), 3)
+
+    def test_invalid(self):
+        rules = RedirectRules()
+        with self.assertRaises(ValueError):
+            rules.add("/plone/(", "/plone/new", "regex")
+        with self.assertRaises(ValueError):
+            rules.add("/plone/old", "/plone/new", "wildcard")
+        # The target may only use the groups of the pattern.
+        with self.assertRaises(ValueError):
+            rules.add("/plone/a/(.*)", "/plone/b/\\2", "regex")
+        with self.assertRaises(ValueError):
+            rules.add("/plone/a/(?P<x>.*)", "/plone/b/\\g<y>", "regex")
+        with self.assertRaises(ValueError):
+            rules.add("/plone/a/*", "/plone/b/\\1/\\2", "glob")
+        self.assertEqual(len(rules), 0)
+        rules.add("/plone/a/(?P<x>.*)", "/plone/b/\\g<x>", "regex")
+        rules.add("/plone/c/*/*", "/plone/d/\\1/\\2", "glob")
+        self.assertEqual(rules.match("/plone/a/1/2"), "/plone/b/1/2")
+        self.assertEqual(rules.match("/plone/c/1/2"), "/plone/d/1/2")
+
+    def test_regex_literal(self):
+        self.assertEqual(_regex_literal(r"/plone/blog/(\d+)"), "/plone/blog/")
+        self.assertEqual(_regex_literal(r"^/plone/a\.b/\d"), "/plone/a.b/")
+        self.assertEqual(_regex_literal(r"/plone/pages?/(.*)"), "/plone/page")
+        self.assertEqual(_regex_literal(r"/plone/a{2}"), "/plone/")
+        self.assertEqual(_regex_literal(r"/plone/a|/other"), "")
+        self.assertEqual(_regex_literal(r"(/plone)"), "")
+
+    def test_changes_are_seen(self):
+        # The compiled rules of each connection are replaced after a change.
+        db = DB(None)
+        self.addCleanup(db.close)
+        manager = transaction.TransactionManager()
+        connection1 = db.open()
+        connection2 = db.open(transaction_manager=manager)
+        self.addCleanup(connection1.close)
+        self.addCleanup(connection2.close)
+        self.addCleanup(transaction.abort)
+        rules = RedirectRules()
+        rules.add("/plone/a", "/plone/b")
+        connection1.root()["rules"] = rules
+        transaction.commit()
+        manager.begin()
+        other = connection2.root()["rules"]
+        self.assertEqual(other.match("/plone/a"), "/plone/b")
+        rules.add("/plone/a", "/plone/c")
+        transaction.commit()
+        manager.begin()
+        self.assertEqual(other.match("/plone/a"), "/plone/c")
@@ -1,6 +1,14 @@
 from DateTime import DateTime
+from plone.app.redirector.interfaces import IRedirectionStorage
 from plone.app.redirector.storage import RedirectionStorage
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from zope.interface.verify import verifyObject
 
+import os
+import tempfile
+import transaction
 import unittest
 
 
@@ -10,6 +18,9 @@ class TestStorage(unittest.TestCase):
     This used to be in a doctest inside storage.py itself.
     """
 
+    def test_storage_interface(self):
+        self.assertTrue(verifyObject(IRedirectionStorage, RedirectionStorage()))
+
     def test_storage_one_redirect(self):
         # Add one redirect
         st = RedirectionStorage()
@@ -269,6 +280,39 @@ class TestStorage(unittest.TestCase):
         self.assertIn("/fred", st)
         self.assertIn("/barney", st)
 
+    def test_storage_chain_hub(self):
+        # Move a target with many redirects to it.
+        st = RedirectionStorage()
+        st.add("/a", "/hub")
+        st.add("/b", "/hub")
+        st.add("/c", "/hub")
+        st.add("/d", "/new")
+        old_paths = st._rpaths["/hub"]
+        st.add("/hub", "/new")
+        # The set with the most redirects is kept.
+        self.assertIs(st._rpaths["/new"], old_paths)
+        self.assertNotIn("/hub", st._rpaths)
+        self.assertListEqual(st.redirects("/new"), ["/a", "/b", "/c", "/d", "/hub"])
+        self.assertEqual(st.get("/a"), "/new")
+        # Moving back removes the redirect that would point to itself.
+        st.add("/new", "/hub")
+        self.assertNotIn("/hub", st)
+        self.assertListEqual(st.redirects("/hub"), ["/a", "/b", "/c", "/d", "/new"])
+        self.assertEqual(len(st), 5)
+
+    def test_storage_iter_redirects(self):
+        st = RedirectionStorage()
+        self.assertListEqual(list(st.iter_redirects("/foo")), [])
+        self.assertEqual(st.count_redirects("/foo"), 0)
+        st.add("/fred", "/foo")
+        st.add("/barney", "/foo/")
+        self.assertListEqual(list(st.iter_redirects("/foo/")), ["/barney", "/fred"])
+        self.assertEqual(st.count_redirects("/foo"), 2)
+        st.enable_interning()
+        self.assertListEqual(list(st.iter_redirects("/foo")), ["/barney", "/fred"])
+        self.assertEqual(st.count_redirects("/foo"), 2)
+        self.assertEqual(st.count_redirects("/unknown/foo"), 0)
+
     def test_storage_destroy_target(self):
         # Destroy the target of a redirect
         st = RedirectionStorage()
@@ -309,6 +353,49 @@ class TestStorage(unittest.TestCase):
         st["/barney"] = "/wilma"
         self.assertEqual(len(st), 3)
 
+    def test_storage_len_counter(self):
+        # The length is kept in a counter, so check it stays in sync.
+        st = RedirectionStorage()
+        st.add("/foo", "/bar")
+        st.add("/foo", "/baz")
+        self.assertEqual(len(st), 1)
+        st.add("/bar", "/foo")
+        self.assertEqual(len(st), 2)
+        # /foo now points to /foo, which is useless, so it is removed.
+        st.add("/foo", "/qux")
+        self.assertEqual(len(st), 2)
+        self.assertEqual(len(st), len(st._paths))
+        st.update({"/a": "/b", "/c": "/b"})
+        self.assertEqual(len(st), 4)
+        st.remove("/a")
+        self.assertEqual(len(st), 3)
+        st.destroy("/b")
+        self.assertEqual(len(st), 2)
+        self.assertEqual(len(st), len(st._paths))
+        st.clear()
+        self.assertEqual(len(st), 0)
+
+    def test_storage_len_migration(self):
+        # Storages from before the length counter existed still work,
+        # and can be migrated.
+        st = RedirectionStorage()
+        st.add("/foo", "/bar")
+        st.add("/baz", "/bar")
+        del st._length
+        self.assertIsNone(st._length)
+        self.assertEqual(len(st), 2)
+        st.add("/qux", "/bar")
+        self.assertEqual(len(st), 3)
+        st._migrate_length()
+        self.assertEqual(st._length(), 3)
+        st.remove("/qux")
+        self.assertEqual(len(st), 2)
+        self.assertEqual(st._length(), 2)
+        # Rebuilding sets the counter too.
+        st._length.set(42)
+        st._rebuild()
+        self.assertEqual(len(st), 2)
+
     def test_storage_no_circular(self):
         # Circular references are ignored
         st = RedirectionStorage()
@@ -473,6 +560,1372 @@ class TestStorage(unittest.TestCase):
         self.assertTrue(time2 < st.get_full("/old/20")[1] < time3)
         self.assertTrue(st.get_full("/old/20")[2])
 
+    def test_storage_update_chains(self):
+        # Chains within the update and through existing redirects
+        # are resolved just like when calling add for each item.
+        info = {
+            "/a": "/b",
+            "/existing/target": "/c",
+            "/b": "/c",
+            "/c": "/existing",
+            "/d/": "/d",
+            "/e": "/f",
+        }
+        expected = RedirectionStorage()
+        st = RedirectionStorage()
+        now = DateTime()
+        for storage in (expected, st):
+            storage.add("/old", "/existing/target", now=now)
+            storage.add("/existing", "/a", now=now)
+        for key, value in info.items():
+            expected.add(key, value, now=now, manual=True)
+        st.update({key: (value, now, True) for key, value in info.items()})
+        self.assertEqual(dict(st._paths.items()), dict(expected._paths.items()))
+        self.assertEqual(
+            {key: list(value) for key, value in st._rpaths.items()},
+            {key: list(value) for key, value in expected._rpaths.items()},
+        )
+        self.assertEqual(len(st), len(expected))
+        self.assertEqual(st.get("/old"), "/existing")
+        self.assertEqual(st.get("/b"), "/existing")
+        # /existing pointed to /c, which now points to /existing.
+        self.assertNotIn("/existing", st)
+        self.assertNotIn("/d", st)
+
+    def test_storage_update_repoint(self):
+        # Update existing redirects to point somewhere else.
+        st = RedirectionStorage()
+        st.add("/foo", "/bar")
+        st.add("/baz", "/bar")
+        st.add("/qux", "/quux")
+        st.update({"/foo": "/quux", "/qux": "/bar", "/new": "/bar"})
+        self.assertEqual(len(st), 4)
+        self.assertEqual(st.get("/foo"), "/quux")
+        self.assertEqual(st.get("/qux"), "/bar")
+        self.assertListEqual(st.redirects("/bar"), ["/baz", "/new", "/qux"])
+        self.assertListEqual(st.redirects("/quux"), ["/foo"])
+        st.update({"/foo": "/baz", "/qux": "/other"})
+        self.assertEqual(len(st), 4)
+        self.assertListEqual(st.redirects("/quux"), [])
+        self.assertNotIn("/quux", st._rpaths)
+        self.assertListEqual(st.redirects("/other"), ["/qux"])
+
+    def test_storage_import_rows(self):
+        st = RedirectionStorage()
+        time1 = DateTime(2020, 1, 1)
+
+        def rows():
+            yield ("/old/0", "/new/0")
+            yield ["/old/1", "/new/1", time1, False]
+            yield []
+            yield ["/old/2/", "/new/2", "2021/02/03", "True"]
+            yield ["/old/3", "/old/0", "", ""]
+            yield ["/old/4", "/new/4", None, "false"]
+
+        reports = []
+        done = st.import_rows(
+            rows(),
+            chunk_size=2,
+            progress=lambda done, rate: reports.append(done),
+            manual=False,
+        )
+        self.assertEqual(done, 6)
+        self.assertListEqual(reports, [2, 4, 6])
+        self.assertEqual(len(st), 5)
+        self.assertEqual(st.get_full("/old/1"), ("/new/1", time1, False))
+        self.assertEqual(
+            st.get_full("/old/2"), ("/new/2", DateTime("2021/02/03"), True)
+        )
+        self.assertEqual(st.get("/old/3"), "/old/0")
+        self.assertFalse(st.get_full("/old/3")[2])
+        self.assertFalse(st.get_full("/old/4")[2])
+
+    def test_storage_import_rows_resume(self):
+        # Commit after each chunk, and resume an interrupted import.
+        db = DB(None)
+        self.addCleanup(db.close)
+        connection = db.open()
+        self.addCleanup(connection.close)
+        self.addCleanup(transaction.abort)
+        st = RedirectionStorage()
+        connection.root()["storage"] = st
+        transaction.commit()
+        rows = [(f"/old/{i}", f"/new/{i}") for i in range(10)]
+        reports = []
+
+        def progress(done, rate):
+            reports.append(done)
+            if done == 6:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            st.import_rows(rows, chunk_size=3, commit=True, progress=progress)
+        transaction.abort()
+        self.assertListEqual(reports, [3, 6])
+        self.assertEqual(len(st), 6)
+
+        done = st.import_rows(rows, chunk_size=3, commit=True, start=reports[-1])
+        self.assertEqual(done, 10)
+        self.assertEqual(len(st), 10)
+        self.assertEqual(st.get("/old/9"), "/new/9")
+
+    def test_storage_export_rows(self):
+        st = RedirectionStorage()
+        self.assertListEqual(list(st.export_rows()), [])
+        time1 = DateTime()
+        for i in range(5):
+            st.add(f"/old/{i}", f"/new/{i}", now=time1, manual=bool(i % 2))
+        # Unmigrated data only has the path.
+        st._paths["/legacy"] = "/new/0"
+        rows = list(st.export_rows())
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0], ("/legacy", "/new/0", None, True))
+        self.assertEqual(rows[1], ("/old/0", "/new/0", time1, False))
+        self.assertEqual(rows[2], ("/old/1", "/new/1", time1, True))
+
+        # Export in pages, with the last seen old path as cursor.
+        pages = []
+        cursor = None
+        while True:
+            page = list(st.export_rows(cursor=cursor, limit=4))
+            if not page:
+                break
+            pages.append(page)
+            cursor = page[-1][0]
+        self.assertListEqual([len(page) for page in pages], [4, 2])
+        self.assertListEqual(pages[0] + pages[1], rows)
+        # The cursor does not need to be an existing path.
+        self.assertListEqual(list(st.export_rows(cursor="/old/2a")), rows[4:])
+
+    def test_storage_bloom_filter(self):
+        st = RedirectionStorage()
+        self.assertIsNone(st.bloom_filter_info())
+        st.add("/foo", "/bar")
+        st.enable_bloom_filter(capacity=1000, error_rate=0.001)
+        info = st.bloom_filter_info()
+        self.assertEqual(info["capacity"], 1000)
+        self.assertEqual(info["error_rate"], 0.001)
+        self.assertIn("estimated_error_rate", info)
+        self.assertIn("/foo", st._bloom)
+        self.assertEqual(st.get("/foo"), "/bar")
+        self.assertIsNone(st.get("/baz"))
+        self.assertEqual(st.get_full("/baz"), (None, None, True))
+        self.assertNotIn("/baz", st)
+        # New redirects are added to the filter.
+        st.add("/baz", "/bar")
+        st.import_rows([("/corge", "/bar")])
+        st.update({"/qux": "/bar", "/bar": "/quux"})
+        for path in ("/foo", "/baz", "/qux", "/bar", "/corge"):
+            self.assertIn(path, st._bloom)
+            self.assertEqual(st.get(path), "/quux")
+        # A path that is in the filter but not in the storage.
+        st.remove("/baz")
+        self.assertIn("/baz", st._bloom)
+        self.assertNotIn("/baz", st)
+        # Rebuilding also rebuilds the filter.
+        st._rebuild()
+        self.assertEqual(st.bloom_filter_info()["capacity"], 1000)
+        self.assertNotIn("/baz", st._bloom)
+        self.assertIn("/foo", st._bloom)
+        # Clearing keeps an empty filter.
+        st.clear()
+        self.assertEqual(st.bloom_filter_info()["capacity"], 1000)
+        self.assertNotIn("/foo", st._bloom)
+        st.disable_bloom_filter()
+        self.assertIsNone(st.bloom_filter_info())
+        st._paths["/foo"] = "/bar"
+        self.assertEqual(st.get("/foo"), "/bar")
+
+    def test_storage_compact_values(self):
+        st = RedirectionStorage()
+        time1 = DateTime()
+        st.add("/foo", "/bar", now=time1)
+        st.compact_values = True
+        time2 = DateTime("2021/02/03 12:00:00.123456 GMT+2")
+        st.add("/baz", "/bar", now=time2, manual=True)
+        info = st._paths["/baz"]
+        self.assertEqual(len(info), 2)
+        self.assertEqual(info[0], "/bar")
+        self.assertIsInstance(info[1], int)
+        full = st.get_full("/baz")
+        self.assertEqual(full[0], "/bar")
+        # The date is the same, but in UTC.
+        self.assertTrue(full[1].equalTo(time2))
+        self.assertEqual(full[1].timezone(), "UTC")
+        self.assertIs(full[2], True)
+        self.assertEqual(st.get("/baz"), "/bar")
+
+        # Without an explicit date.
+        time3 = DateTime()
+        st.add("/qux", "/bar")
+        time4 = DateTime()
+        full = st.get_full("/qux")
+        self.assertTrue(time3.micros() <= full[1].micros() <= time4.micros())
+        self.assertIs(full[2], False)
+
+        # Existing values keep their format when their target moves.
+        st.add("/bar", "/new")
+        self.assertEqual(st._paths["/foo"], ("/new", time1, False))
+        self.assertEqual(st._paths["/baz"], ("/new", info[1]))
+        self.assertEqual(len(st._paths["/bar"]), 2)
+        st.update({"/quux": "/new"})
+        self.assertEqual(len(st._paths["/quux"]), 2)
+        self.assertTrue(st.get_full("/quux")[2])
+        self.assertListEqual(
+            [row[:2] + row[3:] for row in st.export_rows()],
+            [
+                ("/bar", "/new", False),
+                ("/baz", "/new", True),
+                ("/foo", "/new", False),
+                ("/quux", "/new", True),
+                ("/qux", "/new", False),
+            ],
+        )
+        st._rebuild()
+        self.assertEqual(st._paths["/baz"], ("/new", info[1]))
+
+    def test_storage_migrate_values(self):
+        st = RedirectionStorage()
+        time1 = DateTime("2020/01/01 UTC")
+        st.add("/foo", "/bar", now=time1)
+        st.add("/baz", "/bar", now=time1, manual=True)
+        st._paths["/legacy"] = "/bar"
+        st._rpaths["/bar"].insert("/legacy")
+        st.compact_values = True
+        st.add("/qux", "/quux", now=time1)
+        self.assertEqual(st._values_version, 0)
+        time2 = DateTime()
+        st._migrate_values()
+        time3 = DateTime()
+        self.assertEqual(st._values_version, 1)
+        self.assertSetEqual({len(value) for value in st._paths.values()}, {2})
+        self.assertEqual(st.get("/foo"), "/bar")
+        self.assertIsNone(st.get("/unknown"))
+        self.assertEqual(st.get("/unknown", "default"), "default")
+        self.assertEqual(st.get_full("/foo"), ("/bar", time1, False))
+        self.assertEqual(st.get_full("/baz"), ("/bar", time1, True))
+        self.assertEqual(st.get_full("/qux"), ("/quux", time1, False))
+        self.assertEqual(st.get_full("/unknown"), (None, None, True))
+        legacy = st.get_full("/legacy")
+        self.assertTrue(time2.micros() <= legacy[1].micros() <= time3.micros())
+        self.assertTrue(legacy[2])
+        self.assertEqual(len(list(st.export_rows())), 4)
+        # New redirects are compact too, even when asking otherwise.
+        st.compact_values = False
+        st.add("/new", "/bar")
+        st.update({"/newer": "/bar"})
+        self.assertEqual(len(st._paths["/new"]), 2)
+        self.assertEqual(len(st._paths["/newer"]), 2)
+
+    def test_storage_interning(self):
+        st = RedirectionStorage()
+        time1 = DateTime()
+        st.add("/plone/foo", "/plone/bar", now=time1)
+        st._paths["/plone/legacy"] = "/plone/bar"
+        st._rpaths["/plone/bar"].insert("/plone/legacy")
+        st._migrate_length()
+        st.enable_interning()
+        self.assertSetEqual({type(key) for key in st._paths}, {bytes})
+        self.assertSetEqual({type(key) for key in st._rpaths}, {bytes})
+        # The legacy value has been converted.
+        self.assertSetEqual({len(value) for value in st._paths.values()}, {3})
+        self.assertEqual(len(st), 2)
+        self.assertEqual(st.get("/plone/foo"), "/plone/bar")
+        self.assertEqual(st.get_full("/plone/foo"), ("/plone/bar", time1, False))
+        self.assertEqual(st.get("/plone/legacy"), "/plone/bar")
+
+        # The full API works with the paths as strings.
+        st["/plone/baz"] = "/plone/foo/"
+        self.assertEqual(st["/plone/baz"], "/plone/foo")
+        st.add("/plone/foo", "/plone/qux")
+        self.assertEqual(st.get("/plone/baz"), "/plone/qux")
+        self.assertIn("/plone/baz", st)
+        self.assertNotIn("/plone/unknown", st)
+        self.assertNotIn("/plone", st)
+        self.assertIsNone(st.get("/plone/unknown"))
+        self.assertEqual(st.get("/plone/unknown", "default"), "default")
+        self.assertEqual(st.get_full("/plone/unknown"), (None, None, True))
+        self.assertEqual(st.get_full("/plone/unknown", "x"), ("x", None, True))
+        with self.assertRaises(KeyError):
+            st["/plone/unknown"]
+        self.assertListEqual(
+            sorted(st.redirects("/plone/qux")), ["/plone/baz", "/plone/foo"]
+        )
+        self.assertListEqual(st.redirects("/plone/unknown"), [])
+        self.assertListEqual(sorted(st), ["/plone/baz", "/plone/foo", "/plone/legacy"])
+        st.update({"/plone/a": "/plone/b", "/plone/b": "/plone/c"})
+        self.assertEqual(st.get("/plone/a"), "/plone/c")
+        st.import_rows([("/plone/d", "/plone/c", "", "")])
+        self.assertListEqual(
+            sorted(st.redirects("/plone/c")), ["/plone/a", "/plone/b", "/plone/d"]
+        )
+        self.assertEqual(len(st), 6)
+        rows = list(st.export_rows())
+        self.assertEqual(len(rows), 6)
+        self.assertIn(("/plone/foo", "/plone/qux"), [row[:2] for row in rows])
+        self.assertListEqual(list(st.export_rows(cursor=rows[2][0])), rows[3:])
+        with self.assertRaises(KeyError):
+            list(st.export_rows(cursor="/other/unknown"))
+        del st["/plone/baz"]
+        with self.assertRaises(KeyError):
+            del st["/plone/unknown"]
+        st.destroy("/plone/c")
+        st.destroy("/plone/unknown")
+        self.assertListEqual(sorted(st), ["/plone/foo", "/plone/legacy"])
+        self.assertEqual(len(st), 2)
+        st._rebuild()
+        st.enable_bloom_filter()
+        self.assertIn("/plone/foo", st)
+        self.assertNotIn("/plone/baz", st)
+
+        # A path that is also a prefix.
+        st.add("/plone/foo/bar", "/plone/foo/bar/baz")
+        self.assertEqual(st.get("/plone/foo/bar"), "/plone/foo/bar/baz")
+
+        # Back to strings.
+        st.disable_interning()
+        self.assertSetEqual({type(key) for key in st._paths}, {str})
+        self.assertSetEqual({type(key) for key in st._rpaths}, {str})
+        self.assertListEqual(
+            sorted(st), ["/plone/foo", "/plone/foo/bar", "/plone/legacy"]
+        )
+        self.assertEqual(st.get("/plone/foo"), "/plone/qux")
+        self.assertListEqual(st.redirects("/plone/bar"), ["/plone/legacy"])
+        st.disable_interning()
+
+        st.enable_interning()
+        st.clear()
+        self.assertEqual(len(st._prefixes), 0)
+        st.add("/plone/foo", "/plone/bar")
+        self.assertEqual(st.get("/plone/foo"), "/plone/bar")
+
+    def test_storage_subtree(self):
+        st = RedirectionStorage()
+        self.assertListEqual(st.subtrees(), [])
+        self.assertIsNone(st.get_subtree("/a"))
+        time1 = DateTime()
+        st.add_subtree("/a", "/b/", now=time1)
+        self.assertEqual(st.get_subtree("/a/"), "/b")
+        self.assertListEqual(st.subtrees(), [("/a", "/b")])
+        self.assertEqual(st.get("/a/x/y"), "/b/x/y")
+        self.assertEqual(st["/a/x/"], "/b/x")
+        self.assertEqual(st.get_full("/a/x"), ("/b/x", time1, False))
+        self.assertIn("/a/x", st)
+        # Not the prefix itself, or similar paths.
+        self.assertNotIn("/a", st)
+        self.assertNotIn("/ab/x", st)
+        self.assertIsNone(st.get("/a"))
+        self.assertEqual(st.get("/ab/x", "default"), "default")
+        self.assertEqual(st.get_full("/ab/x"), (None, None, True))
+        # Subtree redirects are not counted or listed.
+        self.assertEqual(len(st), 0)
+        self.assertListEqual(list(st), [])
+
+        # The longest prefix wins, and exact redirects win from both.
+        st.add_subtree("/a/x", "/c")
+        st.add("/a/x/z", "/d")
+        self.assertEqual(st.get("/a/y"), "/b/y")
+        self.assertEqual(st.get("/a/x/y"), "/c/y")
+        self.assertEqual(st.get("/a/x/z"), "/d")
+
+        # Redirects to paths below an old prefix are updated.
+        st.add("/e", "/f/g")
+        st.add_subtree("/h", "/f/i")
+        st.add_subtree("/f", "/j")
+        self.assertEqual(st.get("/e"), "/j/g")
+        self.assertListEqual(st.redirects("/j/g"), ["/e"])
+        self.assertListEqual(st.redirects("/f/g"), [])
+        self.assertEqual(st.get("/h/k"), "/j/i/k")
+        self.assertListEqual(
+            st.subtrees(),
+            [("/a", "/b"), ("/a/x", "/c"), ("/f", "/j"), ("/h", "/j/i")],
+        )
+        # Subtree redirects to themselves are removed.
+        st.add_subtree("/j/i", "/h")
+        self.assertIsNone(st.get_subtree("/h"))
+        self.assertEqual(st.get("/j/i/k"), "/h/k")
+        # A subtree redirect for other content at the same old prefix
+        # keeps the existing one, unless that is removed first.
+        st.add_subtree("/f", "/l")
+        self.assertEqual(st.get("/f/m"), "/j/m")
+        st.remove_subtree("/f")
+        st.add_subtree("/f", "/l")
+        self.assertEqual(st.get("/f/m"), "/l/m")
+        self.assertNotIn("/j", st._rsubtrees)
+
+        # A path below a new prefix that moves gets its own redirect.
+        st.add("/b/n", "/o")
+        self.assertEqual(st.get("/a/n"), "/o")
+        self.assertEqual(st.get("/b/n"), "/o")
+        self.assertEqual(len(st), 4)
+
+        # Destroying a new prefix removes its subtree redirects.
+        st.destroy("/b")
+        self.assertIsNone(st.get_subtree("/a"))
+        self.assertEqual(st.get("/a/n"), "/o")
+        self.assertIsNone(st.get("/a/p"))
+        st.remove_subtree("/a/x")
+        self.assertIsNone(st.get("/a/x/y"))
+        with self.assertRaises(KeyError):
+            st.remove_subtree("/a/x")
+        st.clear()
+        self.assertListEqual(st.subtrees(), [])
+        with self.assertRaises(KeyError):
+            st.remove_subtree("/f")
+
+    def test_storage_subtree_interning(self):
+        st = RedirectionStorage()
+        st.enable_interning()
+        st.add("/plone/e", "/plone/f/g")
+        st.add("/plone/e2", "/plone/f/g/h")
+        st.add("/plone/e3", "/plone/fg")
+        st.add_subtree("/plone/f", "/plone/j")
+        self.assertEqual(st.get("/plone/e"), "/plone/j/g")
+        self.assertEqual(st.get("/plone/e2"), "/plone/j/g/h")
+        self.assertEqual(st.get("/plone/e3"), "/plone/fg")
+        self.assertEqual(st.get("/plone/f/x"), "/plone/j/x")
+        st.add("/plone/j/g", "/plone/k")
+        self.assertEqual(st.get("/plone/f/g"), "/plone/k")
+        self.assertEqual(st.get("/plone/e"), "/plone/k")
+        self.assertListEqual(
+            sorted(st.redirects("/plone/k")), ["/plone/e", "/plone/f/g", "/plone/j/g"]
+        )
+
+    def test_storage_subtree_cycle(self):
+        # Like moving /s/a into /s/b, and then /s/b/a/sub to /s/a.
+        for bulk in (False, True):
+            st = RedirectionStorage()
+            st.add_subtree("/s/a", "/s/b/a")
+            st.add("/s/a", "/s/b/a")
+            st.add_subtree("/s/b/a/sub", "/s/a")
+            if bulk:
+                st.update({"/s/b/a/sub": "/s/a"})
+            else:
+                st.add("/s/b/a/sub", "/s/a")
+            self.assertEqual(st.get("/s/b/a/sub"), "/s/a")
+            self.assertEqual(st.get("/s/a/sub"), "/s/a")
+            self.assertEqual(len(st), 3)
+
+    def test_storage_subtree_move_subfolder(self):
+        # Like moving /s/a to /s/b/n0, and then /s/b/n0/x to /s/c/a.
+        st = RedirectionStorage()
+        st.add_subtree("/s/a", "/s/b/n0")
+        st.add("/s/a", "/s/b/n0")
+        st.add_subtree("/s/b/n0/x", "/s/c/a")
+        st.add("/s/b/n0/x", "/s/c/a")
+        self.assertEqual(st.get("/s/a/x"), "/s/c/a")
+        self.assertEqual(st.get("/s/a/x/1"), "/s/c/a/1")
+        self.assertEqual(st.get("/s/a/y/1"), "/s/b/n0/y/1")
+        self.assertIn(("/s/a/x", "/s/c/a"), st.subtrees())
+        # Removing the rest of /s/b/n0 keeps them.
+        st.destroy_subtree("/s/b/n0")
+        self.assertEqual(st.get("/s/a/x/1"), "/s/c/a/1")
+        self.assertIsNone(st.get("/s/a/y/1"))
+        # A subtree redirect that already matches stays.
+        st.add_subtree("/s/a/z", "/s/d")
+        st.add_subtree("/s/a", "/s/b/n1")
+        st.add_subtree("/s/b/n1/z", "/s/e")
+        self.assertEqual(st.get("/s/a/z/1"), "/s/d/1")
+
+    def test_storage_subtree_below_itself(self):
+        st = RedirectionStorage()
+        st.add_subtree("/plone/news", "/plone/archive")
+        st.add("/plone/news", "/plone/archive")
+        st.add_subtree("/plone/archive", "/plone/news/archive")
+        st.add("/plone/archive", "/plone/news/archive")
+        self.assertIn(("/plone/news", "/plone/news/archive"), st.subtrees())
+        self.assertEqual(st.get("/plone/news/missing"), "/plone/news/archive/missing")
+        # Not /plone/news/archive/archive/missing, and so on without end.
+        self.assertIsNone(st.get("/plone/news/archive/missing"))
+        self.assertIsNone(st.get("/plone/news/archive"))
+        self.assertEqual(
+            st.get("/plone/archive/missing"), "/plone/news/archive/missing"
+        )
+        self.assertEqual(st.get("/plone/news"), "/plone/news/archive")
+
+    def test_storage_subtree_moved_back(self):
+        # Like the objectMoved subscriber: /s/b with child z is moved to
+        # /s/a/c, then /s/a to /s/b, and then /s/b to /s/n8.
+        st = RedirectionStorage()
+        st.add_subtree("/s/b", "/s/a/c")
+        st.add("/s/b", "/s/a/c")
+        st.add_subtree("/s/a", "/s/b")
+        st.add("/s/a", "/s/b")
+        self.assertEqual(st.get("/s/b/z"), "/s/b/c/z")
+        st.add_subtree("/s/b", "/s/n8")
+        st.add("/s/b", "/s/n8")
+        # The contents of the second /s/b get their own redirects.
+        self.assertNotEqual(st.get("/s/b/c"), "/s/n8/c")
+        st.add("/s/b/c", "/s/n8/c")
+        self.assertEqual(st.get("/s/b/z"), "/s/n8/c/z")
+        self.assertEqual(st.get("/s/b/c"), "/s/n8/c")
+        self.assertEqual(st.get("/s/a/c/z"), "/s/n8/c/z")
+        self.assertEqual(st.get("/s/b"), "/s/n8")
+
+    def test_storage_subtree_keeps_exact(self):
+        for bulk in (False, True):
+            st = RedirectionStorage()
+            st.add_subtree("/old", "/new")
+            st.add("/old", "/new")
+            st.add("/old/page", "/landing", manual=True)
+            if bulk:
+                st.update({"/new/page": "/elsewhere"}, manual=False)
+            else:
+                st.add("/new/page", "/elsewhere")
+            self.assertEqual(st.get_full("/old/page")[::2], ("/landing", True))
+            self.assertEqual(st.get("/new/page"), "/elsewhere")
+            # Other paths below the old prefix still get their own redirect.
+            st.add("/new/other", "/elsewhere")
+            self.assertEqual(st.get("/old/other"), "/elsewhere")
+
+    def test_storage_add_deferred(self):
+        transaction.abort()
+        self.addCleanup(transaction.abort)
+        st = RedirectionStorage()
+        st.add_deferred("/a", "/b/")
+        self.assertNotIn("/a", st._paths)
+        # Other methods see it.
+        self.assertEqual(st.get("/a"), "/b")
+        self.assertIn("/a", st._paths)
+        self.assertListEqual(st.redirects("/b"), ["/a"])
+
+        # Successive moves of one object are resolved.
+        st.add_deferred("/c", "/d")
+        st.add_deferred("/d", "/e")
+        st.add_deferred("/b", "/f")
+        st.add_deferred("/g", "/h")
+        st.add_deferred("/h", "/g")
+        self.assertEqual(st.get("/c"), "/e")
+        self.assertEqual(st.get("/d"), "/e")
+        self.assertNotIn("/g", st)
+        self.assertEqual(st.get("/h"), "/g")
+        # Existing redirects are updated.
+        self.assertEqual(st.get("/a"), "/f")
+        self.assertEqual(st.get("/b"), "/f")
+        self.assertEqual(len(st), 5)
+
+        # A destroy in between keeps both moves.
+        st.add_deferred("/n", "/o")
+        st.destroy_deferred("/p")
+        st.add_deferred("/o", "/q")
+        self.assertEqual(st.get("/n"), "/q")
+        self.assertEqual(st.get("/o"), "/q")
+
+        # Aborting forgets them.
+        st.add_deferred("/i", "/j")
+        transaction.abort()
+        self.assertNotIn("/i", st)
+
+        # Committing adds them.
+        db = DB(None)
+        self.addCleanup(db.close)
+        connection = db.open()
+        self.addCleanup(connection.close)
+        connection.root()["storage"] = st
+        transaction.commit()
+        st.add_deferred("/k", "/l")
+        st.add_deferred("/l", "/m")
+        transaction.commit()
+        self.assertEqual(st._paths["/k"][0], "/m")
+        self.assertEqual(st._paths["/l"][0], "/m")
+
+    def test_storage_deferred_savepoints(self):
+        transaction.abort()
+        self.addCleanup(transaction.abort)
+        db = DB(None)
+        self.addCleanup(db.close)
+        connection = db.open()
+        self.addCleanup(connection.close)
+        st = RedirectionStorage()
+        connection.root()["storage"] = st
+        st.add("/old", "/doc")
+        transaction.commit()
+
+        # Rolling back a savepoint forgets the changes deferred after it.
+        savepoint = transaction.savepoint()
+        st.destroy_deferred("/doc", subtree=True)
+        st.add_deferred("/a", "/b")
+        savepoint.rollback()
+        transaction.commit()
+        self.assertEqual(st.get("/old"), "/doc")
+        self.assertNotIn("/a", st)
+
+        # Also when they were added to the storage after the savepoint,
+        # and the ones from before it are kept.
+        st.add_deferred("/c", "/d")
+        savepoint = transaction.savepoint()
+        st.add_deferred("/e", "/f")
+        self.assertEqual(st.get("/c"), "/d")
+        savepoint.rollback()
+        st.add_deferred("/g", "/h")
+        transaction.commit()
+        self.assertEqual(st.get("/c"), "/d")
+        self.assertNotIn("/e", st)
+        self.assertEqual(st.get("/g"), "/h")
+
+    def test_storage_deferred_transaction_manager(self):
+        transaction.abort()
+        self.addCleanup(transaction.abort)
+        db = DB(None)
+        self.addCleanup(db.close)
+        manager = transaction.TransactionManager()
+        connection = db.open(transaction_manager=manager)
+        self.addCleanup(connection.close)
+        connection.root()["storage"] = st = RedirectionStorage()
+        manager.commit()
+
+        # The changes are deferred in the transaction of the connection.
+        st.add_deferred("/a", "/b")
+        self.assertListEqual(transaction.get()._resources, [])
+        manager.commit()
+        other = db.open(transaction_manager=transaction.TransactionManager())
+        self.addCleanup(other.close)
+        self.assertEqual(other.root()["storage"].get("/a"), "/b")
+
+    def test_storage_has_redirect(self):
+        transaction.abort()
+        self.addCleanup(transaction.abort)
+        st = RedirectionStorage()
+        st.add("/a", "/b")
+        st.add_subtree("/f", "/g")
+        self.assertTrue(st.has_redirect("/a", "/b/"))
+        self.assertTrue(st.has_redirect("/f/x", "/g/x"))
+        self.assertFalse(st.has_redirect("/a", "/c"))
+        self.assertFalse(st.has_redirect("/c", "/d"))
+
+        # Deferred moves are seen without adding them.
+        st.add_deferred("/c", "/d")
+        st.add_deferred("/d", "/e")
+        self.assertTrue(st.has_redirect("/d", "/e"))
+        self.assertFalse(st.has_redirect("/c", "/d"))
+        # It may say no when the moves are chained.
+        self.assertFalse(st.has_redirect("/c", "/e"))
+        # /a will redirect to /h.
+        st.add_deferred("/b", "/h")
+        self.assertFalse(st.has_redirect("/a", "/b"))
+        self.assertNotIn("/c", st._paths)
+        # Neither do get_subtree and add_subtree, when they do not need to.
+        self.assertEqual(st.get_subtree("/f"), "/g")
+        st.add_subtree("/i", "/j")
+        st.add_subtree("/i", "/j")
+        self.assertNotIn("/c", st._paths)
+        self.assertEqual(st.get("/a"), "/h")
+        self.assertIn("/c", st._paths)
+        self.assertEqual(st.get("/c"), "/e")
+
+        # A subtree redirect from or to a moved path adds the moves first.
+        st.add_deferred("/k", "/l/m")
+        st.add_subtree("/l", "/n")
+        self.assertEqual(st.get("/k"), "/n/m")
+
+        # So do destroys.
+        st.add_deferred("/o", "/p")
+        st.destroy_deferred("/q")
+        self.assertFalse(st.has_redirect("/o", "/q"))
+        self.assertIn("/o", st._paths)
+
+    def test_storage_destroy_deferred(self):
+        transaction.abort()
+        self.addCleanup(transaction.abort)
+        st = RedirectionStorage()
+        st.update({"/a": "/b", "/c": "/d", "/e": "/f"})
+        st.destroy_deferred("/b/")
+        st.destroy_deferred("/d")
+        self.assertIn("/a", st._paths)
+        self.assertNotIn("/a", st)
+        self.assertEqual(len(st), 1)
+        # Moves and removals are applied in order.
+        st.destroy_deferred("/f")
+        st.add_deferred("/g", "/f")
+        st.add_deferred("/h", "/i")
+        st.destroy_deferred("/i")
+        self.assertListEqual(list(st), ["/g"])
+        # With the removal queue, they are queued.
+        st.enable_removal_queue()
+        st.destroy_deferred("/f")
+        self.assertEqual(st.pending_removals(), 1)
+        self.assertIsNone(st.get("/g"))
+
+    def test_storage_destroy_many(self):
+        st = RedirectionStorage()
+        st.update({"/a": "/b", "/c": "/b", "/d": "/e", "/f": "/g"})
+        st.add_subtree("/h", "/e")
+        st.destroy_many(["/b", "/e/", "/unknown"])
+        self.assertListEqual(list(st), ["/f"])
+        self.assertListEqual(list(st._rpaths), ["/g"])
+        self.assertListEqual(st.subtrees(), [])
+        self.assertEqual(len(st), 1)
+        st.destroy_many([])
+        self.assertEqual(len(st), 1)
+
+    def test_storage_destroy_subtree(self):
+        st = RedirectionStorage()
+        st.update(
+            {
+                "/a": "/f",
+                "/b": "/f/x/y",
+                "/c": "/f/x",
+                "/d": "/fa",
+                "/e": "/f-b/x",
+            }
+        )
+        st.add_subtree("/g", "/f/z")
+        st.add_subtree("/h", "/e")
+        st.destroy_subtree("/f/")
+        self.assertListEqual(list(st), ["/d", "/e"])
+        self.assertListEqual(st.subtrees(), [("/h", "/e")])
+        self.assertEqual(len(st), 2)
+
+        # The same with interning, and with the removal queue.
+        st = RedirectionStorage()
+        st.enable_interning()
+        st.update({"/a": "/f", "/b": "/f/x/y", "/c": "/f/x", "/d": "/fa"})
+        st.enable_removal_queue()
+        st.destroy_subtree("/f")
+        self.assertIsNone(st.get("/b"))
+        self.assertEqual(st.get("/d"), "/fa")
+        self.assertListEqual(st.redirects("/f/x"), [])
+        # A redirect to a path in the queued folder processes it first.
+        st.add("/e", "/f/x")
+        self.assertEqual(st.pending_removals(), 0)
+        self.assertListEqual(list(st), ["/d", "/e"])
+
+    def test_storage_items_from(self):
+        st = RedirectionStorage()
+        time1 = DateTime("2020-01-01 00:00:00 UTC")
+        time2 = DateTime("2021-01-01 00:00:00 UTC")
+        st.update(
+            {
+                "/news": ("/archive/news", time1, True),
+                "/news/a": ("/archive/news/a", time2, False),
+                "/news/b": ("/b", time2, True),
+                "/news-b": ("/archive/b", time1, False),
+                "/newsa": ("/archive/news", time1, False),
+            }
+        )
+        self.assertListEqual(
+            [row[:2] for row in st.items_from("/news/")],
+            [
+                ("/news", "/archive/news"),
+                ("/news/a", "/archive/news/a"),
+                ("/news/b", "/b"),
+            ],
+        )
+        self.assertListEqual(list(st.items_from("/unknown")), [])
+        rows = st.items_from("/news", start=time2)
+        self.assertEqual(next(rows), ("/news/a", "/archive/news/a", time2, False))
+        self.assertListEqual(
+            [row[0] for row in st.items_from("/news", end=time1)], ["/news"]
+        )
+        self.assertListEqual(
+            [row[0] for row in st.items_from("/news", manual=True)],
+            ["/news", "/news/b"],
+        )
+        self.assertListEqual(
+            [row[0] for row in st.items_from("/news", time1, time2, False)],
+            ["/news/a"],
+        )
+
+        self.assertListEqual(
+            [row[:2] for row in st.targets_under("/archive/news")],
+            [
+                ("/news", "/archive/news"),
+                ("/newsa", "/archive/news"),
+                ("/news/a", "/archive/news/a"),
+            ],
+        )
+        self.assertListEqual(
+            [row[0] for row in st.targets_under("/archive", manual=False)],
+            ["/news-b", "/newsa", "/news/a"],
+        )
+
+        # The same with interning and compact values.
+        st.enable_interning()
+        st._migrate_values()
+        self.assertListEqual(
+            [row[0] for row in st.items_from("/news", manual=True)],
+            ["/news", "/news/b"],
+        )
+        self.assertListEqual(
+            [row[0] for row in st.targets_under("/archive/news", start=time2)],
+            ["/news/a"],
+        )
+
+    def test_storage_date_index(self):
+        st = RedirectionStorage()
+        time1 = DateTime("2020-01-01 00:00:00 UTC")
+        time2 = DateTime("2021-01-01 00:00:00 UTC")
+        time3 = DateTime("2022-01-01 00:00:00 UTC")
+        st.update(
+            {
+                "/a": ("/new/a", time1, True),
+                "/b": ("/new/b", time2, False),
+                "/c": ("/new/c", time2, True),
+                "/d": ("/new/d", time3, False),
+            }
+        )
+
+        def old_paths(rows):
+            return [row[0] for row in rows]
+
+        # Without the index we get the same, but slower.
+        for enable in (False, True):
+            if enable:
+                st.enable_date_index()
+                self.assertEqual(len(st._dates), 4)
+            self.assertListEqual(
+                old_paths(st.items_by_date()), ["/d", "/b", "/c", "/a"]
+            )
+            self.assertListEqual(
+                old_paths(st.items_by_date(start=time2, end=time2)), ["/b", "/c"]
+            )
+            self.assertListEqual(
+                old_paths(st.items_by_date(end=time2, manual=True)), ["/c", "/a"]
+            )
+            self.assertListEqual(old_paths(st.manual_redirects()), ["/a", "/c"])
+            self.assertListEqual(old_paths(st.manual_redirects(limit=1)), ["/a"])
+            self.assertListEqual(old_paths(st.manual_redirects(cursor="/a")), ["/c"])
+
+            # Pages
+            page = list(st.items_by_date(limit=2))
+            self.assertEqual(page[1], ("/b", "/new/b", time2, False))
+            page = list(st.items_by_date(cursor=page[-1], limit=2))
+            self.assertListEqual(old_paths(page), ["/c", "/a"])
+            self.assertListEqual(list(st.items_by_date(cursor=page[-1])), [])
+
+        # The index follows the changes.
+        st.add("/b", "/new/b2", now=time3, manual=True)
+        st.add("/new/d", "/newer/d", now=time1)
+        st.remove("/a")
+        st.destroy("/new/c")
+        self.assertListEqual(
+            list(st.items_by_date()),
+            [
+                ("/b", "/new/b2", time3, True),
+                ("/d", "/newer/d", time3, False),
+                ("/new/d", "/newer/d", time1, False),
+            ],
+        )
+        self.assertListEqual(old_paths(st.manual_redirects()), ["/b"])
+        st.update({"/b": ("/new/b3", time1, False), "/new/b3": "/e"})
+        self.assertListEqual(
+            old_paths(st.items_by_date(manual=False)), ["/d", "/b", "/new/d"]
+        )
+        self.assertListEqual(old_paths(st.manual_redirects()), ["/new/b3"])
+        self.assertEqual(len(st._dates), len(st))
+
+        # The same with interning, compact values and lazy chains.
+        st.enable_interning()
+        st._migrate_values()
+        st.enable_lazy_chains()
+        st.add("/new/b", "/f", now=time2)
+        st.add("/e", "/g", now=time1)
+        self.assertListEqual(
+            list(st.items_by_date(start=time2, end=time3)),
+            [("/d", "/newer/d", time3, False), ("/new/b", "/f", time2, False)],
+        )
+        self.assertListEqual(
+            [row[:2] for row in st.manual_redirects()], [("/new/b3", "/g")]
+        )
+        st.destroy_subtree("/newer")
+        st._rebuild()
+        rows = list(st.items_by_date())
+        self.assertListEqual(old_paths(rows[:2]), ["/new/b3", "/new/b"])
+        self.assertSetEqual(set(old_paths(rows[2:])), {"/b", "/e"})
+        st.clear()
+        self.assertEqual(len(list(st.items_by_date())), len(st))
+
+    def test_storage_prune(self):
+        time1 = DateTime("2020-01-01 00:00:00 UTC")
+        time2 = DateTime("2021-01-01 00:00:00 UTC")
+        time3 = DateTime("2022-01-01 00:00:00 UTC")
+        # Without and with the date index, and with lazy chains.
+        for mode in ("scan", "index", "lazy"):
+            st = RedirectionStorage()
+            if mode != "scan":
+                st.enable_date_index()
+            if mode == "lazy":
+                st.enable_lazy_chains()
+            st.update(
+                {
+                    "/a": ("/new/a", time1, False),
+                    "/b": ("/new/b", time1, True),
+                    "/c": ("/new/c", time1, False),
+                    "/d": ("/new/d", time2, False),
+                    "/e": ("/new/e", time3, False),
+                    "/f": ("/new/f", time1, False),
+                }
+            )
+            st._paths["/legacy"] = "/new/legacy"
+            st._change_length(1)
+            st.add("/new/c", "/newer/c", now=time3)
+            st.add_subtree("/old", "/new", now=time1)
+            st.add_subtree("/older", "/new", now=time3)
+
+            reports = []
+            removed = st.prune(
+                time2,
+                batch_size=1,
+                keep=lambda old_path: old_path == "/f",
+                progress=lambda done, rate: reports.append(done),
+            )
+            self.assertEqual(removed, 3)
+            self.assertListEqual(reports, [1, 2, 3])
+            self.assertListEqual(
+                list(st), ["/b", "/d", "/e", "/f", "/legacy", "/new/c"]
+            )
+            self.assertEqual(len(st), 6)
+            self.assertEqual(st.get("/new/c"), "/newer/c")
+            self.assertListEqual(st.redirects("/newer/c"), ["/new/c"])
+            self.assertListEqual(st.redirects("/new/a"), [])
+            self.assertListEqual(st.subtrees(), [("/older", "/new")])
+            self.assertEqual(st.prune(time2), 1)
+            self.assertNotIn("/f", st)
+            self.assertEqual(st.prune(time3, keep=lambda old_path: True), 0)
+            self.assertEqual(st.prune(DateTime("2023-01-01 00:00:00 UTC")), 4)
+            self.assertListEqual(list(st), ["/b", "/legacy"])
+            if mode != "scan":
+                self.assertEqual(len(st._dates), 1)
+            transaction.abort()
+
+    def test_storage_hits(self):
+        st = RedirectionStorage()
+        time1 = DateTime("2020-01-01 00:00:00 UTC")
+        time2 = DateTime("2021-01-01 00:00:00 UTC")
+        st.update(
+            {
+                "/a": ("/new/a", time1, False),
+                "/b": ("/new/b", time1, False),
+                "/c": ("/new/c", time1, False),
+            }
+        )
+        # Without hit tracking, hits are ignored.
+        st.record_hits({"/a": (1, time2.micros())})
+        self.assertEqual(st.get_hits("/a"), (0, None))
+        self.assertListEqual(list(st.iter_hits()), [])
+
+        st.enable_hit_tracking()
+        st.record_hits({"/a": (2, time1.micros()), "/b": (1, time1.micros())})
+        st.record_hits({"/a": (3, time2.micros())})
+        self.assertEqual(st.get_hits("/a/"), (5, time2))
+        self.assertListEqual(list(st.iter_hits()), [("/a", 5, time2), ("/b", 1, time1)])
+        self.assertListEqual(list(st.iter_hits(cursor="/a")), [("/b", 1, time1)])
+
+        # Pruning keeps the redirects with recent hits, and forgets the hits
+        # of the removed ones.
+        self.assertEqual(st.prune(time2, hit_since=time2), 2)
+        self.assertListEqual(list(st), ["/a"])
+        self.assertListEqual(list(st.iter_hits()), [("/a", 5, time2)])
+        st.clear()
+        self.assertEqual(st.get_hits("/a"), (0, None))
+
+    def test_storage_rules(self):
+        st = RedirectionStorage()
+        self.assertIsNone(st.match_rule("/plone/blog/2020/a"))
+        generation = st._generation()
+        st.add_rule(r"/plone/blog/(\d{4})/(.*)", r"/plone/news/\1/\2", "regex")
+        st.add_rule("/plone/old/", "/plone/new")
+        self.assertGreater(st._generation(), generation)
+        self.assertEqual(st.match_rule("/plone/blog/2020/a/"), "/plone/news/2020/a")
+        self.assertEqual(st.match_rule("/plone/old/a"), "/plone/new/a")
+        # Rules are separate from the redirects.
+        self.assertIsNone(st.get("/plone/old/a"))
+        self.assertEqual(len(st), 0)
+        self.assertListEqual(
+            st.rules(),
+            [
+                (r"/plone/blog/(\d{4})/(.*)", r"/plone/news/\1/\2", "regex"),
+                ("/plone/old", "/plone/new", "prefix"),
+            ],
+        )
+        st.remove_rule("/plone/old/")
+        self.assertIsNone(st.match_rule("/plone/old/a"))
+        with self.assertRaises(KeyError):
+            st.remove_rule("/plone/old")
+        st.clear()
+        self.assertListEqual(st.rules(), [])
+
+    def test_storage_resolve(self):
+        st = RedirectionStorage()
+        st["/plone/a?x=1"] = "/plone/query"
+        st["/plone/b"] = "/plone/path"
+        st["/plone/c"] = "/plone/view"
+        st["/plone/d"] = "/plone/d"
+        st.add_rule("/plone/old", "/plone/new")
+        self.assertEqual(
+            st.resolve(["", "plone", "a"], "x=1"),
+            ("/plone/query", "", "query", "/plone/a?x=1"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "b"], "y=2"),
+            ("/plone/path", "y=2", "path", "/plone/b"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "c", "@@images", "image"]),
+            ("/plone/view/@@images/image", "", "view", "/plone/c"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "c", "view"], "", "edit"),
+            ("/plone/view/edit", "", "template", "/plone/c"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "c", "view"]),
+            ("/plone/view/view", "", "template", "/plone/c"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "old", "a"]),
+            ("/plone/new/a", "", "rule", "/plone/old"),
+        )
+        # A parent that redirects to itself is not used.
+        self.assertEqual(
+            st.resolve(["", "plone", "d", "view"], "y=2"),
+            (None, "y=2", None, None),
+        )
+        self.assertEqual(st.resolve([""]), (None, "", None, None))
+
+    def test_storage_resolve_ancestor(self):
+        st = RedirectionStorage()
+        st["/plone/old"] = "/plone/new"
+        st["/plone/old/a/b"] = "/plone/b"
+        st["/plone/same"] = "/plone/same"
+        self.assertEqual(
+            st.resolve(["", "plone", "old", "x", "y", "z"], "q=1"),
+            ("/plone/new/x/y/z", "q=1", "ancestor", "/plone/old"),
+        )
+        # The nearest ancestor wins.
+        self.assertEqual(
+            st.resolve(["", "plone", "old", "a", "b", "c", "d"]),
+            ("/plone/b/c/d", "", "ancestor", "/plone/old/a/b"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "old", "x", "@@view", "y"]),
+            ("/plone/new/x/@@view/y", "", "ancestor", "/plone/old"),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "same", "x", "y"]), (None, "", None, None)
+        )
+        # An ancestor that redirects below itself gives one hop, not a loop.
+        st["/plone/news"] = "/plone/news/archive"
+        self.assertEqual(
+            st.resolve(["", "plone", "news", "x", "y"])[0], "/plone/news/archive/x/y"
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "news", "archive", "x", "y"]),
+            (None, "", None, None),
+        )
+        self.assertEqual(
+            st.resolve(["", "plone", "news", "archive", "missing"]),
+            (None, "", None, None),
+        )
+        # Subtree redirects win, as they match the path itself.
+        st.add_subtree("/plone/old/x", "/plone/x")
+        self.assertEqual(
+            st.resolve(["", "plone", "old", "x", "y", "z"]),
+            ("/plone/x/y/z", "", "path", "/plone/old/x"),
+        )
+
+    def test_storage_prune_commit(self):
+        db = DB(None)
+        self.addCleanup(db.close)
+        connection = db.open()
+        self.addCleanup(connection.close)
+        self.addCleanup(transaction.abort)
+        st = RedirectionStorage()
+        connection.root()["storage"] = st
+        st.update(
+            {f"/old/{i}": (f"/new/{i}", DateTime(2020, 1, 1), False) for i in range(10)}
+        )
+        transaction.commit()
+
+        def progress(done, rate):
+            if done == 6:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            st.prune(DateTime(2021, 1, 1), batch_size=3, commit=True, progress=progress)
+        transaction.abort()
+        self.assertEqual(len(st), 4)
+        self.assertEqual(st.prune(DateTime(2021, 1, 1), batch_size=3, commit=True), 4)
+        self.assertEqual(len(st), 0)
+
+    def test_storage_removal_queue(self):
+        st = RedirectionStorage()
+        st.add("/a", "/b")
+        st.add("/c", "/b")
+        st.add("/d", "/e")
+        st.add_subtree("/f", "/g")
+        st.enable_removal_queue()
+        self.assertEqual(st.pending_removals(), 0)
+        st.destroy("/b/")
+        st.destroy("/g")
+        self.assertEqual(st.pending_removals(), 2)
+        # The redirects are still there, but they are not served.
+        self.assertEqual(len(st), 3)
+        self.assertIn("/a", st._paths)
+        self.assertNotIn("/a", st)
+        self.assertIsNone(st.get("/c"))
+        self.assertEqual(st.get_full("/c"), (None, None, True))
+        self.assertListEqual(st.redirects("/b"), [])
+        self.assertIsNone(st.get("/f/x"))
+        self.assertListEqual(st.subtrees(), [("/f", "/g")])
+        self.assertEqual(st.get("/d"), "/e")
+
+        # A new redirect to a queued path first processes it.
+        st.add("/h", "/b")
+        self.assertEqual(st.pending_removals(), 1)
+        self.assertEqual(st.get("/h"), "/b")
+        self.assertIsNone(st.get("/a"))
+        self.assertEqual(len(st), 2)
+
+        # So does a new redirect from a queued path.
+        st.destroy("/e")
+        st.add("/e", "/i")
+        self.assertIsNone(st.get("/d"))
+        self.assertEqual(st.get("/e"), "/i")
+
+        # Process the queue in batches.
+        st.destroy("/i")
+        st.destroy("/j")
+        self.assertEqual(st.process_removals(limit=2), 2)
+        self.assertEqual(st.pending_removals(), 1)
+        self.assertListEqual(st.subtrees(), [])
+        self.assertEqual(st.process_removals(), 1)
+        self.assertEqual(st.process_removals(), 0)
+        self.assertListEqual(list(st), ["/h"])
+
+        # Disabling processes the rest.
+        st.destroy("/b")
+        st.disable_removal_queue()
+        self.assertEqual(len(st), 0)
+        self.assertEqual(st.pending_removals(), 0)
+        st.add("/a", "/b")
+        st.destroy("/b")
+        self.assertEqual(len(st), 0)
+
+    def test_storage_removal_queue_subtree(self):
+        # Like removing /s/a/x, and then moving /s/a.
+        st = RedirectionStorage()
+        st.enable_removal_queue()
+        st.add("/s/old", "/s/a/x/doc")
+        st.add("/s/other", "/s/a/y")
+        st.destroy_subtree("/s/a/x")
+        st.add_subtree("/s/a", "/s/b")
+        self.assertEqual(st.pending_removals(), 0)
+        self.assertIsNone(st.get("/s/old"))
+        self.assertEqual(st.get("/s/other"), "/s/b/y")
+
+    def test_storage_concurrent_changes(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        db = DB(FileStorage(os.path.join(tmpdir.name, "Data.fs")))
+        self.addCleanup(db.close)
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        conn2 = db.open(transaction_manager=tm2)
+        self.addCleanup(conn1.close)
+        self.addCleanup(conn2.close)
+        st = RedirectionStorage()
+        st.enable_interning()
+        st.add("/plone/a/b", "/plone/a/c")
+        # Like a storage from before subtree redirects.
+        st._subtrees = st._rsubtrees = None
+        conn1.root()["st"] = st
+        tm1.commit()
+
+        def concurrently(change1, change2):
+            tm1.begin()
+            tm2.begin()
+            change1(conn1.root()["st"])
+            change2(conn2.root()["st"])
+            tm1.commit()
+            tm2.commit()
+
+        # Moves in new folders of different sections.
+        concurrently(
+            lambda st: st.add("/plone/a/d/e", "/plone/a/f/e"),
+            lambda st: st.add("/plone/g/h/i", "/plone/g/j/i"),
+        )
+        # Redirects to the same path.
+        concurrently(
+            lambda st: st.add("/plone/a/k", "/plone/a/c"),
+            lambda st: st.add("/plone/g/k", "/plone/a/c"),
+        )
+        # Changing different attributes of the storage itself.
+        concurrently(
+            lambda st: st.add_subtree("/plone/a/l", "/plone/a/m"),
+            lambda st: st.enable_removal_queue(),
+        )
+        st = conn1.root()["st"]
+        self.assertEqual(len(st), 5)
+        self.assertEqual(st.get("/plone/a/d/e"), "/plone/a/f/e")
+        self.assertEqual(st.get("/plone/g/h/i"), "/plone/g/j/i")
+        self.assertEqual(len(st.redirects("/plone/a/c")), 3)
+        self.assertListEqual(st.subtrees(), [("/plone/a/l", "/plone/a/m")])
+        self.assertEqual(st.pending_removals(), 0)
+
+        # Changing the same attribute still conflicts.
+        with self.assertRaises(ConflictError):
+            concurrently(
+                lambda st: st.enable_bloom_filter(),
+                lambda st: st.enable_bloom_filter(),
+            )
+        tm2.abort()
+        # Creating the same tree too.
+        with self.assertRaises(ConflictError):
+            concurrently(
+                lambda st: st.enable_hit_tracking(),
+                lambda st: st.enable_hit_tracking(),
+            )
+        tm2.abort()
+        # Options that fill their trees from the others conflict with any
+        # change, even when they set different attributes: the date index
+        # would get other keys than _paths.
+        with self.assertRaises(ConflictError):
+            concurrently(
+                lambda st: st.enable_date_index(),
+                lambda st: st.disable_interning(),
+            )
+        tm2.abort()
+        with self.assertRaises(ConflictError):
+            concurrently(
+                lambda st: st.add_rule("/plone/x/*", "/plone/y", "glob"),
+                lambda st: st.disable_interning(),
+            )
+        tm2.abort()
+        st = conn1.root()["st"]
+        self.assertIsNotNone(st._prefixes)
+        self.assertEqual(len(list(st.items_by_date())), len(st))
+
+    def test_storage_lazy_chains(self):
+        st = RedirectionStorage()
+        st.add("/a", "/b")
+        st.enable_lazy_chains()
+        st.add("/c", "/b")
+        # Moving /b only stores the new hop.
+        time1 = DateTime()
+        st.add("/b", "/d", now=time1, manual=True)
+        self.assertEqual(st._paths["/a"][0], "/b")
+        self.assertEqual(st.get("/a"), "/d")
+        self.assertEqual(st.get("/c/"), "/d")
+        self.assertEqual(st.get_full("/b"), ("/d", time1, True))
+        st.add("/d", "/e")
+        self.assertEqual(st.get("/a"), "/e")
+        self.assertEqual(len(st), 4)
+        self.assertListEqual(st.redirects("/e"), ["/d", "/b", "/a", "/c"])
+        self.assertEqual(st.count_redirects("/e"), 4)
+        self.assertListEqual(st.redirects("/d"), [])
+        self.assertListEqual(list(st._hops), ["/b", "/d"])
+        rows = list(st.export_rows())
+        self.assertListEqual([row[1] for row in rows], ["/e"] * 4)
+
+        # Moving content to a path with a redirect removes that redirect,
+        # keeping the redirects through it.
+        st.add("/f", "/d")
+        self.assertEqual(st.get("/f"), "/d")
+        self.assertIsNone(st.get("/d"))
+        self.assertEqual(st.get("/a"), "/e")
+        # Also when that would make a loop.
+        st.add("/e", "/a")
+        self.assertIsNone(st.get("/a"))
+        self.assertEqual(st.get("/b"), "/a")
+        self.assertEqual(st.get("/e"), "/a")
+        self.assertEqual(len(st), 4)
+
+        # A manual redirect to a redirect is chained.
+        st.add("/g", "/e", manual=True)
+        self.assertEqual(st.get("/g"), "/a")
+        self.assertIn("/e", st)
+        # Removing a hop keeps the redirects through it.
+        st.remove("/e")
+        self.assertEqual(st.get("/g"), "/a")
+
+        # Destroying the end of a chain removes the whole chain.
+        st.destroy("/a")
+        self.assertEqual(len(st), 1)
+        self.assertListEqual(list(st), ["/f"])
+        self.assertListEqual(list(st._rpaths), ["/d"])
+
+    def test_storage_lazy_chains_compact(self):
+        st = RedirectionStorage()
+        st.enable_lazy_chains()
+        st.update({"/a": "/b", "/c": "/b"})
+        st.update({"/b": "/d"})
+        st.add("/d", "/e")
+        st.add("/e", "/f")
+        self.assertEqual(st.compact_chains(limit=2), 2)
+        self.assertEqual(st.get("/a"), "/f")
+        self.assertEqual(st.compact_chains(), 1)
+        self.assertEqual(st.compact_chains(), 0)
+        for old_path in ("/a", "/b", "/c", "/d", "/e"):
+            self.assertEqual(st._paths[old_path][0], "/f")
+        self.assertListEqual(list(st._rpaths), ["/f"])
+
+        # Disabling compacts the chains.
+        st.add("/f", "/g")
+        st.disable_lazy_chains()
+        self.assertEqual(st._paths["/a"][0], "/g")
+        st.add("/g", "/h")
+        self.assertEqual(st._paths["/a"][0], "/h")
+        self.assertIsNone(st._hops)
+
+    def test_storage_lazy_chains_loop(self):
+        st = RedirectionStorage()
+        st.enable_lazy_chains()
+        st.add("/a", "/b")
+        st.add("/b", "/c")
+        # A loop that we do not create ourselves.
+        st._paths["/c"] = st._full_value("/a")
+        self.assertIsNone(st.get("/a"))
+        self.assertNotIn("/a", st)
+        # Long chains are only followed up to MAX_HOPS.
+        st = RedirectionStorage()
+        st.enable_lazy_chains()
+        for i in range(100):
+            st.add(f"/{i}", f"/{i + 1}")
+        self.assertEqual(st.get("/0"), "/51")
+        st.compact_chains()
+        self.assertEqual(st.get("/0"), "/100")
+
+    def test_storage_lazy_chains_removal_queue(self):
+        # The queue gives the same lookups as destroying directly.
+        def check(*changes):
+            storages = []
+            for queue, bulk in ((False, False), (True, False), (True, True)):
+                st = RedirectionStorage()
+                st.enable_lazy_chains()
+                if queue:
+                    st.enable_removal_queue()
+                for change in changes:
+                    if len(change) == 1:
+                        st.destroy(change[0])
+                    elif bulk:
+                        st.update({change[0]: change[1]}, manual=change[2])
+                    else:
+                        st.add(change[0], change[1], manual=change[2])
+                storages.append(st)
+            paths = {p for change in changes for p in change[:2]}
+            for st in storages[1:]:
+                for p in paths:
+                    self.assertEqual(st.get(p), storages[0].get(p), p)
+            return storages[1]
+
+        # The end of the chain from the old path is queued.
+        st = check(
+            ("/p0", "/p2", True), ("/p2", "/p6", False), ("/p6",), ("/p2", "/p5", True)
+        )
+        self.assertIsNone(st.get("/p0"))
+        self.assertEqual(st.get("/p2"), "/p5")
+        # The end of the chain from the new path is queued.
+        st = check(("/p2", "/p7", False), ("/p7",), ("/p4", "/p2", True))
+        self.assertEqual(st.get("/p4"), "/p2")
+        check(
+            ("/p1", "/p5", False),
+            ("/p5", "/p2", False),
+            ("/p2",),
+            ("/p5", "/p7", False),
+        )
+
     def test_rebuild(self):
         # Rebuild the internal information.
         # This is mostly meant to be used in migration
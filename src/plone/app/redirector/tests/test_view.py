@@ -1,3 +1,6 @@
+from plone.app.redirector.cache import lookup_cache
+from plone.app.redirector.cache import parent_cache
+from plone.app.redirector.hits import hit_buffer
 from plone.app.redirector.interfaces import IRedirectionStorage
 from plone.app.redirector.testing import PLONE_APP_REDIRECTOR_INTEGRATION_TESTING
 from plone.app.testing import setRoles
@@ -22,6 +25,8 @@ class TestRedirectorView(unittest.TestCase):
         self.portal.invokeFactory("Folder", "folder")
         self.folder = self.portal.folder
         self.storage = getUtility(IRedirectionStorage)
+        parent_cache.clear()
+        self.addCleanup(parent_cache.clear)
 
     def view(self, context, actual_url, query_string=""):
         self.request["ACTUAL_URL"] = actual_url
@@ -57,6 +62,60 @@ class TestRedirectorView(unittest.TestCase):
             fu + "/bar/@@view/part", self.request.response.getHeader("location")
         )
 
+    def test_attempt_redirect_with_subtree(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.add_subtree(fp + "/foo", fp + "/bar")
+        self.storage.add_subtree(fp + "/foo/baz", fp + "/qux")
+        view = self.view(self.portal, fu + "/foo/a/b")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(302, self.request.response.getStatus())
+        self.assertEqual(fu + "/bar/a/b", self.request.response.getHeader("location"))
+        # The longest prefix wins.
+        view = self.view(self.portal, fu + "/foo/baz/c")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(fu + "/qux/c", self.request.response.getHeader("location"))
+        # The prefix itself is not redirected.
+        view = self.view(self.portal, fu + "/foo")
+        self.assertEqual(False, view.attempt_redirect())
+
+    def test_attempt_redirect_with_ancestor(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.add(fp + "/foo", fp + "/bar")
+        view = self.view(self.portal, fu + "/foo/a/b/c")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(302, self.request.response.getStatus())
+        self.assertEqual(fu + "/bar/a/b/c", self.request.response.getHeader("location"))
+
+    def test_attempt_redirect_with_ancestor_below_itself(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.add(fp + "/news", fp + "/news/archive")
+        view = self.view(self.portal, fu + "/news/a/b")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(
+            fu + "/news/archive/a/b", self.request.response.getHeader("location")
+        )
+        # Not a loop.
+        view = self.view(self.portal, fu + "/news/archive/a/b")
+        self.assertEqual(False, view.attempt_redirect())
+
+    def test_attempt_redirect_with_rule(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.add_rule(fp + "/blog/(\\d{4})/(.*)", fp + "/news/\\1/\\2", "regex")
+        self.storage.add(fp + "/blog/2020/a", fp + "/b")
+        view = self.view(self.portal, fu + "/blog/2020/c/d")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(
+            fu + "/news/2020/c/d", self.request.response.getHeader("location")
+        )
+        # Redirects win.
+        view = self.view(self.portal, fu + "/blog/2020/a")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(fu + "/b", self.request.response.getHeader("location"))
+
     def test_attempt_redirect_with_unknown_url(self):
         fu = self.folder.absolute_url()
         view = self.view(self.portal, fu + "/foo")
@@ -112,6 +171,60 @@ class TestRedirectorView(unittest.TestCase):
             self.request.response.getHeader("location"),
         )
 
+    def test_attempt_redirect_uses_cache(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        lookup_cache.clear()
+        view = self.view(self.portal, fu + "/foo")
+        self.assertEqual(False, view.attempt_redirect())
+        # The negative outcome is cached.
+        self.assertEqual(len(lookup_cache), 1)
+        self.assertEqual(False, view.attempt_redirect())
+        self.assertEqual(len(lookup_cache), 1)
+        # A change in the storage is seen immediately.
+        self.storage.add(fp + "/foo", fp + "/bar")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(fu + "/bar", self.request.response.getHeader("location"))
+        lookup_cache.clear()
+
+    def test_attempt_redirect_counts_hits(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.add(fp + "/foo", fp + "/bar")
+        hit_buffer.drain()
+        # Only when the storage tracks hits.
+        self.assertEqual(True, self.view(self.portal, fu + "/foo").attempt_redirect())
+        self.assertEqual(len(hit_buffer), 0)
+        self.storage.enable_hit_tracking()
+        self.assertEqual(True, self.view(self.portal, fu + "/foo").attempt_redirect())
+        view = self.view(self.portal, fu + "/foo/@@images/image")
+        self.assertEqual(True, view.attempt_redirect())
+        view = self.view(self.portal, fu + "/foo/view")
+        self.assertEqual(True, view.attempt_redirect())
+        self.assertEqual(False, self.view(self.portal, fu + "/baz").attempt_redirect())
+        hits = hit_buffer.drain()
+        self.assertListEqual(list(hits), [fp + "/foo"])
+        self.assertEqual(hits[fp + "/foo"][0], 3)
+
+    def test_attempt_redirect_counts_hits_per_source(self):
+        fp = "/".join(self.folder.getPhysicalPath())
+        fu = self.folder.absolute_url()
+        self.storage.enable_hit_tracking()
+        self.storage.add_rule(fp + "/blog", fp + "/news")
+        self.storage.add_subtree(fp + "/old", fp + "/new")
+        self.storage.add(fp + "/foo", fp + "/bar")
+        hit_buffer.drain()
+        # Crawlers try many paths, which would each get a hit otherwise.
+        for i in range(5):
+            for name in ("blog", "old", "foo"):
+                url = f"{fu}/{name}/page{i}"
+                self.assertEqual(True, self.view(self.portal, url).attempt_redirect())
+        hits = hit_buffer.drain()
+        self.assertListEqual(sorted(hits), [fp + "/blog", fp + "/foo", fp + "/old"])
+        self.assertEqual(hits[fp + "/blog"][0], 5)
+        self.assertEqual(hits[fp + "/old"][0], 5)
+        self.assertEqual(hits[fp + "/foo"][0], 5)
+
     def test_find_first_parent_found_leaf(self):
         self.folder.invokeFactory("Folder", "f1")
         fu = self.folder.absolute_url()
@@ -130,6 +243,32 @@ class TestRedirectorView(unittest.TestCase):
         view = self.view(self.portal, "/foo/f1/p1/p2")
         self.assertEqual(None, view.find_first_parent())
 
+    def test_find_first_parent_uses_cache(self):
+        self.folder.invokeFactory("Folder", "f1")
+        fu = self.folder.absolute_url()
+        view = self.view(self.portal, fu + "/f1/p1/p2/p3")
+        self.assertEqual(fu + "/f1", view.find_first_parent().absolute_url())
+        # The paths we tried, up to the parent itself.
+        self.assertEqual(len(parent_cache), 3)
+        view = self.view(self.portal, fu + "/f1/p1/p2/p4")
+        self.assertEqual(fu + "/f1", view.find_first_parent().absolute_url())
+        self.assertEqual(len(parent_cache), 3)
+        # Removing content clears the cache.
+        self.folder.manage_delObjects(["f1"])
+        self.assertEqual(len(parent_cache), 0)
+        view = self.view(self.portal, fu + "/f1/p1/p2/p4")
+        self.assertEqual(fu, view.find_first_parent().absolute_url())
+
+    def test_find_first_parent_cached_parent_gone(self):
+        self.folder.invokeFactory("Folder", "f1")
+        fu = self.folder.absolute_url()
+        view = self.view(self.portal, fu + "/f1/p1")
+        self.assertEqual(fu + "/f1", view.find_first_parent().absolute_url())
+        # Like a removal in another process.
+        self.folder._delObject("f1", suppress_events=True)
+        view = self.view(self.portal, fu + "/f1/p1")
+        self.assertEqual(fu, view.find_first_parent().absolute_url())
+
     def test_search_leaf(self):
         self.folder.invokeFactory("Folder", "f1")
         self.folder.invokeFactory("Folder", "f2")